@@ -0,0 +1,758 @@
+"""
+    Micro benchmarks for the PeoplesChain node.
+
+    Usage: python benchmark.py <name> [options]
+
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep, time
+
+from block import Block
+from blockchain import ACCEPTED, Blockchain
+from consensus import HashTargetRule, LegacyRule
+from miner import Miner
+from profile import Profile
+from transaction import Transaction
+
+
+def timed(function, *args):
+    """ Run function(*args) and return (result, elapsed seconds). """
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+
+def report(label, seconds, operations):
+    per_op = seconds / operations if operations else 0
+    print("{:<40} {:>10} ops {:>12.3f} s {:>14.2f} us/op".format(label, operations, seconds, per_op * 1e6))
+
+
+def bench_registry(args):
+    """ Profile lookup and edit latency: list scan (old) against the address index. """
+
+    addresses = ["{:032x}".format(i) for i in range(args.users)]
+    samples = [random.choice(addresses) for _ in range(args.lookups)]
+
+    users = [Profile(address) for address in addresses]
+
+    def scan_lookup():
+        for address in samples:
+            for user in users:
+                if user.address == address:
+                    break
+
+    def scan_edit():
+        for address in samples:
+            for user in users:
+                if user.address == address:
+                    user.balance -= 1
+                    user.edit_name("bench")
+                    Transaction(user.address, {"name": "bench"}, 1, "Network")
+                    break
+
+    chain = Blockchain()
+    _, elapsed = timed(lambda: [chain.add_user(user) for user in users])
+    report("register (address index)", elapsed, len(users))
+
+    def index_lookup():
+        for address in samples:
+            chain.get_user(address)
+
+    def index_edit():
+        for address in samples:
+            user = chain.get_user(address)
+            user.balance -= 1
+            user.edit_name("bench")
+            chain.push_unconfirmed_transaction(Transaction(user.address, {"name": "bench"}, 1, "Network"))
+
+    _, elapsed = timed(scan_lookup)
+    report("lookup (list scan)", elapsed, len(samples))
+    _, elapsed = timed(index_lookup)
+    report("lookup (address index)", elapsed, len(samples))
+    _, elapsed = timed(scan_edit)
+    report("edit (list scan)", elapsed, len(samples))
+    _, elapsed = timed(index_edit)
+    report("edit (address index)", elapsed, len(samples))
+
+
+def bench_mining(args):
+    """ Proof of work candidates per second: the old print-per-candidate loop against the Miner. """
+
+    # No proof p' with p' % 9 == 0 divides this, so every candidate up to the limit is checked
+    last_proof = 10 ** 12 + 1
+    candidates = args.candidates
+
+    def legacy_proof_of_work():
+        proof = 1
+        while proof < candidates:
+            print ("Trying proof: {}".format(proof))
+            if last_proof % proof == 0 and proof % 9 == 0:
+                return proof
+            proof += 1
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, elapsed = timed(legacy_proof_of_work)
+    report("legacy loop", elapsed, candidates)
+
+    for workers in sorted(set([1, args.workers])):
+        miner = Miner(workers=workers, max_nonce=candidates)
+        miner.start_pool()
+        _, elapsed = timed(miner.mine, LegacyRule(), last_proof)
+        report("miner, {} worker(s)".format(workers), elapsed, miner.last_job["candidates"])
+        miner.close()
+
+
+def bench_consensus(args):
+    """ Mining and verification throughput of each proof rule. """
+
+    template = Block(1, [Transaction("bench", {"message": "x" * 64}, 1, "Network") for _ in range(10)], 0, "0" * 64)
+    # Challenges no candidate satisfies, so exactly args.candidates candidates are checked
+    rules = [
+        (LegacyRule(), 10 ** 12 + 1, 2 ** 18),
+        (HashTargetRule(), template.proof_template() + (0,), 2 ** 248),
+    ]
+
+    for rule, impossible, easy_target in rules:
+        _, elapsed = timed(rule.search, impossible, 1, args.candidates)
+        report("{} mining".format(rule.name), elapsed, args.candidates)
+
+        if isinstance(rule, HashTargetRule):
+            rule = HashTargetRule(initial_target=easy_target, retarget_interval=50)
+        chain = Blockchain(rule=rule)
+        for index in range(1, args.blocks or 1000):
+            last_block = chain.last_block
+            # Senders take turns, each spends far less than its initial balance
+            transactions = [Transaction("bench{}".format(index % 1000), {"n": index}, 1, "Network", last_block.timestamp + 1)]
+            block = Block(index, transactions, 0, last_block.hash, last_block.timestamp + 10)
+            challenge = rule.challenge(chain.blocks, block)
+            proof = rule.search(challenge, 1, rule.nonce_limit(challenge, 2 ** 24))
+            assert chain.add_block(Block(index, block.transactions, proof, last_block.hash, block.timestamp))
+
+        def verify_all():
+            for block in chain.blocks:
+                block.calculate_block_hash()
+                assert rule.verify(chain.blocks, block)
+
+        _, elapsed = timed(verify_all)
+        report("{} verify (hash + rule)".format(rule.name), elapsed, len(chain.blocks))
+
+
+def synthetic_chain(length, rule=None, store=None):
+    """ A valid chain of length blocks with one transfer each, mined with the legacy rule. """
+
+    chain = Blockchain(rule=rule, store=store)
+    for index in range(1, length):
+        last_block = chain.last_block
+        transactions = [Transaction("user{}".format(index % 1000), {"n": index}, 1, "Network", last_block.timestamp + 1)]
+        assert chain.add_block(Block(index, transactions, 9, last_block.hash, last_block.timestamp + 10))
+    return chain
+
+
+def bench_validation(args):
+    """ Blocks per second validated: one by one against the tip, and by parallel height ranges. """
+
+    chain = synthetic_chain(args.blocks or 100000)
+    block_dicts = [block.to_dict() for block in chain.blocks]
+    genesis = chain.blocks[0]
+
+    def sequential():
+        fresh = Blockchain(blocks=[genesis])
+        for block_dict in block_dicts[1:]:
+            assert fresh.add_block(Block.from_dict(block_dict))
+
+    def parallel():
+        fresh = Blockchain(blocks=[genesis])
+        for block in fresh.check_blocks(block_dicts[1:], workers=args.workers):
+            assert fresh.add_block(block)
+
+    _, elapsed = timed(sequential)
+    report("decode + validate, one by one", elapsed, len(block_dicts))
+    _, elapsed = timed(parallel)
+    report("decode + validate, {} workers".format(args.workers), elapsed, len(block_dicts))
+    valid, elapsed = timed(chain.validate_chain, args.workers)
+    assert valid
+    report("validate_chain, {} workers".format(args.workers), elapsed, len(block_dicts))
+
+
+def legacy_transaction_json(transaction):
+    """ The JSON a transaction was hashed and sent as before the binary encoding. """
+    return json.dumps({
+        "handle": transaction.handle,
+        "data": transaction.data,
+        "amount": transaction.amount,
+        "time": transaction.timestamp,
+        "destination": transaction.destination or 0,
+    }, sort_keys=True)
+
+
+def legacy_block_json(block):
+    return json.dumps({
+        "index": block.index,
+        "previous_hash": block.previous_hash,
+        "proof": block.proof,
+        "timestamp": block.timestamp,
+        "transactions": [legacy_transaction_json(transaction) for transaction in block.transactions],
+    }, sort_keys=True)
+
+
+def bench_serialization(args):
+    """ Encode, decode and hash throughput of blocks: the old JSON format against the binary one. """
+
+    chain = synthetic_chain(args.blocks or 20000)
+    blocks = list(chain.blocks)
+
+    def json_encode():
+        return [legacy_block_json(block).encode('utf-8') for block in blocks]
+
+    def json_decode(payloads):
+        for payload in payloads:
+            block_dict = json.loads(payload)
+            block_dict["transactions"] = [json.loads(transaction) for transaction in block_dict["transactions"]]
+
+    def json_hash():
+        for block in blocks:
+            for transaction in block.transactions:
+                hashlib.sha256(legacy_transaction_json(transaction).encode('utf-8'))
+            hashlib.sha256(legacy_block_json(block).encode('utf-8'))
+
+    def binary_encode():
+        return [block.encode() for block in blocks]
+
+    def binary_decode(payloads):
+        for payload in payloads:
+            Block.from_bytes(payload)
+
+    def binary_hash():
+        for block in blocks:
+            for transaction in block.transactions:
+                transaction.calculate_tx_id()
+            block.calculate_block_hash()
+
+    json_payloads, elapsed = timed(json_encode)
+    report("encode (json)", elapsed, len(blocks))
+    binary_payloads, elapsed = timed(binary_encode)
+    report("encode (binary)", elapsed, len(blocks))
+    _, elapsed = timed(json_decode, json_payloads)
+    report("decode (json)", elapsed, len(blocks))
+    # Rebuilding a block from bytes also hashes it and its transactions
+    _, elapsed = timed(binary_decode, binary_payloads)
+    report("decode + hash (binary)", elapsed, len(blocks))
+    _, elapsed = timed(json_hash)
+    report("hash block + transactions (json)", elapsed, len(blocks))
+    _, elapsed = timed(binary_hash)
+    report("hash block + transactions (binary)", elapsed, len(blocks))
+    print("bytes per block: json {:.0f}, binary {:.0f}".format(
+        sum(map(len, json_payloads)) / len(blocks), sum(map(len, binary_payloads)) / len(blocks)
+    ))
+
+
+class DictTransaction:
+    """ The transaction model before slots: a plain object with a __dict__. """
+
+    def __init__(self, handle, data, amount, destination, timestamp):
+        self.handle = handle
+        self.data = data
+        self.amount = amount
+        self.timestamp = timestamp
+        self.destination = destination
+        self.tx_id = hashlib.sha256(legacy_transaction_json(self).encode('utf-8')).hexdigest()
+
+
+class DictBlock:
+    """ The block model before slots. """
+
+    def __init__(self, index, transactions, proof, previous_hash, timestamp):
+        self.index = index
+        self.transactions = transactions
+        self.timestamp = timestamp
+        self.proof = proof
+        self.previous_hash = previous_hash
+        self.hash = hashlib.sha256(legacy_block_json(self).encode('utf-8')).hexdigest()
+
+
+def traced_size(build):
+    """ Bytes still allocated by build() when it returns, and its result. """
+
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size, result
+
+
+def bench_memory(args):
+    """ Bytes per transaction and per block of an in-memory chain: __dict__ objects against slots. """
+
+    per_block = 100
+    block_count = max(args.transactions // per_block, 1)
+
+    def build(transaction_class, block_class):
+        blocks = []
+        previous_hash = "0" * 64
+        for index in range(block_count):
+            transactions = [
+                transaction_class("user{}".format(n % 1000), {"n": n}, 1, "Network", float(n))
+                for n in range(index * per_block, (index + 1) * per_block)
+            ]
+            block = block_class(index, transactions, index, previous_hash, float(index))
+            previous_hash = block.hash
+            blocks.append(block)
+        return blocks
+
+    for label, transaction_class, block_class in (
+        ("__dict__", DictTransaction, DictBlock),
+        ("slots", Transaction, Block),
+    ):
+        transaction_size, _ = traced_size(lambda: [
+            transaction_class("user{}".format(n % 1000), {"n": n}, 1, "Network", float(n))
+            for n in range(per_block * 100)
+        ])
+        chain_size, _ = traced_size(lambda: build(transaction_class, block_class))
+        transaction_bytes = transaction_size / (per_block * 100)
+        block_bytes = (chain_size - transaction_bytes * block_count * per_block) / block_count
+        print("{:<10} {:>10.0f} bytes/transaction {:>10.0f} bytes/block (+ transactions) {:>8.1f} MB for {} transactions".format(
+            label, transaction_bytes, block_bytes, chain_size / 2 ** 20, block_count * per_block
+        ))
+
+
+def bench_batch(args):
+    """ Accepted transactions per second through the /tx/batch path: decode, verify signatures, insert. """
+
+    try:
+        import pyelliptic
+        from signatures import CURVE, SignatureVerifier, address_of, decode_lines, sign_transaction
+    except (ImportError, AttributeError) as error:
+        print("The batch benchmark needs pyelliptic with ECC support: {}".format(error))
+        return
+
+    keys = [pyelliptic.ECC(curve=CURVE) for _ in range(100)]
+    lines = []
+    for n in range(args.batch_size * args.batches):
+        key = keys[n % len(keys)]
+        transaction = Transaction(address_of(key.get_pubkey()), {"n": n}, 0, "Network")
+        lines.append(json.dumps({
+            "transaction": transaction.to_dict(),
+            "public_key": key.get_pubkey().hex(),
+            "signature": sign_transaction(key, transaction).hex(),
+        }))
+    batches = [
+        "\n".join(lines[start:start + args.batch_size]).encode('utf-8')
+        for start in range(0, len(lines), args.batch_size)
+    ]
+
+    verifier = SignatureVerifier(args.workers)
+    verifier.start_pool()
+    chain = Blockchain(mempool_size=len(lines))
+
+    def submit():
+        accepted = 0
+        for batch in batches:
+            records = decode_lines(batch)
+            valid = verifier.verify(records)
+            signed = [transaction for ok, (transaction, _, _) in zip(valid, records) if ok]
+            accepted += chain.submit_transactions(signed).count(ACCEPTED)
+        return accepted
+
+    accepted, elapsed = timed(submit)
+    verifier.close()
+    report("batch submit, {} workers".format(args.workers), elapsed, accepted)
+    print("{:.0f} accepted transactions/s".format(accepted / elapsed))
+
+
+def bench_gossip(args):
+    """
+        Block and transaction propagation through inventory gossip, in a simulated network of
+        Nodes served by one reactor, each on its own loopback address.
+    """
+
+    from twisted.internet import defer, reactor, task
+
+    from peopleschain import Node
+    from signatures import address_of, new_key, sign_transaction
+
+    genesis = Blockchain().blocks[0]
+    addresses = ["127.0.0.{}".format(2 + index) for index in range(args.nodes or 32)]
+    nodes = []
+    for address in addresses:
+        seeds = random.sample([other for other in addresses if other != address], min(args.degree, len(addresses) - 1))
+        node = Node(address, Blockchain(blocks=[genesis]), seeds=seeds, own_address=address, serve=False)
+        reactor.listenTCP(node.port, node.site(), interface=address)
+        nodes.append(node)
+    # Links work both ways
+    for node in nodes:
+        for seed in node.peers.snapshot():
+            nodes[addresses.index(seed)].peers.add(node.my_node())
+
+    def traffic():
+        return sum(
+            stats.bytes_sent + stats.bytes_received
+            for node in nodes for stats in node.peer_client.stats.values()
+        )
+
+    @defer.inlineCallbacks
+    def propagate(label, start, arrived, items):
+        """ Run start() on the first node, then wait until arrived(node) holds on every node. """
+
+        bytes_before = traffic()
+        started = perf_counter()
+        arrivals = {}
+        start(nodes[0])
+        while len(arrivals) < len(nodes) and perf_counter() - started < args.timeout:
+            for index, node in enumerate(nodes):
+                if index not in arrivals and arrived(node):
+                    arrivals[index] = perf_counter() - started
+            yield task.deferLater(reactor, 0.001, lambda: None)
+
+        times = sorted(arrivals.values())
+        print("{:<14} reached {}/{} nodes, p50 {:.1f} ms, p99 {:.1f} ms, {} bytes ({:.0f} per item per node)".format(
+            label, len(times), len(nodes),
+            times[len(times) // 2] * 1000 if times else 0,
+            times[int(len(times) * 0.99)] * 1000 if times else 0,
+            traffic() - bytes_before, (traffic() - bytes_before) / (items * len(nodes)),
+        ))
+
+    @defer.inlineCallbacks
+    def simulate():
+        try:
+            block = Block(1, [Transaction("Network", {"message": "Block reward"}, 200, "miner", genesis.timestamp + 1)], 9, genesis.hash, genesis.timestamp + 10)
+
+            def mine(node):
+                node.Peopleschain.accept_block(block)
+                node.broadcast_block(block)
+
+            yield propagate("block", mine, lambda node: node.Peopleschain.last_block.hash == block.hash, 1)
+            print("{:<14} {} bytes to send the block body to every node".format("full push", len(block.to_bytes()) * (len(nodes) - 1)))
+
+            # Relayed transactions must be signed by the key owning their sender address
+            keys = [new_key() for _ in range(min(args.items, 100))]
+            transactions = []
+            signatures = []
+            for n in range(args.items):
+                key = keys[n % len(keys)]
+                transaction = Transaction(address_of(key.get_pubkey()), {"n": n}, 0, "Network")
+                transactions.append(transaction)
+                signatures.append((key.get_pubkey(), sign_transaction(key, transaction)))
+
+            def submit(node):
+                node.Peopleschain.submit_transactions(transactions, signatures)
+                node.broadcast_transactions(transactions)
+
+            yield propagate(
+                "transactions", submit,
+                lambda node: all(transaction.tx_id in node.Peopleschain.unconfimed_transaction for transaction in transactions),
+                len(transactions)
+            )
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(simulate)
+    reactor.run()
+
+
+def bench_compression(args):
+    """
+        Bytes on the wire and CPU cost of the negotiated compression, per encoding and level,
+        for the answers peers exchange most: /chain as JSON, /blocks as binary records and
+        transaction announcements. Each answer is one stream; compressing its items one by
+        one shows what framing them into a single body saves.
+    """
+
+    import serialization
+    from compression import compress, decompress, ENCODINGS
+    from peopleschain import Node
+
+    chain = synthetic_chain(args.blocks or 2000)
+    blocks = list(chain.blocks)
+    chain_items = [json.dumps(Node.block_json(block)).encode('utf-8') for block in blocks]
+    block_items = [block.to_bytes() for block in blocks]
+    tx_ids = [transaction.tx_id for block in blocks for transaction in block.transactions]
+    inventory_items = [json.dumps({"sender": "127.0.0.1", "blocks": [], "transactions": [tx_id]}).encode('utf-8') for tx_id in tx_ids]
+    payloads = [
+        ("/chain json", chain_items, b'{"Blocks": {' + b', '.join(chain_items) + b'}}'),
+        ("/blocks binary", block_items, serialization.encode_records(block_items)),
+        ("/inv", inventory_items, json.dumps({"sender": "127.0.0.1", "blocks": [], "transactions": tx_ids}).encode('utf-8')),
+    ]
+
+    print("{:<16} {:<8} {:>5} {:>12} {:>7} {:>12} {:>12} {:>12}".format(
+        "payload", "encoding", "level", "bytes", "ratio", "compress", "decompress", "per item"
+    ))
+    for label, items, body in payloads:
+        megabytes = len(body) / 2 ** 20
+        print("{:<16} {:<8} {:>5} {:>12}".format(label, "identity", "-", len(body)))
+        for encoding in ENCODINGS:
+            for level in (1, 3, 6, 9):
+                compressed, compress_time = timed(compress, body, encoding, level)
+                _, decompress_time = timed(decompress, compressed, encoding)
+                # The same items compressed one message at a time, as without batching
+                separate = sum(len(compress(item, encoding, level)) for item in items)
+                print("{:<16} {:<8} {:>5} {:>12} {:>6.1f}x {:>9.1f} ms/MB {:>9.1f} ms/MB {:>12}".format(
+                    label, encoding.decode('ascii'), level, len(compressed), len(body) / len(compressed),
+                    compress_time * 1000 / megabytes, decompress_time * 1000 / megabytes, separate
+                ))
+
+
+def load(calls, concurrency):
+    """
+        Send HTTP requests from a pool of threads.
+
+        :param calls: <list> (method, url, keyword arguments of requests.request)
+        :return: <dict> Request rate and latency percentiles
+    """
+
+    import requests
+
+    sessions = threading.local()
+
+    def call(method, url, kwargs):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        started = perf_counter()
+        try:
+            success = sessions.session.request(method, url, timeout=60, **kwargs).status_code in (200, 304)
+        except requests.exceptions.RequestException:
+            success = False
+        return perf_counter() - started, success
+
+    started = perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda request: call(*request), calls))
+    elapsed = perf_counter() - started
+
+    latencies = sorted(seconds for seconds, success in results if success)
+    return {
+        "requests": len(results),
+        "errors": len(results) - len(latencies),
+        "seconds": elapsed,
+        "requests_per_second": len(results) / elapsed if elapsed else 0,
+        "p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+    }
+
+
+def bench_cluster(args):
+    """
+        Throughput and latency of the HTTP API on a local cluster of node processes, block
+        propagation between them and their memory. Results are written as JSON with --output.
+    """
+
+    import requests
+
+    from blockchain import GENESIS_TIMESTAMP
+    from cluster import Cluster
+
+    def print_load(label, result):
+        print("{:<14} {:>6} requests {:>4} errors {:>9.1f} req/s  p50 {:>8.1f} ms  p99 {:>8.1f} ms".format(
+            label, result["requests"], result["errors"], result["requests_per_second"],
+            result["p50_ms"] or 0, result["p99_ms"] or 0,
+        ))
+
+    def tip(node):
+        try:
+            return requests.get(node.url("/chain/tip"), timeout=5).json()["hash"]
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    def wait_for_tip(nodes, block_hash):
+        """ Seconds until each node reports block_hash as its tip, by node address. """
+
+        started = perf_counter()
+        arrivals = {}
+        while len(arrivals) < len(nodes) and perf_counter() - started < args.timeout:
+            for node in nodes:
+                if node.address not in arrivals and tip(node) == block_hash:
+                    arrivals[node.address] = perf_counter() - started
+            sleep(0.005)
+        return arrivals
+
+    size = args.nodes or 4
+    block_count = args.blocks or 50
+    # The nodes build the same genesis block, the synthetic chain extends it
+    chain = synthetic_chain(block_count + args.samples + 1)
+    assert chain.blocks[0].timestamp == GENESIS_TIMESTAMP
+    new_blocks = chain.blocks[1:]
+
+    results = {
+        "benchmark": "cluster",
+        "time": time(),
+        "nodes": size,
+        "degree": args.degree,
+        "concurrency": args.concurrency,
+        "endpoints": {},
+    }
+    with Cluster(size, base_port=args.port, degree=args.degree) as cluster:
+        nodes = cluster.nodes
+        results["memory_start"] = cluster.memory()
+        addresses = ["{:032x}".format(random.getrandbits(128)) for _ in range(args.requests)]
+        owners = [nodes[n % len(nodes)] for n in range(len(addresses))]
+        for address, node in zip(addresses, owners):
+            requests.post(node.url("/user/add"), json={"address": address})
+
+        def run(label, calls, concurrency=args.concurrency):
+            result = load(calls, concurrency)
+            results["endpoints"][label] = result
+            print_load(label, result)
+
+        run("/view", [("GET", node.url("/view/{}".format(address)), {}) for address, node in zip(addresses, owners)])
+        run("/edit", [
+            ("POST", node.url("/edit/{}".format(address)), {"json": {"name": "bench"}})
+            for address, node in zip(addresses, owners)
+        ])
+        run("/chain", [("GET", nodes[n % len(nodes)].url("/chain"), {}) for n in range(args.requests)])
+        # Clients polling with the ETag of their copy, answered 304 while the chain is unchanged
+        etags = [requests.get(node.url("/chain")).headers.get("ETag", "") for node in nodes]
+        run("/chain 304", [
+            ("GET", nodes[n % len(nodes)].url("/chain"), {"headers": {"If-None-Match": etags[n % len(nodes)]}})
+            for n in range(args.requests)
+        ])
+
+        # Blocks must arrive in order, they are sent one at a time to the first node
+        binary = {"headers": {"Content-Type": "application/octet-stream"}}
+        run("/block/new", [
+            ("POST", nodes[0].url("/block/new"), dict(binary, data=block.to_bytes())) for block in new_blocks[:block_count]
+        ], concurrency=1)
+        arrivals = wait_for_tip(nodes, new_blocks[block_count - 1].hash)
+        print("{:<14} {}/{} nodes at the tip after {:.1f} ms".format(
+            "sync", len(arrivals), len(nodes), max(arrivals.values(), default=0) * 1000
+        ))
+
+        # Each sample block is sent to one node, the time is until every node has it
+        propagation = []
+        for n, block in enumerate(new_blocks[block_count:]):
+            requests.post(nodes[n % len(nodes)].url("/block/new"), data=block.to_bytes(), **binary)
+            arrivals = wait_for_tip(nodes, block.hash)
+            if len(arrivals) == len(nodes):
+                propagation.append(max(arrivals.values()))
+        propagation.sort()
+        results["propagation"] = {
+            "samples": args.samples,
+            "reached_all": len(propagation),
+            "p50_ms": propagation[len(propagation) // 2] * 1000 if propagation else None,
+            "p99_ms": propagation[int(len(propagation) * 0.99)] * 1000 if propagation else None,
+        }
+        print("{:<14} {}/{} blocks reached every node, p50 {:.1f} ms, p99 {:.1f} ms".format(
+            "propagation", len(propagation), args.samples,
+            results["propagation"]["p50_ms"] or 0, results["propagation"]["p99_ms"] or 0,
+        ))
+
+        # A node mines one block at a time, /mine is called once per node concurrently
+        run("/mine", [("GET", nodes[n % len(nodes)].url("/mine"), {}) for n in range(block_count)], concurrency=len(nodes))
+
+        results["memory_end"] = cluster.memory()
+        for address, rss in sorted(results["memory_end"].items()):
+            print("{:<14} {:>8.1f} MB resident".format(address, (rss or 0) / 2 ** 20))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print("Results written to {}".format(args.output))
+
+
+def bench_startup(args):
+    """
+        Startup of a new node against a peer holding a long chain: how long until it answers
+        requests, and until it reached the peer's tip. Both run as processes, see cluster.py
+    """
+
+    import tempfile
+
+    import requests
+
+    from blockstore import BlockStore
+    from cluster import ClusterNode
+
+    block_count = args.blocks or 100000
+    directory = tempfile.mkdtemp(prefix="peopleschain-startup-")
+    source = ClusterNode(0, args.port, os.path.join(directory, "node0"), [])
+    store = BlockStore(os.path.join(source.directory, "data", "blocks"))
+    chain, elapsed = timed(synthetic_chain, block_count, None, store)
+    store.close()
+    # Commits the chain index, the source node opens it next
+    chain.index.close()
+    print("{:<14} {} blocks stored in {:.1f} s".format("source", block_count, elapsed))
+
+    def height(node):
+        try:
+            return requests.get(node.url("/chain/tip"), timeout=1).json()["height"]
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    fresh = ClusterNode(1, args.port + 1, os.path.join(directory, "node1"), [source.address])
+    try:
+        source.start()
+        while height(source) is None:
+            sleep(0.1)
+
+        started = perf_counter()
+        fresh.start()
+        first_answer = None
+        current = None
+        while current != block_count - 1 and perf_counter() - started < args.timeout:
+            if fresh.process.poll() is not None:
+                raise RuntimeError("The new node exited, see {}".format(fresh.directory))
+            current = height(fresh)
+            if current is not None and first_answer is None:
+                first_answer = (perf_counter() - started, current)
+            sleep(0.05)
+        synced = perf_counter() - started if current == block_count - 1 else None
+
+        print("{:<14} {:.2f} s, at height {}".format("first answer", *first_answer) if first_answer else "never answered")
+        print("{:<14} {}".format("at the tip", "after {:.2f} s".format(synced) if synced else "not within the timeout"))
+        print("{:<14} {:.1f} MB resident".format("memory", (fresh.memory() or 0) / 2 ** 20))
+    finally:
+        fresh.stop()
+        source.stop()
+
+
+BENCHMARKS = {
+    "cluster": bench_cluster,
+    "startup": bench_startup,
+    "gossip": bench_gossip,
+    "compression": bench_compression,
+    "batch": bench_batch,
+    "memory": bench_memory,
+    "serialization": bench_serialization,
+    "validation": bench_validation,
+    "consensus": bench_consensus,
+    "registry": bench_registry,
+    "mining": bench_mining,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PeoplesChain benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--users", type=int, default=1000000, help="Number of registered profiles")
+    parser.add_argument("--lookups", type=int, default=200, help="Number of lookups/edits to time")
+    parser.add_argument("--candidates", type=int, default=2000000, help="Number of proof of work candidates")
+    parser.add_argument("--transactions", type=int, default=1000000, help="Number of transactions in the memory benchmark")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Transactions per /tx/batch request")
+    parser.add_argument("--batches", type=int, default=4, help="Number of /tx/batch requests")
+    parser.add_argument("--nodes", type=int, help="Number of nodes in simulated networks and clusters")
+    parser.add_argument("--degree", type=int, default=4, help="Number of peers each simulated node starts with")
+    parser.add_argument("--items", type=int, default=200, help="Number of transactions relayed in the gossip benchmark")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for propagation")
+    parser.add_argument("--blocks", type=int, help="Number of blocks in synthetic chains")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint in the cluster benchmark")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests in the cluster benchmark")
+    parser.add_argument("--samples", type=int, default=10, help="Blocks timed for propagation in the cluster benchmark")
+    parser.add_argument("--port", type=int, default=19100, help="Port of the first cluster node")
+    parser.add_argument("--output", help="File the cluster benchmark results are written to, as JSON")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Number of worker processes")
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.name](args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,47 +2,211 @@ import hashlib
 import json
 from time import time
 
+import merkle
+import serialization
+from transaction import Transaction
+
 class Block:
-    """ A Block holds a list of transaction. """
+    """
+        A Block holds a list of transaction. Blocks are immutable once created and use
+        slots; the encoded form is not kept, since the transactions already hold their bytes.
+    """
+
+    __slots__ = ('index', 'transactions', 'timestamp', 'proof', 'previous_hash', 'merkle_root', 'hash')
 
     def __init__(self, index, transactions, proof, previous_hash, timestamp=None):
         """
             :param index: <int> The index of the block
-            :param transactions: <list> List of transactions to be added to this block
+            :param transactions: <list> List of transactions to be added to this block, kept as a tuple
             :param proof: <int> The proof given by the proof of work algorithm
             :param previous_hash: <str> Hash of the previous block
 
         """
 
-        self.index = index
-        self.transactions = transactions
-        if timestamp is None:
-            self.timestamp = time()
-        else:
-            self.timestamp = timestamp
-        self.proof = proof
-        self.previous_hash = previous_hash
-        self.hash = self.calculate_block_hash()
+        set_field = object.__setattr__
+        set_field(self, 'index', index)
+        set_field(self, 'transactions', tuple(transactions))
+        set_field(self, 'timestamp', time() if timestamp is None else timestamp)
+        set_field(self, 'proof', proof)
+        set_field(self, 'previous_hash', previous_hash)
+        set_field(self, 'merkle_root', self.calculate_merkle_root())
+        set_field(self, 'hash', hashlib.sha256(self.encode_header(self.merkle_root)).hexdigest())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Block {} is immutable".format(self.hash))
+
+    def __delattr__(self, name):
+        raise AttributeError("Block {} is immutable".format(self.hash))
+
+    def __setstate__(self, state):
+        # Unpickling, e.g. results of the validation process pool
+        _, fields = state
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def calculate_merkle_root(self):
+        return merkle.merkle_root([transaction.tx_id for transaction in self.transactions]).hex()
 
     def calculate_block_hash(self):
+        """ Hash of the header, with the Merkle root recomputed from the transactions. """
+
+        hash_object = hashlib.sha256(self.encode_header(self.calculate_merkle_root()))
+        return hash_object.hexdigest()
+
+    def encode_header(self, merkle_root):
+        return serialization.BLOCK_HEADER.pack(
+            serialization.BLOCK_VERSION,
+            self.index,
+            serialization.pack_hash(self.previous_hash),
+            bytes.fromhex(merkle_root),
+            self.timestamp,
+            self.proof
+        )
+
+    def encode_body(self):
+        parts = [serialization.LENGTH.pack(len(self.transactions))]
+        for transaction in self.transactions:
+            transaction_bytes = transaction.to_bytes()
+            parts.append(serialization.LENGTH.pack(len(transaction_bytes)))
+            parts.append(transaction_bytes)
+        return b''.join(parts)
+
+    def encode(self):
+        """ Binary encoding of the block and its transactions, see serialization.py """
+        return self.encode_header(self.merkle_root) + self.encode_body()
+
+    @staticmethod
+    def hash_header(header):
+        """
+            Block hash from a header alone, without the transactions.
 
-        data_to_json = {
+            :param header: <dict> index, previous_hash, merkle_root, timestamp and proof,
+                as served by /headers
+            :return: <str> The hex block hash
+        """
+
+        header_bytes = serialization.BLOCK_HEADER.pack(
+            serialization.BLOCK_VERSION,
+            header["index"],
+            serialization.pack_hash(header["previous_hash"]),
+            bytes.fromhex(header["merkle_root"]),
+            header["timestamp"],
+            header["proof"]
+        )
+        return hashlib.sha256(header_bytes).hexdigest()
+
+    def header_dict(self):
+        return {
             "index": self.index,
-            "transactions": [transaction.toJSON() for transaction in self.transactions],
+            "hash": self.hash,
+            "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "timestamp": self.timestamp,
+            "proof": self.proof,
+        }
+
+    def merkle_branch(self, tx_id):
+        """
+            Proof that a transaction is part of this block.
+
+            :param tx_id: <str> Id of one of the block's transactions
+            :return: <list> Sibling hashes up to the Merkle root, None if tx_id is not in the block
+        """
+
+        tx_ids = [transaction.tx_id for transaction in self.transactions]
+        if tx_id not in tx_ids:
+            return None
+        return merkle.merkle_branch(tx_ids, tx_ids.index(tx_id))
+
+    def to_bytes(self):
+        return self.encode()
+
+    @classmethod
+    def from_bytes(cls, buffer, lazy=False):
+        """
+            Rebuild a block, and its transactions, from its binary encoding.
+
+            :param buffer: <bytes> Output of to_bytes
+            :param lazy: <bool> Keep the transactions encoded as received, see Transaction.from_bytes
+        """
+
+        serialization.check_version(buffer, serialization.BLOCK_VERSION)
+        _, index, previous_hash, merkle_root, timestamp, proof = serialization.BLOCK_HEADER.unpack_from(buffer)
+
+        offset = serialization.BLOCK_HEADER.size
+        transaction_count, = serialization.LENGTH.unpack_from(buffer, offset)
+        offset += serialization.LENGTH.size
+        transactions = []
+        for _ in range(transaction_count):
+            length, = serialization.LENGTH.unpack_from(buffer, offset)
+            offset += serialization.LENGTH.size
+            transactions.append(Transaction.from_bytes(buffer[offset:offset + length], lazy))
+            offset += length
+
+        block = cls(index, transactions, proof, serialization.unpack_hash(previous_hash), timestamp)
+        if block.merkle_root != merkle_root.hex():
+            raise serialization.SerializationError("Block {} does not match its Merkle root".format(index))
+        return block
+
+    def proof_template(self):
+        """
+            Split the header around the proof.
+
+            The block hash is sha256(prefix + encode_proof(proof) + suffix), which lets a miner
+            try many proofs without re-serializing the block.
+
+            :return: <tuple> (prefix, suffix) bytes
+        """
+
+        header = self.encode_header(self.merkle_root)
+        offset = serialization.PROOF_OFFSET
+        return header[:offset], header[offset + serialization.PROOF.size:]
+
+    @staticmethod
+    def encode_proof(proof):
+        return serialization.PROOF.pack(proof)
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "transactions": [transaction.to_dict() for transaction in self.transactions],
             "timestamp": self.timestamp,
             "proof": self.proof,
             "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "hash": self.hash,
         }
 
-        data_json = json.dumps(data_to_json, sort_keys=True)
-        hash_object = hashlib.sha256(data_json.encode('utf-8'))
-        return hash_object.hexdigest()
+    @classmethod
+    def from_dict(cls, block_dict):
+        """
+            Rebuild a block, and its transactions, from the dictionary produced by to_dict.
+
+            :param block_dict: <dict> Decoded block
+        """
+
+        transactions = [Transaction.from_dict(transaction) for transaction in block_dict["transactions"]]
+        return cls(
+            block_dict["index"],
+            transactions,
+            block_dict["proof"],
+            block_dict["previous_hash"],
+            block_dict["timestamp"]
+        )
 
     def to_json(self):
-        return json.dumps(self, default=lambda o: {key: value for key, value in o.__dict__.items()}, sort_keys=True)
+        return json.dumps(self.to_dict(), sort_keys=True)
 
     def __repr__(self):
         return "<PeopleChain Block {}>".format(self.hash)
 
     def __str__(self):
-        return str(self.__dict__)
+        return str({
+            "index": self.index,
+            "transactions": list(self.transactions),
+            "timestamp": self.timestamp,
+            "proof": self.proof,
+            "previous_hash": self.previous_hash,
+            "merkle_root": self.merkle_root,
+            "hash": self.hash,
+        })
@@ -1,23 +1,182 @@
+import functools
+import itertools
 import hashlib
+import json
 import logging
+import math
+import os
+import struct
 import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from time import time
 
 from block import Block
+from blocktree import BlockTree, ChainView
+from chainindex import CHAIN_INDEX_NAME, ChainIndex
+from checkpoint import Checkpoint, CheckpointError, PrunedBlocks
+from consensus import LegacyRule
+from mempool import Mempool
+from state import AccountState, INITIAL_BALANCE, NETWORK, apply_transactions
 from transaction import Transaction
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+BLOCK_REWARD = 200
+# Every node must build the same genesis block, so it carries a fixed time
+GENESIS_TIMESTAMP = 1514764800
+STATE_DIRECTORY = "state"
+# A block must be later than the median of the blocks before it and at most this far ahead of
+# the node's clock, so miners cannot move the time the retarget reads either way
+MEDIAN_TIME_BLOCKS = 11
+MAX_FUTURE_BLOCK_TIME = 2 * 60 * 60
+# A transaction is only valid while its timestamp is later than the median time past minus
+# this, and at most MAX_FUTURE_BLOCK_TIME ahead of its block. A replay can then only be of a
+# recent transaction, the only ones a checkpoint needs to carry.
+TRANSACTION_EXPIRY = 24 * 60 * 60
+
+# Outcomes of Blockchain.submit_transactions
+ACCEPTED = "accepted"
+DUPLICATE = "duplicate"
+INVALID_AMOUNT = "invalid amount"
+INSUFFICIENT_BALANCE = "insufficient balance"
+EXPIRED = "expired"
+MEMPOOL_FULL = "mempool full"
+
+# Outcomes of Blockchain.accept_block
+CONNECTED = "connected"
+REORGANIZED = "reorganized"
+SIDE_CHAIN = "side chain"
+ORPHAN = "orphan"
+KNOWN = "known"
+INVALID = "invalid"
+
+
+class InvalidBlock(Exception):
+    pass
+
+
+def check_blocks(block_dicts):
+    """
+        Context-free checks of decoded blocks: rebuild each block, which recomputes its hash and
+        transaction ids, and compare them with the ones it claims. Runs in worker processes.
+
+        :param block_dicts: <list> Blocks as produced by Block.to_dict, hash and tx_id optional,
+            their JSON encoding, or their binary encoding
+        :return: <list> The rebuilt blocks
+    """
+
+    blocks = []
+    for block_dict in block_dicts:
+        if isinstance(block_dict, (bytes, bytearray)):
+            # The binary encoding carries no hash or ids, rebuilding the block computes them
+            blocks.append(Block.from_bytes(block_dict))
+            continue
+        if not isinstance(block_dict, dict):
+            block_dict = json.loads(block_dict)
+        block = Block.from_dict(block_dict)
+        if block_dict.get("hash", block.hash) != block.hash:
+            raise InvalidBlock("Block {} does not match its hash".format(block.index))
+        for transaction, transaction_dict in zip(block.transactions, block_dict["transactions"]):
+            if transaction_dict.get("tx_id", transaction.tx_id) != transaction.tx_id:
+                raise InvalidBlock("Transaction {} does not match its id".format(transaction.tx_id))
+        blocks.append(block)
+    return blocks
+
+
+def block_hashes(encodings):
+    """
+        Hashes of blocks rebuilt from their binary encoding with every transaction decoded and
+        re-encoded, so a block whose transactions are not canonically encoded gets another
+        hash than its lazily decoded copy. Runs in worker processes.
+
+        :param encodings: <list> Binary encodings of blocks
+        :return: <list> Their hashes
+    """
+
+    try:
+        return [Block.from_bytes(encoding).hash for encoding in encodings]
+    except (ValueError, struct.error) as error:
+        raise InvalidBlock(str(error))
+
+
+def is_valid_amount(amount):
+    """ A number that is finite and not negative: NaN would compare false to every balance. """
+    return isinstance(amount, (int, float)) and math.isfinite(amount) and amount >= 0
+
+
+def synchronized(method):
+    """ Run a method holding the chain's lock, see Blockchain.lock """
+
+    @functools.wraps(method)
+    def locked(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return locked
+
+
 class Blockchain():
 
-    def __init__(self, blocks=None, users=None):
+    def __init__(self, blocks=None, users=None, store=None, rule=None, mempool_size=50000, snapshot_interval=1000,
+                 checkpoint=None):
+        """
+            :param blocks: <list> (Optional) Blocks to build the chain from, e.g. downloaded from a peer
+            :param users: <list> (Optional) Profiles to register
+            :param store: <BlockStore> (Optional) On-disk store the chain is written through to and read from
+            :param rule: <object> (Optional) Proof of work rule from consensus.py, the legacy rule by default
+            :param mempool_size: <int> Maximum number of unconfirmed transactions
+            :param snapshot_interval: <int> Number of blocks between balance snapshots, written
+                next to the store when there is one
+            :param checkpoint: <Checkpoint> (Optional) Start the chain at a checkpoint instead of the
+                genesis block. A store that was started from one reopens from it.
+        """
+
+        # Held by every method changing the chain or the mempool, so blocks can be checked and
+        # connected off the reactor thread. Readers do not take it: they see the chain as of
+        # the last change, or in the middle of a reorganization.
+        self.lock = threading.RLock()
+        self.rule = rule if rule is not None else LegacyRule()
+
+        self.unconfimed_transaction = Mempool(mempool_size)
+        # Either an in-memory list or a BlockStore, both behave like a list of blocks
+        self.blocks = [] if store is None else store
+        # Accounts keyed by address; dicts keep insertion order for /chain
+        self.users = {}
+        # Changes with every profile added or edited, e.g. to key cached answers
+        self.users_version = 0
+        # Where confirmed transactions are, by id and by address, on disk next to the store
+        self.index = ChainIndex(None if store is None else os.path.join(store.path, CHAIN_INDEX_NAME))
+        # tx_id -> timestamp of the unexpired transactions confirmed below the checkpoint the
+        # chain started from, those above it are looked up in the chain index, see is_confirmed
+        self.checkpoint_transactions = {}
+        # block hash -> height of the blocks added to the main chain
+        self.hash_heights = {}
+        # Cumulative work of the main chain at each height from main_work_height on, filled lazily
+        self.main_work = []
+        self.main_work_height = 0
+        # Side chains and orphan blocks
+        self.tree = BlockTree()
+        # Balances derived from the confirmed transactions
+        state_path = None if store is None else os.path.join(store.path, STATE_DIRECTORY)
+        self.state = AccountState(state_path, snapshot_interval)
+        # Hashes of blocks whose hash and transaction ids were already checked
+        self.verified_hashes = OrderedDict()
+        self.verified_cache_size = 100000
 
-        self.unconfimed_transaction = []
-        self.blocks = []
-        self.users = []
+        if checkpoint is None and store is not None:
+            checkpoint = Checkpoint.load(store.path)
+        if checkpoint is not None:
+            self.start_from_checkpoint(checkpoint, store)
+        self.index.catch_up(self.blocks, self.first_block_height)
 
         if blocks is None:
+            if len(self.blocks) > 0:
+                # Reopened store: blocks are read lazily, the chain index was caught up above and
+                # knows every confirmed transaction
+                logger.info("Opened block store at height %d", len(self.blocks) - 1)
+                self.state.load(self.blocks)
+                return
             # TODO: When a node starts, check parameters for peer list and then synchronize the chain
             genesis_block = self.get_genesis_block()
             self.add_block(genesis_block)
@@ -26,7 +185,38 @@ class Blockchain():
                 self.add_block(block)
             if users is not None:
                 for user in users:
-                    self.users.append(user)
+                    self.add_user(user)
+
+    def start_from_checkpoint(self, checkpoint, store=None):
+        """
+            Take the balances, headers and chain work at a checkpoint's height as given, so only
+            the blocks after it are downloaded and checked.
+
+            :param checkpoint: <Checkpoint> A checkpoint whose content hash was checked
+            :param store: <BlockStore> (Optional) The store of the blocks after the checkpoint,
+                the checkpoint is saved next to it
+        """
+
+        if checkpoint.rule_state["name"] != self.rule.name:
+            raise CheckpointError("Checkpoint uses the {} proof rule".format(checkpoint.rule_state["name"]))
+        self.blocks = PrunedBlocks(checkpoint.headers(), self.blocks)
+        self.main_work = [checkpoint.chain_work]
+        self.main_work_height = checkpoint.height
+        self.rule.load_checkpoint_state(checkpoint.rule_state)
+        self.state.restore(checkpoint.balances, checkpoint.height, checkpoint.hash)
+        self.checkpoint_transactions.update(checkpoint.transactions)
+        if store is not None:
+            checkpoint.save(store.path)
+        logger.info("Chain starts from the checkpoint at height %d", checkpoint.height)
+
+    @property
+    def first_block_height(self):
+        """ Height of the oldest block held in full, above the checkpoint the chain started from. """
+        return getattr(self.blocks, 'first_block_height', 0)
+
+    @property
+    def first_header_height(self):
+        return getattr(self.blocks, 'first_header_height', 0)
 
     def get_genesis_block(self):
 
@@ -35,49 +225,636 @@ class Blockchain():
             "Network",
             {"message": "Genesis Transaction 1"},
             0,
-            "Network"
+            "Network",
+            GENESIS_TIMESTAMP
         )
 
         genesis_transaction_two = Transaction(
             "Network",
             {"message": "Genesis Transaction 2"},
             0,
-            "Network"
+            "Network",
+            GENESIS_TIMESTAMP
         )
 
         genesis_transactions = [genesis_transaction_one, genesis_transaction_two]
-        print ("Creating genesis block")
-        genesis_block  = Block(0, genesis_transactions, 0, 0)
+        logger.debug("Creating genesis block")
+        genesis_block  = Block(0, genesis_transactions, 0, 0, GENESIS_TIMESTAMP)
         return genesis_block
 
+    @synchronized
     def add_block(self, block):
-        # TODO change this from memory to persistent
 
         if self.validate_block(block):
             self.blocks.append(block)
+            self.index_block(block)
+            self.state.apply_block(block)
+            self.unconfimed_transaction.remove_confirmed(block.transactions)
+            # Only the senders of the block have less to spend
+            self.revalidate_mempool({transaction.handle for transaction in block.transactions})
             return True
         return False
 
+    def index_block(self, block):
+        """
+            Record where the block and its transactions are, and the addresses they touch.
+
+            :param block: <Block> A block that has just been added to the chain
+        """
+
+        self.hash_heights[block.hash] = block.index
+        self.index.add_block(block)
+
+    @synchronized
+    def truncate(self, length):
+        """
+            Remove every block at or above a height, to make room for a longer remote chain.
+
+            :param length: <int> Number of blocks to keep
+            :return: <list> The removed blocks
+        """
+
+        if length >= len(self.blocks):
+            # Nothing to remove, the state needs no rollback
+            return []
+        removed = self.blocks[length:]
+        # The index first: after a crash it may be behind the store, never ahead
+        self.index.truncate(self.blocks, length)
+        del self.blocks[length:]
+        del self.main_work[length - self.main_work_height:]
+        self.state.rollback(self.blocks, length)
+        for block in reversed(removed):
+            self.hash_heights.pop(block.hash, None)
+        return removed
+
+    def height_of(self, block_hash):
+        """ Height of a block of the main chain, None if it is not on it. """
+
+        height = self.hash_heights.get(block_hash)
+        if height is None and hasattr(self.blocks, 'height_of'):
+            # Blocks of a reopened store are only indexed by the store
+            height = self.blocks.height_of(block_hash)
+        return height
+
+    def is_main(self, block_hash):
+        return self.height_of(block_hash) is not None
+
+    def is_confirmed(self, tx_id):
+        """ Whether a transaction is on the main chain, or below the checkpoint it started from. """
+        return tx_id in self.checkpoint_transactions or self.index.find_transaction(tx_id) is not None
+
+    @synchronized
+    def chain_work(self, height):
+        """ Cumulative work of the main chain up to a height. """
+
+        while self.main_work_height + len(self.main_work) <= height:
+            block = self.blocks[self.main_work_height + len(self.main_work)]
+            previous_work = self.main_work[-1] if self.main_work else 0
+            self.main_work.append(previous_work + self.rule.work(self.blocks, block))
+        return self.main_work[height - self.main_work_height]
+
+    @synchronized
+    def accept_block(self, block):
+        """
+            Add a block received from a peer wherever it belongs: on top of the chain, on a
+            side chain, which becomes the main chain if it has more work, or in the orphan pool
+            until its parent arrives. Orphans waiting for the block are connected after it.
+
+            :param block: <Block> The received block
+            :return: <str> CONNECTED, REORGANIZED, SIDE_CHAIN, ORPHAN, KNOWN or INVALID
+        """
+
+        result = self.connect_block(block)
+        if result in (CONNECTED, REORGANIZED, SIDE_CHAIN):
+            pending = [block.hash]
+            while pending:
+                for child in self.tree.pop_orphan_children(pending.pop()):
+                    if self.connect_block(child) in (CONNECTED, REORGANIZED, SIDE_CHAIN):
+                        pending.append(child.hash)
+            self.tree.prune(len(self.blocks) - 1)
+        return result
+
+    def connect_block(self, block):
+        if self.is_main(block.hash) or block.hash in self.tree:
+            return KNOWN
+        try:
+            self.check_block(block)
+        except InvalidBlock as error:
+            logger.warning("Rejected block: %s", error)
+            return INVALID
+
+        if block.previous_hash == self.last_block.hash:
+            return CONNECTED if self.add_block(block) else INVALID
+
+        if self.is_main(block.previous_hash):
+            branch = [block]
+        else:
+            branch = self.tree.branch(block, self.is_main)
+        if branch is None:
+            self.tree.add_orphan(block)
+            return ORPHAN
+
+        fork_height = branch[0].index
+        if fork_height < self.first_block_height:
+            logger.warning("Rejected side block %s, it forks below the checkpoint", block.hash)
+            return INVALID
+        view = ChainView(self.blocks, fork_height, branch[:-1])
+        if block.index != len(view) or not self.rule.verify(view, block):
+            logger.warning("Rejected side block %s", block.hash)
+            return INVALID
+
+        if len(branch) == 1:
+            parent_work = self.chain_work(fork_height - 1)
+        else:
+            parent_work = self.tree.side_work[block.previous_hash]
+        work = parent_work + self.rule.work(view, block)
+        self.tree.add_side_block(block, work)
+
+        if work <= self.chain_work(len(self.blocks) - 1):
+            return SIDE_CHAIN
+        if self.reorganize(fork_height, branch):
+            return REORGANIZED
+        self.tree.remove_side_block(block.hash)
+        return INVALID
+
+    @synchronized
+    def reorganize(self, fork_height, new_blocks):
+        """
+            Replace the blocks from a height on with another branch, if the whole branch is
+            valid and the chain ends up with more work. The disconnected blocks are kept as a
+            side chain and their transactions that the new branch does not confirm go back to
+            the mempool.
+
+            :param fork_height: <int> Height of the first block to replace
+            :param new_blocks: <list> The new blocks, the first one at fork_height
+            :return: <bool> True if the chain was reorganized, False if it is unchanged
+        """
+
+        if fork_height < self.first_block_height:
+            logger.warning("Cannot reorganize from height %d, below the checkpoint", fork_height)
+            return False
+        tip_work = self.chain_work(len(self.blocks) - 1)
+        old_work = [self.chain_work(height) for height in range(fork_height, len(self.blocks))]
+        removed = self.truncate(fork_height)
+        for block in new_blocks:
+            if not self.add_block(block):
+                logger.warning("Reorganization at height %d failed, block %d is invalid", fork_height, block.index)
+                self.restore(fork_height, removed)
+                return False
+        # A longer branch may still carry less work, e.g. mined at an easier target
+        if self.chain_work(len(self.blocks) - 1) <= tip_work:
+            logger.warning("Reorganization at height %d refused, the branch does not have more work", fork_height)
+            self.restore(fork_height, removed)
+            return False
+
+        for block in new_blocks:
+            self.tree.remove_side_block(block.hash)
+        for old_block, work in zip(removed, old_work):
+            self.tree.add_side_block(old_block, work)
+        for old_block in removed:
+            for transaction in old_block.transactions:
+                # Rewards of the disconnected blocks are not valid in any other block
+                if transaction.handle != NETWORK and not self.is_confirmed(transaction.tx_id):
+                    self.push_unconfirmed_transaction(transaction)
+        # Transfers the new branch lacks may have funded any of them
+        self.revalidate_mempool()
+
+        logger.info("Reorganized from height %d: %d blocks disconnected, %d connected", fork_height, len(removed), len(new_blocks))
+        return True
+
+    def restore(self, fork_height, removed):
+        """ Put back the blocks a failed reorganization disconnected. """
+
+        self.truncate(fork_height)
+        for old_block in removed:
+            self.add_block(old_block)
+
+    @synchronized
+    def tip(self):
+        """ :return: <tuple> The last block and the cumulative work of the chain up to it """
+        return self.last_block, self.chain_work(len(self.blocks) - 1)
+
+    @synchronized
+    def extend(self, blocks):
+        """
+            Add blocks on top of the chain in order, e.g. downloaded from a peer. Blocks that
+            reached the main chain meanwhile, e.g. by gossip, are skipped.
+
+            :param blocks: <list> The blocks, the first one at the current height or below
+            :return: <bool> False if a block is invalid, the blocks before it stay
+        """
+
+        # A store syncs the range to disk once
+        bulk = getattr(self.blocks, 'bulk', None)
+        with bulk() if bulk is not None else nullcontext():
+            for block in blocks:
+                if self.is_main(block.hash):
+                    continue
+                if not self.add_block(block):
+                    return False
+                self.tree.remove_side_block(block.hash)
+        return True
+
+    @synchronized
+    def add_user(self, user):
+        """
+            Register a profile, unless its address is already known.
+
+            :param user: <Profile> The profile to register
+            :return: <bool> True if the profile was added
+        """
+
+        if user.address in self.users:
+            return False
+        self.users[user.address] = user
+        self.users_version += 1
+        return True
+
+    def get_user(self, address):
+        return self.users.get(address)
+
+    @synchronized
+    def list_users(self, start=0, stop=None):
+        """
+            Profiles in registration order, copied: profiles are added off the reactor thread.
+
+            :param start: <int> Position of the first profile
+            :param stop: <int> (Optional) Position after the last one, all the others without
+            :return: <tuple> (list of profiles, number of registered profiles)
+        """
+
+        return list(itertools.islice(self.users.values(), start, stop)), len(self.users)
+
+    @property
+    def balances(self):
+        return self.state.balances
+
+    def balance_of(self, address):
+        """ Confirmed balance of an address. """
+        return self.state.balance(address)
+
+    def available_balance(self, address):
+        """ Confirmed balance minus what the address already spends in the mempool. """
+
+        pending = sum(transaction.amount for transaction in self.unconfimed_transaction.from_sender(address))
+        return self.state.balance(address) - pending
+
+    def address_history(self, address, cursor=None, limit=100):
+        """
+            Confirmed transactions sent or received by an address, oldest first.
+
+            :param cursor: <str> (Optional) next_cursor of the previous page
+            :param limit: <int> Maximum number of transactions
+            :return: <tuple> (list of (transaction, block height), next_cursor)
+        """
+
+        entries, next_cursor = self.index.address_history(address, cursor, limit)
+        history = []
+        for tx_id, height, position, offset, length in entries:
+            transaction = self.read_transaction(tx_id, height, position, offset, length)
+            if transaction is not None:
+                history.append((transaction, height))
+        return history, next_cursor
+
+    def find_transaction(self, tx_id):
+        """
+            A confirmed transaction, read alone from its block.
+
+            :return: <tuple> (transaction, block height), None if it is not on the main chain
+        """
+
+        location = self.index.find_transaction(tx_id)
+        if location is None:
+            return None
+        transaction = self.read_transaction(tx_id, *location)
+        return None if transaction is None else (transaction, location[0])
+
+    def read_transaction(self, tx_id, height, position, offset, length):
+        """ Transaction at a location given by the chain index, None if the chain changed meanwhile. """
+
+        try:
+            read = getattr(self.blocks, 'read', None)
+            if read is not None:
+                # Only the transaction is decoded, not the block around it
+                transaction = Transaction.from_bytes(read(height)[offset:offset + length])
+            else:
+                transaction = self.blocks[height].transactions[position]
+        except (IndexError, ValueError, struct.error):
+            return None
+        # Readers do not take the chain lock, the block may have been replaced
+        return transaction if transaction.tx_id == tx_id else None
+
     @property
     def last_block(self):
         return self.blocks[-1]
 
+    def remember_verified(self, block):
+        self.verified_hashes[block.hash] = True
+        while len(self.verified_hashes) > self.verified_cache_size:
+            self.verified_hashes.popitem(last=False)
+
+    def check_block(self, block):
+        """ Checks that only depend on the block itself, done once per block hash. """
+
+        if block.hash in self.verified_hashes:
+            return
+        if block.calculate_block_hash() != block.hash:
+            raise InvalidBlock("Block {} does not match its hash".format(block.index))
+        for transaction in block.transactions:
+            try:
+                # Re-encodes the data, which also checks a lazily decoded transaction
+                tx_id = transaction.calculate_tx_id()
+            except ValueError:
+                tx_id = None
+            if tx_id != transaction.tx_id:
+                raise InvalidBlock("Transaction {} does not match its id".format(transaction.tx_id))
+        self.remember_verified(block)
+
+    @staticmethod
+    def median_time_past(blocks):
+        """ Median timestamp of the last MEDIAN_TIME_BLOCKS blocks, None for an empty chain. """
+
+        first_height = max(len(blocks) - MEDIAN_TIME_BLOCKS, getattr(blocks, 'first_header_height', 0))
+        timestamps = sorted(blocks[height].timestamp for height in range(first_height, len(blocks)))
+        return timestamps[len(timestamps) // 2] if timestamps else None
+
+    @synchronized
+    def unexpired_transactions(self, height):
+        """
+            Confirmed transactions up to a height that have not expired for the blocks after it,
+            the ones a checkpoint at that height carries. The median time past never goes
+            down, so the older ones can never be confirmed again.
+
+            :param height: <int> A height of the main chain, above the checkpoint it started from
+            :return: <dict> tx_id -> timestamp
+        """
+
+        first_height = max(self.first_header_height, height - MEDIAN_TIME_BLOCKS + 1)
+        after = self.median_time_past([self.blocks[each] for each in range(first_height, height + 1)]) - TRANSACTION_EXPIRY
+        transactions = {tx_id: timestamp for tx_id, timestamp in self.checkpoint_transactions.items() if timestamp > after}
+        transactions.update(self.index.recent_transactions(height, after))
+        return transactions
+
+    def transaction_time_bounds(self):
+        """
+            Timestamps a transaction in a block mined now on the tip may have.
+
+            :return: <tuple> (exclusive lower bound, inclusive upper bound)
+        """
+
+        median = self.median_time_past(self.blocks)
+        lower = -math.inf if median is None else median - TRANSACTION_EXPIRY
+        return lower, time() + MAX_FUTURE_BLOCK_TIME
+
+    def next_block_time(self):
+        """ Timestamp of a block mined now on the tip, later than the median time past. """
+
+        median = self.median_time_past(self.blocks)
+        return time() if median is None else max(time(), median + 1)
+
+    def check_block_context(self, blocks, block, balances, is_confirmed):
+        """
+            Checks of a block against the chain it extends.
+
+            :param blocks: <list> The chain, up to the parent of block
+            :param block: <Block> The block to check
+            :param balances: <dict> Balances after the parent, updated with the block's transactions
+            :param is_confirmed: <function> Whether a transaction id was confirmed before the block
+        """
+
+        if block.index != len(blocks):
+            raise InvalidBlock("Block {} does not come next, expected height {}".format(block.index, len(blocks)))
+        previous_hash = blocks[-1].hash if len(blocks) > 0 else 0
+        if block.previous_hash != previous_hash:
+            raise InvalidBlock("Block {} does not point to the last block".format(block.index))
+        # Written so that a NaN timestamp fails both
+        median = self.median_time_past(blocks)
+        if median is not None and not block.timestamp > median:
+            raise InvalidBlock("Block {} is not later than the median time of the blocks before it".format(block.index))
+        if not block.timestamp <= time() + MAX_FUTURE_BLOCK_TIME:
+            raise InvalidBlock("Block {} is more than {} s in the future".format(block.index, MAX_FUTURE_BLOCK_TIME))
+        if not self.rule.verify(blocks, block):
+            raise InvalidBlock("Block {} has an invalid proof".format(block.index))
+
+        issued = 0
+        spent = {}
+        tx_ids = set()
+        for transaction in block.transactions:
+            if transaction.tx_id in tx_ids or is_confirmed(transaction.tx_id):
+                raise InvalidBlock("Transaction {} is already confirmed".format(transaction.tx_id))
+            tx_ids.add(transaction.tx_id)
+            if not is_valid_amount(transaction.amount):
+                raise InvalidBlock("Transaction {} has an invalid amount".format(transaction.tx_id))
+            if median is not None and not (
+                    median - TRANSACTION_EXPIRY < transaction.timestamp <= block.timestamp + MAX_FUTURE_BLOCK_TIME):
+                raise InvalidBlock("Transaction {} has expired or is dated too far ahead".format(transaction.tx_id))
+            if transaction.handle == NETWORK:
+                issued += transaction.amount
+            else:
+                spent[transaction.handle] = spent.get(transaction.handle, 0) + transaction.amount
+                if spent[transaction.handle] > balances.get(transaction.handle, INITIAL_BALANCE):
+                    raise InvalidBlock("{} does not have enough balance".format(transaction.handle))
+        if issued > BLOCK_REWARD:
+            raise InvalidBlock("Block {} issues more than the block reward".format(block.index))
+
     def validate_block(self, block):
-        # TODO write code to validate a block
+        """
+            Check a block before it is added on top of the chain.
+
+            :param block: <Block> The block to check
+            :return: <bool> True if the block is valid
+        """
+
+        try:
+            self.check_block(block)
+            self.check_block_context(self.blocks, block, self.balances, self.is_confirmed)
+        except InvalidBlock as error:
+            logger.warning("Rejected block: %s", error)
+            return False
         return True
 
-    def validate_chain(self):
-        pass
+    def check_blocks(self, block_dicts, workers=None, chunk_size=1000):
+        """
+            Rebuild and check many decoded blocks at once, in a process pool when there are enough.
 
-    def pop_next_unconfirmed_transaction(self):
+            :param block_dicts: <list> Blocks as produced by Block.to_dict, or their JSON or binary encoding
+            :param workers: <int> (Optional) Number of processes, one per core by default
+            :param chunk_size: <int> Number of blocks per process task
+            :return: <list> The rebuilt blocks, which add_block will not check again
+        """
+
+        chunks = [block_dicts[start:start + chunk_size] for start in range(0, len(block_dicts), chunk_size)]
+        if len(chunks) <= 1:
+            results = [check_blocks(chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                results = list(executor.map(check_blocks, chunks))
+
+        blocks = [block for chunk in results for block in chunk]
+        for block in blocks:
+            self.remember_verified(block)
+        return blocks
+
+    def load_blocks(self, encodings, executor=None, chunk_size=100):
+        """
+            Rebuild blocks from their binary encoding. They are decoded lazily here, while
+            executor decodes them fully to check the transactions are canonically encoded.
+
+            :param encodings: <list> Binary encodings of blocks
+            :param executor: <Executor> (Optional) Process pool the full decoding runs in,
+                it runs in this process without one
+            :param chunk_size: <int> Number of blocks per process task
+            :return: <list> The blocks, which add_block will not check again
+        """
+
+        chunks = [encodings[start:start + chunk_size] for start in range(0, len(encodings), chunk_size)]
+        hashes = (executor.map if executor is not None else map)(block_hashes, chunks)
+        blocks = []
         try:
-            return self.unconfimed_transaction.pop(0)
-        except IndexError:
-            return None
+            for encoding in encodings:
+                blocks.append(Block.from_bytes(encoding, lazy=True))
+        except (ValueError, struct.error) as error:
+            raise InvalidBlock(str(error))
 
-    def push_unconfirmed_transaction(self, transaction):
-        self.unconfimed_transaction.append(transaction)
+        checked_hashes = [block_hash for chunk in hashes for block_hash in chunk]
+        for block, block_hash in zip(blocks, checked_hashes):
+            if block.hash != block_hash:
+                raise InvalidBlock("Block {} has transactions that are not canonically encoded".format(block.index))
+            self.remember_verified(block)
+        return blocks
+
+    def encoded_block(self, height):
+        """ Binary encoding of a block, read as stored when the chain is in a BlockStore. """
+
+        read = getattr(self.blocks, 'read', None)
+        return read(height) if read is not None else self.blocks[height].to_bytes()
+
+    def validate_chain(self, workers=None, chunk_size=1000):
+        """
+            Check the whole chain. Blocks are rebuilt and hashed in parallel by height range,
+            then linked and checked against the balances in one pass.
+
+            The balances are replaced by the rebuilt ones when the chain is valid, e.g. after
+            reopening a block store.
+
+            :return: <bool> True if the chain is valid
+        """
+
+        if self.first_block_height > 0:
+            raise ValueError("The chain starts from a checkpoint, blocks below it cannot be checked")
+        stored = hasattr(self.blocks, 'read')
+        encoded_blocks = [self.encoded_block(height) for height in range(len(self.blocks))]
+
+        balances = {}
+        confirmed = set()
+        checked = []
+        try:
+            if len(encoded_blocks) > chunk_size:
+                with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                    blocks = self.load_blocks(encoded_blocks, executor, chunk_size)
+            else:
+                blocks = self.load_blocks(encoded_blocks, chunk_size=chunk_size)
+            for block in blocks:
+                if stored and self.blocks.height_of(block.hash) != block.index:
+                    raise InvalidBlock("Block {} does not match the hash in the store index".format(block.index))
+                self.check_block_context(checked, block, balances, confirmed.__contains__)
+                checked.append(block)
+                apply_transactions(balances, block.transactions)
+                confirmed.update(transaction.tx_id for transaction in block.transactions)
+        except InvalidBlock as error:
+            logger.warning("Invalid chain: %s", error)
+            return False
+
+        last_block = checked[-1] if checked else None
+        self.state.reset(balances, len(checked) - 1, last_block.hash if last_block else None)
         return True
 
+    @synchronized
+    def pop_next_unconfirmed_transaction(self):
+        return self.unconfimed_transaction.pop()
+
+    @synchronized
+    def push_unconfirmed_transaction(self, transaction):
+        return self.unconfimed_transaction.add(transaction)
+
+    @synchronized
+    def submit_transactions(self, transactions, signatures=None):
+        """
+            Insert a batch of transactions, whose signatures were checked, into the mempool.
+            Transactions already known, repeated in the batch, expired or dated too far ahead,
+            or spending more than the sender's confirmed balance minus what it already spends
+            in the mempool are rejected.
+
+            :param transactions: <list> The transactions, in submission order
+            :param signatures: <list> (Optional) (public key, signature) of each transaction,
+                kept in the mempool so they are relayed with it
+            :return: <list> One outcome per transaction: ACCEPTED, DUPLICATE, INVALID_AMOUNT,
+                EXPIRED, INSUFFICIENT_BALANCE or MEMPOOL_FULL
+        """
+
+        outcomes = []
+        seen = set()
+        available = {}
+        lower, upper = self.transaction_time_bounds()
+        if signatures is None:
+            signatures = [None] * len(transactions)
+        for transaction, signature in zip(transactions, signatures):
+            if (transaction.tx_id in seen or transaction.tx_id in self.unconfimed_transaction
+                    or self.is_confirmed(transaction.tx_id)):
+                outcomes.append(DUPLICATE)
+                continue
+            seen.add(transaction.tx_id)
+            if not is_valid_amount(transaction.amount):
+                outcomes.append(INVALID_AMOUNT)
+                continue
+            if not lower < transaction.timestamp <= upper:
+                outcomes.append(EXPIRED)
+                continue
+            if transaction.handle not in available:
+                available[transaction.handle] = self.available_balance(transaction.handle)
+            if transaction.amount > available[transaction.handle]:
+                outcomes.append(INSUFFICIENT_BALANCE)
+                continue
+            if not self.unconfimed_transaction.add(transaction, signature):
+                outcomes.append(MEMPOOL_FULL)
+                continue
+            available[transaction.handle] -= transaction.amount
+            outcomes.append(ACCEPTED)
+        return outcomes
+
+    @synchronized
+    def revalidate_mempool(self, handles=None):
+        """
+            Drop the unconfirmed transactions the chain no longer accepts once blocks changed
+            the balances, e.g. a block confirmed another transaction of the same sender, or
+            moved the median time past beyond their expiry. Each sender's transactions are kept
+            in arrival order while its confirmed balance covers them, so any selection of the
+            mempool makes a valid block.
+
+            :param handles: <iterable> (Optional) Senders to check, every sender without
+            :return: <list> The dropped transactions
+        """
+
+        mempool = self.unconfimed_transaction
+        lower, _ = self.transaction_time_bounds()
+        dropped = []
+        for handle in list(mempool.senders) if handles is None else handles:
+            available = self.balance_of(handle)
+            for transaction in mempool.from_sender(handle):
+                if transaction.amount > available or not transaction.timestamp > lower:
+                    dropped.append(mempool.remove(transaction.tx_id))
+                else:
+                    available -= transaction.amount
+        if dropped:
+            logger.info("Dropped %d unconfirmed transactions the chain no longer accepts", len(dropped))
+        return dropped
+
+    @synchronized
+    def block_template_transactions(self, max_transactions):
+        """ The best paying unconfirmed transactions that fit in a block, the expired ones are dropped first. """
+
+        self.revalidate_mempool()
+        return self.unconfimed_transaction.select(max_transactions)
+
     def __str__(self):
         return str(self.__dict__)
@@ -0,0 +1,278 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from block import Block
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_NAME = "blk{:05d}.dat"
+INDEX_NAME = "index.dat"
+
+# Every record in a segment is a 4 byte big endian length followed by the block's binary encoding
+RECORD_HEADER = struct.Struct(">I")
+# One index entry per height: segment number, offset, record length, raw block hash
+INDEX_ENTRY = struct.Struct(">IQI32s")
+
+
+class BlockStore:
+    """
+        Append-only, on-disk store of blocks.
+
+        Blocks are written to numbered segment files as length-prefixed records and
+        read back lazily through mmap. A fixed-size index file maps each height to the
+        segment and offset of its record, so opening the store only reads the index.
+        The store behaves like a list of blocks: len(), indexing, iteration and append.
+        Blocks can be read from one thread while another appends them.
+    """
+
+    def __init__(self, path, segment_size=64 * 1024 * 1024, sync_every=16, cache_size=256):
+        """
+            :param path: <str> Directory holding the segment and index files
+            :param segment_size: <int> Size in bytes after which a new segment is started
+            :param sync_every: <int> Number of appends between two fsync calls
+            :param cache_size: <int> Number of decoded blocks kept in memory
+        """
+
+        self.path = path
+        self.segment_size = segment_size
+        self.sync_every = sync_every
+        self.cache_size = cache_size
+
+        self.entries = []       # height -> (segment, offset, length)
+        self.heights = {}       # block hash -> height
+        self.hashes = []        # height -> block hash
+        self.cache = OrderedDict()
+        self.maps = {}          # segment -> mmap
+        self.pending = 0
+        # Guards the files, maps and cache: reads and appends may come from different threads
+        self.lock = threading.RLock()
+        self.truncations = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.load_index()
+
+        self.segment = self.entries[-1][0] if self.entries else 0
+        self.segment_file = open(self.segment_path(self.segment), 'ab')
+        self.index_file = open(os.path.join(self.path, INDEX_NAME), 'ab')
+
+    def segment_path(self, segment):
+        return os.path.join(self.path, SEGMENT_NAME.format(segment))
+
+    def load_index(self):
+        """ Read the index file, dropping entries whose records never reached the disk. """
+
+        index_path = os.path.join(self.path, INDEX_NAME)
+        if not os.path.exists(index_path):
+            return
+
+        with open(index_path, 'rb') as index_file:
+            raw_index = index_file.read()
+
+        segment_sizes = {}
+        valid_size = 0
+        for position in range(0, len(raw_index) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            segment, offset, length, raw_hash = INDEX_ENTRY.unpack_from(raw_index, position)
+            if segment not in segment_sizes:
+                segment_path = self.segment_path(segment)
+                segment_sizes[segment] = os.path.getsize(segment_path) if os.path.exists(segment_path) else 0
+            if offset + length > segment_sizes[segment]:
+                break
+            self.heights[raw_hash.hex()] = len(self.entries)
+            self.hashes.append(raw_hash.hex())
+            self.entries.append((segment, offset, length))
+            valid_size = position + INDEX_ENTRY.size
+
+        if valid_size != len(raw_index):
+            logger.warning("Truncating block index at height %d", len(self.entries))
+            with open(index_path, 'r+b') as index_file:
+                index_file.truncate(valid_size)
+
+    def append(self, block):
+        """
+            Write a block at the next height.
+
+            :param block: <Block> The block to store
+            :return: <int> The height of the stored block
+        """
+
+        payload = block.to_bytes()
+        record_length = RECORD_HEADER.size + len(payload)
+
+        with self.lock:
+            offset = self.segment_file.tell()
+            if offset > 0 and offset + record_length > self.segment_size:
+                self.flush(sync=True)
+                self.segment_file.close()
+                self.segment += 1
+                self.segment_file = open(self.segment_path(self.segment), 'ab')
+                offset = 0
+
+            self.segment_file.write(RECORD_HEADER.pack(len(payload)))
+            self.segment_file.write(payload)
+            self.index_file.write(INDEX_ENTRY.pack(self.segment, offset, record_length, bytes.fromhex(block.hash)))
+
+            height = len(self.entries)
+            self.entries.append((self.segment, offset, record_length))
+            self.heights[block.hash] = height
+            self.hashes.append(block.hash)
+            self.remember(height, block)
+
+            self.pending += 1
+            if self.pending >= self.sync_every:
+                self.flush(sync=True)
+            return height
+
+    @contextmanager
+    def bulk(self):
+        """ Appends made inside are fsynced once at the end, instead of every sync_every blocks. """
+
+        sync_every = self.sync_every
+        self.sync_every = float('inf')
+        try:
+            yield
+        finally:
+            self.sync_every = sync_every
+            self.flush(sync=True)
+
+    def flush(self, sync=False):
+        """
+            Push buffered writes to the OS so they can be read back, optionally fsync them.
+
+            :param sync: <bool> Also fsync the segment and the index
+        """
+
+        with self.lock:
+            self.segment_file.flush()
+            self.index_file.flush()
+            if sync and self.pending:
+                os.fsync(self.segment_file.fileno())
+                os.fsync(self.index_file.fileno())
+                self.pending = 0
+
+    def read(self, height):
+        """ Raw serialized block at a height, read through mmap. """
+
+        with self.lock:
+            segment, offset, length = self.entries[height]
+            if segment == self.segment:
+                self.segment_file.flush()
+            segment_map = self.maps.get(segment)
+            if segment_map is None or offset + length > len(segment_map):
+                if segment_map is not None:
+                    segment_map.close()
+                with open(self.segment_path(segment), 'rb') as segment_file:
+                    segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+                self.maps[segment] = segment_map
+
+            payload_length, = RECORD_HEADER.unpack_from(segment_map, offset)
+            start = offset + RECORD_HEADER.size
+            return segment_map[start:start + payload_length]
+
+    def remember(self, height, block):
+        self.cache[height] = block
+        self.cache.move_to_end(height)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def get(self, height):
+        """ Decoded block at a height, served from the cache when possible. """
+
+        with self.lock:
+            block = self.cache.get(height)
+            if block is not None:
+                self.cache.move_to_end(height)
+                return block
+            payload = self.read(height)
+            truncations = self.truncations
+        # Decoded outside the lock; not cached if the chain was truncated meanwhile. Stored
+        # blocks were checked before they were appended, their transactions are kept encoded.
+        block = Block.from_bytes(payload, lazy=True)
+        with self.lock:
+            if self.truncations == truncations:
+                self.remember(height, block)
+        return block
+
+    def get_by_hash(self, block_hash):
+        height = self.heights.get(block_hash)
+        if height is None:
+            return None
+        return self.get(height)
+
+    def height_of(self, block_hash):
+        return self.heights.get(block_hash)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            return [self.get(each) for each in range(*height.indices(len(self)))]
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError("block height out of range")
+        return self.get(height)
+
+    def __delitem__(self, heights):
+        """ Only trailing slices can be removed: del store[height:] """
+
+        if not isinstance(heights, slice) or heights.stop is not None or heights.step is not None:
+            raise TypeError("only trailing slices can be deleted from a block store")
+        self.truncate(min(len(self), heights.start or 0))
+
+    def truncate(self, length):
+        """
+            Drop every block at or above a height, e.g. to replace a fork.
+
+            :param length: <int> Number of blocks to keep
+        """
+
+        with self.lock:
+            if length >= len(self):
+                return
+
+            segment, offset, _ = self.entries[length]
+            for height in range(length, len(self)):
+                self.cache.pop(height, None)
+            for block_hash in self.hashes[length:]:
+                del self.heights[block_hash]
+            del self.hashes[length:]
+            del self.entries[length:]
+            self.truncations += 1
+
+            self.segment_file.close()
+            self.index_file.flush()
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
+
+            later_segment = segment + 1
+            while os.path.exists(self.segment_path(later_segment)):
+                os.remove(self.segment_path(later_segment))
+                later_segment += 1
+            with open(self.segment_path(segment), 'r+b') as segment_file:
+                segment_file.truncate(offset)
+            self.index_file.truncate(length * INDEX_ENTRY.size)
+
+            self.segment = segment
+            self.segment_file = open(self.segment_path(segment), 'ab')
+            self.pending += 1
+            self.flush(sync=True)
+
+    def __iter__(self):
+        for height in range(len(self)):
+            yield self.get(height)
+
+    def close(self):
+        with self.lock:
+            self.flush(sync=True)
+            self.segment_file.close()
+            self.index_file.close()
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
@@ -0,0 +1,117 @@
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ChainView:
+    """
+        A chain that shares the blocks below a fork with the main chain and continues with
+        a branch, indexable like a list of blocks without copying the main chain.
+    """
+
+    def __init__(self, blocks, fork_height, branch):
+        """
+            :param blocks: <list> The main chain, a list of blocks or a BlockStore
+            :param fork_height: <int> Height of the first block that is not shared
+            :param branch: <list> Consecutive blocks from the fork height on, may be empty
+        """
+
+        self.blocks = blocks
+        self.fork_height = fork_height
+        self.branch = branch
+
+    def __len__(self):
+        return self.fork_height + len(self.branch)
+
+    def __getitem__(self, height):
+        if height < 0:
+            height += len(self)
+        if not 0 <= height < len(self):
+            raise IndexError(height)
+        if height < self.fork_height:
+            return self.blocks[height]
+        return self.branch[height - self.fork_height]
+
+
+class BlockTree:
+    """
+        Blocks that are not on the main chain.
+
+        Side blocks extend some block of the tree (main chain or side) and carry the
+        cumulative work of the chain ending with them. Orphans are blocks whose parent is
+        not known yet; they are buffered, oldest evicted first, until it arrives.
+    """
+
+    def __init__(self, max_orphans=100, max_depth=100):
+        """
+            :param max_orphans: <int> Maximum number of buffered orphan blocks
+            :param max_depth: <int> Side blocks further than this below the tip are dropped
+        """
+
+        self.max_orphans = max_orphans
+        self.max_depth = max_depth
+        self.side_blocks = {}           # hash -> block
+        self.side_work = {}             # hash -> cumulative work of the chain ending with the block
+        self.orphans = OrderedDict()    # hash -> block, in arrival order
+        self.orphan_children = {}       # previous hash -> set of orphan hashes
+
+    def __contains__(self, block_hash):
+        return block_hash in self.side_blocks or block_hash in self.orphans
+
+    def add_side_block(self, block, work):
+        self.side_blocks[block.hash] = block
+        self.side_work[block.hash] = work
+
+    def remove_side_block(self, block_hash):
+        self.side_work.pop(block_hash, None)
+        return self.side_blocks.pop(block_hash, None)
+
+    def branch(self, block, is_main):
+        """
+            The side blocks from the main chain up to block, oldest first.
+
+            :param block: <Block> A side block, or a block whose parent is one
+            :param is_main: <function> hash -> True if the block is on the main chain
+        """
+
+        branch = [block]
+        while not is_main(branch[-1].previous_hash):
+            parent = self.side_blocks.get(branch[-1].previous_hash)
+            if parent is None:
+                return None
+            branch.append(parent)
+        branch.reverse()
+        return branch
+
+    def add_orphan(self, block):
+        if block.hash in self.orphans:
+            return
+        self.orphans[block.hash] = block
+        self.orphan_children.setdefault(block.previous_hash, set()).add(block.hash)
+        while len(self.orphans) > self.max_orphans:
+            _, evicted = self.orphans.popitem(last=False)
+            self.forget_orphan(evicted)
+            logger.info("Orphan pool full, dropped block %s", evicted.hash)
+
+    def forget_orphan(self, block):
+        children = self.orphan_children.get(block.previous_hash)
+        if children is not None:
+            children.discard(block.hash)
+            if not children:
+                del self.orphan_children[block.previous_hash]
+
+    def pop_orphan_children(self, block_hash):
+        """ Remove and return the orphans waiting for a block. """
+
+        children = []
+        for orphan_hash in self.orphan_children.pop(block_hash, ()):
+            children.append(self.orphans.pop(orphan_hash))
+        return children
+
+    def prune(self, tip_height):
+        """ Drop side blocks too deep below the tip to ever be reorganized to. """
+
+        for block_hash, block in list(self.side_blocks.items()):
+            if block.index < tip_height - self.max_depth:
+                self.remove_side_block(block_hash)
@@ -0,0 +1,136 @@
+"""
+    Cached answers of the read-heavy HTTP routes.
+
+    An answer is keyed by what it is built from, e.g. the tip hash and the version of the
+    mempool, and its strong ETag is derived from the key alone. A request whose
+    If-None-Match holds that ETag is answered 304 before anything is built.
+    Answers, and the JSON of blocks, which never change once built, are kept in LRU caches
+    bounded by the size of what they hold.
+
+"""
+import hashlib
+from collections import OrderedDict
+from uuid import uuid4
+
+
+class LRUCache:
+    """ bytes values by key, the least recently used are dropped once max_bytes are held. """
+
+    def __init__(self, max_bytes):
+        """
+            :param max_bytes: <int> Total size of the values held, larger values are not kept
+        """
+
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        value = self.items.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        previous = self.items.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self.items.popitem(last=False)
+            self.size -= len(evicted)
+
+
+def etag_matches(header, etag):
+    """
+        :param header: <bytes> Value of an If-None-Match header, None without one
+        :param etag: <bytes> Quoted ETag of the current answer
+    """
+
+    if header is None:
+        return False
+    tags = [tag.strip() for tag in header.split(b',')]
+    # If-None-Match compares weakly: W/"x" matches "x"
+    return b'*' in tags or etag in (tag[2:] if tag.startswith(b'W/') else tag for tag in tags)
+
+
+class ResponseCache:
+
+    def __init__(self, max_bytes):
+        """
+            :param max_bytes: <int> Total size of the cached answers
+        """
+
+        self.answers = LRUCache(max_bytes)
+        # ETags of another node, or of an earlier run of this one, never match
+        self.salt = uuid4().hex
+        # route -> count, read by the node's metrics. Bytes saved are those of the answers
+        # not sent again thanks to a 304.
+        self.hits = {}
+        self.misses = {}
+        self.not_modified = {}
+        self.bytes_saved = {}
+
+    def etag(self, key):
+        digest = hashlib.sha256((self.salt + repr(key)).encode('utf-8')).hexdigest()
+        return '"{}"'.format(digest[:32]).encode('ascii')
+
+    @staticmethod
+    def count(counts, route, amount=1):
+        counts[route] = counts.get(route, 0) + amount
+
+    def lookup(self, request, route, key):
+        """
+            Set the ETag of the answer and find it.
+
+            :param request: <Request> The incoming request
+            :param route: <str> Name of the route, for the metrics
+            :param key: <tuple> Everything the answer is built from, hashable
+            :return: <bytes> b'' when the client's copy is current (304), the cached answer,
+                or None when it must be built and stored
+        """
+
+        # A compressed answer is another representation, with its own strong ETag
+        etag = self.etag((key, request.responseHeaders.getRawHeaders(b'Content-Encoding')))
+        request.setHeader(b'ETag', etag)
+        answer = self.answers.get(key)
+        if etag_matches(request.getHeader(b'If-None-Match'), etag):
+            request.setResponseCode(304)
+            self.count(self.not_modified, route)
+            if answer is not None:
+                self.count(self.bytes_saved, route, len(answer))
+            return b''
+        if answer is not None:
+            self.count(self.hits, route)
+            return answer
+        self.count(self.misses, route)
+        return None
+
+    def store(self, key, answer):
+        self.answers.put(key, answer)
+
+    def respond(self, request, route, key, build):
+        """
+            The cached answer, or build() stored for the next requests.
+
+            :param build: <function> Returns the answer as str or bytes
+        """
+
+        answer = self.lookup(request, route, key)
+        if answer is None:
+            answer = build()
+            if isinstance(answer, str):
+                answer = answer.encode('utf-8')
+            self.store(key, answer)
+        return answer
@@ -0,0 +1,278 @@
+"""
+    Secondary indexes of the main chain, kept in sqlite next to the block store.
+
+    transactions: tx_id -> height of its block, position in the block, and the offset and
+        length of its encoding in the block's encoding, so one transaction is read back
+        without decoding its block. Also its timestamp, indexed, to list the transactions
+        that have not expired, see Blockchain.TRANSACTION_EXPIRY.
+    address_transactions: address -> the same location of every transaction it sent or
+        received, ordered by height and position. Network is not an account and is left
+        out, its history would be every reward and fee.
+
+    Blocks are indexed as they are added and removed when the chain is truncated. Their rows
+    are buffered and written and committed every commit_every blocks, or before a lookup,
+    with the hash of the last indexed block. After a crash the index is behind the store,
+    never ahead, and catch_up indexes the missing blocks.
+
+"""
+import logging
+import sqlite3
+import threading
+
+import serialization
+from state import NETWORK
+
+logger = logging.getLogger(__name__)
+
+CHAIN_INDEX_NAME = "chainindex.sqlite"
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value
+    );
+    CREATE TABLE IF NOT EXISTS transactions (
+        tx_id BLOB PRIMARY KEY,
+        height INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        timestamp REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS transactions_by_time ON transactions (timestamp);
+    CREATE TABLE IF NOT EXISTS address_transactions (
+        address TEXT NOT NULL,
+        height INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        tx_id BLOB NOT NULL,
+        offset INTEGER NOT NULL,
+        length INTEGER NOT NULL,
+        PRIMARY KEY (address, height, position)
+    ) WITHOUT ROWID;
+"""
+
+
+def transaction_locations(block):
+    """
+        Where the transactions of a block are in its encoding, see serialization.py
+
+        :return: <list> (transaction, position, offset, length) in block order
+    """
+
+    locations = []
+    offset = serialization.BLOCK_HEADER.size + serialization.LENGTH.size
+    for position, transaction in enumerate(block.transactions):
+        length = len(transaction.to_bytes())
+        offset += serialization.LENGTH.size
+        locations.append((transaction, position, offset, length))
+        offset += length
+    return locations
+
+
+def format_cursor(height, position):
+    return "{}:{}".format(height, position)
+
+
+def parse_cursor(cursor):
+    """ (height, position) of the last entry a client received, (-1, -1) for the first page. """
+
+    if not cursor:
+        return -1, -1
+    try:
+        height, position = cursor.split(':')
+        return int(height), int(position)
+    except ValueError:
+        raise ValueError("Malformed cursor {!r}".format(cursor))
+
+
+class ChainIndex:
+
+    def __init__(self, path=None, commit_every=1000):
+        """
+            :param path: <str> (Optional) File of the sqlite database, in memory without one
+            :param commit_every: <int> Number of indexed blocks between two commits
+        """
+
+        self.path = path
+        self.commit_every = commit_every
+        self.pending = 0
+        # Rows of the blocks indexed since the last write
+        self.transaction_rows = []
+        self.address_rows = []
+        # The connection is shared by the reactor and the threads adding blocks
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        if path is not None:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # Commits are not fsynced, a lost one is made up by catch_up
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(transactions)")]
+        if columns and "timestamp" not in columns:
+            # Written before transactions had their timestamp, catch_up rebuilds it
+            self.connection.executescript("DROP TABLE transactions; DROP TABLE address_transactions; DELETE FROM meta;")
+        self.connection.executescript(SCHEMA)
+
+        rows = dict(self.connection.execute("SELECT key, value FROM meta"))
+        self.height = rows.get("height", -1)
+        self.block_hash = rows.get("hash")
+
+    def add_block(self, block):
+        """ Index the transactions of the block at the next height. """
+
+        with self.lock:
+            for transaction, position, offset, length in transaction_locations(block):
+                tx_id = bytes.fromhex(transaction.tx_id)
+                self.transaction_rows.append((tx_id, block.index, position, offset, length, transaction.timestamp))
+                for address in {transaction.handle, transaction.destination}:
+                    if address and address != NETWORK:
+                        self.address_rows.append((address, block.index, position, tx_id, offset, length))
+            self.height = block.index
+            self.block_hash = block.hash
+            self.pending += 1
+            if self.pending >= self.commit_every:
+                self.commit()
+
+    def truncate(self, blocks, length):
+        """
+            Forget the blocks at or above a height, committed at once. Rows are found from the
+            transactions of the removed blocks, there is no index by height to maintain.
+
+            :param blocks: <list> The main chain, still holding the blocks to forget
+            :param length: <int> Number of blocks kept
+        """
+
+        with self.lock:
+            self.write()
+            transactions = [
+                transaction for height in range(length, self.height + 1) for transaction in blocks[height].transactions
+            ]
+            addresses = {address for transaction in transactions for address in (transaction.handle, transaction.destination)}
+            self.connection.executemany(
+                "DELETE FROM transactions WHERE tx_id = ?", ((bytes.fromhex(transaction.tx_id),) for transaction in transactions)
+            )
+            self.connection.executemany(
+                "DELETE FROM address_transactions WHERE address = ? AND height >= ?",
+                ((address, length) for address in addresses if address and address != NETWORK)
+            )
+            if self.height >= length:
+                self.height = length - 1
+                self.block_hash = blocks[length - 1].hash if length > 0 else None
+            self.pending += 1
+            self.commit()
+
+    def clear(self):
+        with self.lock:
+            self.transaction_rows = []
+            self.address_rows = []
+            self.connection.execute("DELETE FROM transactions")
+            self.connection.execute("DELETE FROM address_transactions")
+            self.height = -1
+            self.block_hash = None
+            self.pending += 1
+            self.commit()
+
+    def write(self):
+        """ Write the buffered rows, uncommitted: lookups on this connection see them. """
+
+        with self.lock:
+            # A transaction confirmed again after a reorganization moves to its new block
+            self.connection.executemany("INSERT OR REPLACE INTO transactions VALUES (?, ?, ?, ?, ?, ?)", self.transaction_rows)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO address_transactions VALUES (?, ?, ?, ?, ?, ?)", self.address_rows
+            )
+            self.transaction_rows = []
+            self.address_rows = []
+
+    def commit(self):
+        with self.lock:
+            if not self.pending:
+                return
+            self.write()
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (("height", self.height), ("hash", self.block_hash))
+            )
+            self.connection.commit()
+            self.pending = 0
+
+    def catch_up(self, blocks, first_height=0):
+        """
+            Index the blocks added since the last commit, e.g. when a block store is reopened.
+            An index that does not match the chain is rebuilt.
+
+            :param blocks: <list> The main chain, a list of blocks, a BlockStore or PrunedBlocks
+            :param first_height: <int> Height of the first block held in full
+        """
+
+        with self.lock:
+            if self.height >= len(blocks) or (
+                    self.height >= 0 and (self.height < first_height or blocks[self.height].hash != self.block_hash)):
+                logger.warning("Chain index does not match the chain, rebuilding it")
+                self.clear()
+            start = max(self.height + 1, first_height)
+            for height in range(start, len(blocks)):
+                self.add_block(blocks[height])
+            self.commit()
+            if len(blocks) > start:
+                logger.info("Indexed blocks %d to %d", start, len(blocks) - 1)
+
+    def find_transaction(self, tx_id):
+        """
+            :param tx_id: <str> Hex id of a confirmed transaction
+            :return: <tuple> (height, position, offset, length), None if it is not indexed
+        """
+
+        try:
+            raw_id = bytes.fromhex(tx_id)
+        except ValueError:
+            return None
+        with self.lock:
+            self.write()
+            return self.connection.execute(
+                "SELECT height, position, offset, length FROM transactions WHERE tx_id = ?", (raw_id,)
+            ).fetchone()
+
+    def recent_transactions(self, max_height, after):
+        """
+            Transactions indexed at or below a height and dated after a time, e.g. the ones a
+            checkpoint carries because they have not expired.
+
+            :return: <dict> tx_id -> timestamp
+        """
+
+        with self.lock:
+            self.write()
+            rows = self.connection.execute(
+                "SELECT tx_id, timestamp FROM transactions WHERE timestamp > ? AND height <= ?", (after, max_height)
+            )
+            return {tx_id.hex(): timestamp for tx_id, timestamp in rows}
+
+    def address_history(self, address, cursor=None, limit=100):
+        """
+            Transactions sent or received by an address, oldest first.
+
+            :param address: <str> The address
+            :param cursor: <str> (Optional) next_cursor of the previous page
+            :param limit: <int> Maximum number of entries
+            :return: <tuple> (entries, next_cursor): entries are (tx_id, height, position,
+                offset, length), next_cursor is None on the last page
+        """
+
+        height, position = parse_cursor(cursor)
+        with self.lock:
+            self.write()
+            rows = self.connection.execute(
+                "SELECT tx_id, height, position, offset, length FROM address_transactions"
+                " WHERE address = ? AND (height, position) > (?, ?) ORDER BY height, position LIMIT ?",
+                (address, height, position, limit + 1)
+            ).fetchall()
+        entries = [(tx_id.hex(), height, position, offset, length) for tx_id, height, position, offset, length in rows]
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = format_cursor(entries[-1][1], entries[-1][2])
+        return entries, next_cursor
+
+    def close(self):
+        with self.lock:
+            self.commit()
+            self.connection.close()
@@ -0,0 +1,273 @@
+"""
+    Checkpoints: the state of the chain at a height H, for new nodes to start from.
+
+    A checkpoint holds the balances after block H, the ids and timestamps of the transactions
+    confirmed up to H that have not expired, so they cannot be confirmed again, the headers of
+    the last blocks up to H, the cumulative work of the chain at H and what the proof rule
+    needs to check the blocks after H. It is encoded as canonical JSON and identified by the
+    sha256 of that encoding, its content hash, which the publishing node signs. Peers serve
+    the encoding in chunks, so it can be fetched from several of them at once.
+
+    A chain started from a checkpoint knows the blocks up to H by their headers only,
+    see PrunedBlocks.
+
+"""
+import hashlib
+import json
+import os
+from contextlib import nullcontext
+
+import serialization
+from block import Block
+
+CHECKPOINT_VERSION = 3
+# Headers kept below the checkpoint, enough for the proof rules to check the next blocks
+CHECKPOINT_HEADERS = 500
+CHUNK_SIZE = 256 * 1024
+CHECKPOINT_NAME = "checkpoint.json"
+
+
+class CheckpointError(ValueError):
+    pass
+
+
+class BlockHeader:
+    """ A block known only by its header, at or below the checkpoint a chain started from. """
+
+    __slots__ = ('index', 'timestamp', 'proof', 'previous_hash', 'merkle_root', 'hash')
+
+    transactions = ()
+
+    def __init__(self, header):
+        """
+            :param header: <dict> As produced by Block.header_dict, its hash is checked
+        """
+
+        if Block.hash_header(header) != header["hash"]:
+            raise CheckpointError("Header {} does not match its hash".format(header["index"]))
+        for name in self.__slots__:
+            setattr(self, name, header[name])
+
+    def header_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return "<BlockHeader {} {}>".format(self.index, self.hash)
+
+
+class PrunedBlocks:
+    """
+        The blocks of a chain started from a checkpoint: headers up to the checkpoint height,
+        then full blocks. Behaves like the list of blocks, or BlockStore, it wraps for the
+        blocks after the checkpoint, at their real heights.
+    """
+
+    def __init__(self, headers, tail):
+        """
+            :param headers: <list> BlockHeaders, consecutive, ending at the checkpoint
+            :param tail: <list> Blocks after the checkpoint, a list or a BlockStore
+        """
+
+        self.headers = headers
+        self.tail = tail
+        self.first_header_height = headers[0].index
+        self.first_block_height = headers[-1].index + 1
+        self.header_heights = {header.hash: header.index for header in headers}
+
+    def __len__(self):
+        return self.first_block_height + len(self.tail)
+
+    def __getitem__(self, height):
+        if isinstance(height, slice):
+            start, stop, step = height.indices(len(self))
+            if start < self.first_block_height:
+                raise IndexError("Blocks below height {} are pruned".format(self.first_block_height))
+            return [self[each] for each in range(start, stop, step)]
+        if height < 0:
+            height += len(self)
+        if height >= len(self):
+            raise IndexError("block height out of range")
+        if height >= self.first_block_height:
+            return self.tail[height - self.first_block_height]
+        if height >= self.first_header_height:
+            return self.headers[height - self.first_header_height]
+        raise IndexError("Block {} is older than the checkpoint".format(height))
+
+    def __delitem__(self, heights):
+        """ Only blocks after the checkpoint can be removed: del blocks[height:] """
+
+        if not isinstance(heights, slice) or heights.stop is not None or heights.step is not None:
+            raise TypeError("only trailing slices can be deleted")
+        start = heights.start or 0
+        if start < self.first_block_height:
+            raise ValueError("Cannot remove blocks below the checkpoint at height {}".format(self.first_block_height - 1))
+        del self.tail[start - self.first_block_height:]
+
+    def append(self, block):
+        self.tail.append(block)
+
+    def height_of(self, block_hash):
+        height = self.header_heights.get(block_hash)
+        if height is None and hasattr(self.tail, 'height_of'):
+            tail_height = self.tail.height_of(block_hash)
+            if tail_height is not None:
+                height = tail_height + self.first_block_height
+        return height
+
+    def bulk(self):
+        bulk = getattr(self.tail, 'bulk', None)
+        return bulk() if bulk is not None else nullcontext()
+
+    def read(self, height):
+        """ Binary encoding of a block after the checkpoint. """
+
+        if not self.first_block_height <= height < len(self):
+            raise IndexError("Block {} is not stored".format(height))
+        read = getattr(self.tail, 'read', None)
+        if read is not None:
+            return read(height - self.first_block_height)
+        return self.tail[height - self.first_block_height].to_bytes()
+
+    def __iter__(self):
+        for height in range(self.first_header_height, len(self)):
+            yield self[height]
+
+
+class Checkpoint:
+
+    def __init__(self, content, data=None):
+        """
+            :param content: <dict> Decoded checkpoint, see from_chain
+            :param data: <bytes> (Optional) Its encoding, computed when missing
+        """
+
+        self.content = content
+        self.data = data if data is not None else serialization.canonical_json(content)
+        self.content_hash = hashlib.sha256(self.data).hexdigest()
+        self.public_key = None
+        self.signature = None
+
+    @property
+    def height(self):
+        return self.content["height"]
+
+    @property
+    def hash(self):
+        return self.content["hash"]
+
+    @property
+    def chain_work(self):
+        return self.content["chain_work"]
+
+    @property
+    def balances(self):
+        return self.content["balances"]
+
+    @property
+    def transactions(self):
+        """ tx_id -> timestamp """
+        return self.content["transactions"]
+
+    @property
+    def rule_state(self):
+        return self.content["rule"]
+
+    def headers(self):
+        return [BlockHeader(header) for header in self.content["headers"]]
+
+    @classmethod
+    def from_chain(cls, blockchain, height, balances, max_headers=CHECKPOINT_HEADERS):
+        """
+            :param blockchain: <Blockchain> The chain, height must be on its main chain
+            :param height: <int> Height of the checkpoint
+            :param balances: <dict> Balances after the block at height, e.g. a state snapshot
+            :param max_headers: <int> Number of headers up to height to include
+        """
+
+        blocks = blockchain.blocks
+        first_height = max(blockchain.first_header_height, height - max_headers + 1)
+        content = {
+            "version": CHECKPOINT_VERSION,
+            "height": height,
+            "hash": blocks[height].hash,
+            "chain_work": blockchain.chain_work(height),
+            "balances": balances,
+            "transactions": blockchain.unexpired_transactions(height),
+            "headers": [blocks[each].header_dict() for each in range(first_height, height + 1)],
+            "rule": blockchain.rule.checkpoint_state(blocks, height),
+        }
+        return cls(content)
+
+    @classmethod
+    def decode(cls, data, content_hash):
+        """
+            Rebuild a downloaded checkpoint, checking it against its content hash and checking
+            that its headers form a chain ending at its block.
+
+            :param data: <bytes> The encoding, as served in chunks
+            :param content_hash: <str> The hex sha256 it was announced with
+        """
+
+        if hashlib.sha256(data).hexdigest() != content_hash:
+            raise CheckpointError("Checkpoint does not match its content hash")
+        try:
+            content = json.loads(data)
+        except ValueError as error:
+            raise CheckpointError("Malformed checkpoint: {}".format(error))
+        if content.get("version") != CHECKPOINT_VERSION:
+            raise CheckpointError("Unsupported checkpoint version {}".format(content.get("version")))
+
+        checkpoint = cls(content, data)
+        headers = checkpoint.headers()
+        if not headers:
+            raise CheckpointError("Checkpoint has no headers")
+        for previous, header in zip(headers, headers[1:]):
+            if header.previous_hash != previous.hash or header.index != previous.index + 1:
+                raise CheckpointError("Header {} does not extend the previous one".format(header.index))
+        if headers[-1].index != checkpoint.height or headers[-1].hash != checkpoint.hash:
+            raise CheckpointError("Headers do not end at the checkpoint")
+        return checkpoint
+
+    def chunk_count(self, chunk_size=CHUNK_SIZE):
+        return (len(self.data) + chunk_size - 1) // chunk_size
+
+    def chunk(self, position, chunk_size=CHUNK_SIZE):
+        return self.data[position * chunk_size:(position + 1) * chunk_size]
+
+    def sign(self, key):
+        """ :param key: <pyelliptic.ECC> Key of the publishing node """
+
+        self.public_key = key.get_pubkey()
+        self.signature = key.sign(self.content_hash.encode('ascii'))
+
+    def manifest(self, chunk_size=CHUNK_SIZE):
+        """ What /checkpoint announces: enough to download, check and trust the checkpoint. """
+
+        return {
+            "height": self.height,
+            "hash": self.hash,
+            "content_hash": self.content_hash,
+            "size": len(self.data),
+            "chunk_size": chunk_size,
+            "chunks": self.chunk_count(chunk_size),
+            "public_key": self.public_key.hex() if self.public_key else None,
+            "signature": self.signature.hex() if self.signature else None,
+        }
+
+    def save(self, path):
+        # Write then rename, a crash never leaves a half written checkpoint
+        file_name = os.path.join(path, CHECKPOINT_NAME)
+        with open(file_name + ".tmp", 'wb') as checkpoint_file:
+            checkpoint_file.write(self.data)
+        os.replace(file_name + ".tmp", file_name)
+
+    @classmethod
+    def load(cls, path):
+        """ The checkpoint a chain stored at path was started from, None if it was not. """
+
+        file_name = os.path.join(path, CHECKPOINT_NAME)
+        if not os.path.exists(file_name):
+            return None
+        with open(file_name, 'rb') as checkpoint_file:
+            data = checkpoint_file.read()
+        return cls.decode(data, hashlib.sha256(data).hexdigest())
@@ -0,0 +1,150 @@
+"""
+    A network of PeoplesChain nodes on this host, one process per node.
+
+    Every node runs peopleschain.py in a directory of its own, where it keeps its node.ini,
+    block store and log, and listens on its own port of 127.0.0.1. Peers are addressed as
+    127.0.0.1:<port>.
+
+"""
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, sleep
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+NODE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "peopleschain.py")
+LOCAL_HOST = "127.0.0.1"
+
+
+class ClusterError(Exception):
+    pass
+
+
+def resident_memory(pid):
+    """ Resident set size of a process in bytes, None where /proc is not available. """
+
+    try:
+        with open("/proc/{}/status".format(pid)) as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class ClusterNode:
+    """ One node process of a cluster. """
+
+    def __init__(self, index, port, directory, seeds):
+        self.index = index
+        self.port = port
+        self.directory = directory
+        self.seeds = seeds
+        self.process = None
+        self.log = None
+
+    @property
+    def address(self):
+        return "{}:{}".format(LOCAL_HOST, self.port)
+
+    def url(self, path):
+        return "http://{}{}".format(self.address, path)
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.log = open(os.path.join(self.directory, "node.log"), 'ab')
+        command = [sys.executable, NODE_SCRIPT, "--port", str(self.port), "--host", self.address, "--seeds"] + self.seeds
+        self.process = subprocess.Popen(command, cwd=self.directory, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def is_ready(self):
+        try:
+            return requests.get(self.url("/chain/tip"), timeout=1).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+
+    def memory(self):
+        if self.process is None or self.process.poll() is not None:
+            return None
+        return resident_memory(self.process.pid)
+
+    def stop(self, timeout=10):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+class Cluster:
+    """
+        Start and stop a local network of nodes.
+
+        Nodes are started one after another, each seeded with up to degree of the nodes
+        already running, so it synchronizes from them and announces itself to them.
+    """
+
+    def __init__(self, size, base_port=19100, degree=2, directory=None, start_timeout=60):
+        """
+            :param size: <int> Number of nodes
+            :param base_port: <int> Port of the first node, the others use the following ones
+            :param degree: <int> Number of running nodes each new node is seeded with
+            :param directory: <str> (Optional) Where the node directories are created, a temporary directory by default
+            :param start_timeout: <int> Seconds a node may take to answer its first request
+        """
+
+        self.size = size
+        self.base_port = base_port
+        self.degree = degree
+        self.directory = directory or tempfile.mkdtemp(prefix="peopleschain-cluster-")
+        self.start_timeout = start_timeout
+        self.nodes = []
+
+    def start(self):
+        try:
+            for index in range(self.size):
+                port = self.base_port + index
+                seeds = random.sample([node.address for node in self.nodes], min(self.degree, len(self.nodes)))
+                node = ClusterNode(index, port, os.path.join(self.directory, "node{}".format(index)), seeds)
+                self.nodes.append(node)
+                node.start()
+                self.wait_ready(node)
+        except Exception:
+            self.stop()
+            raise
+        logger.info("Cluster of %d nodes running in %s", self.size, self.directory)
+        return self
+
+    def wait_ready(self, node):
+        started = perf_counter()
+        while not node.is_ready():
+            if node.process.poll() is not None:
+                raise ClusterError("Node {} exited with {}, see {}".format(node.index, node.process.returncode, node.directory))
+            if perf_counter() - started > self.start_timeout:
+                raise ClusterError("Node {} did not start within {} s".format(node.index, self.start_timeout))
+            sleep(0.1)
+
+    def memory(self):
+        """ Resident memory of each node process in bytes, by node address. """
+        return {node.address: node.memory() for node in self.nodes}
+
+    def stop(self):
+        for node in self.nodes:
+            node.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
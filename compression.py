@@ -0,0 +1,156 @@
+"""
+    Negotiated compression of the HTTP traffic, gzip or zlib ("deflate" in HTTP).
+
+    Answers are compressed when the client accepts it (Accept-Encoding), as one stream per
+    answer: the blocks or items of a range are framed into a single body, so they share
+    the compressor's window instead of being compressed one by one. A node compressing its
+    answers also advertises the encodings it accepts for request bodies, with an
+    Accept-Encoding response header, and PeerClient compresses what it sends to peers that
+    advertised one.
+
+"""
+import json
+import zlib
+from io import BytesIO
+from time import perf_counter
+
+from twisted.web import iweb
+from zope.interface import implementer
+
+from metrics import TimedRequest
+
+# HTTP content coding -> zlib wbits, in order of preference
+ENCODINGS = {
+    b'gzip': 16 + zlib.MAX_WBITS,
+    b'deflate': zlib.MAX_WBITS,
+}
+ACCEPT_ENCODING = b', '.join(ENCODINGS)
+# Request bodies smaller than this are not worth compressing
+MIN_COMPRESSED_SIZE = 512
+# Largest request body decoded, against bodies that expand without bound
+MAX_DECODED_SIZE = 64 * 1024 * 1024
+
+
+class DecodingError(ValueError):
+    pass
+
+
+def choose_encoding(accept_encoding):
+    """
+        :param accept_encoding: <bytes> Value of an Accept-Encoding header, None without one
+        :return: <bytes> The preferred encoding the other side accepts, None for none
+    """
+
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(b','):
+        coding, _, parameters = item.strip().partition(b';')
+        quality = 1.0
+        parameters = parameters.strip()
+        if parameters.startswith(b'q='):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    candidates = [encoding for encoding in ENCODINGS if accepted.get(encoding, accepted.get(b'*', 0)) > 0]
+    if not candidates:
+        return None
+    # The other side's preference first, ours among equals
+    return max(candidates, key=lambda encoding: accepted.get(encoding, accepted.get(b'*', 0)))
+
+
+def compressor(encoding, level):
+    return zlib.compressobj(level, zlib.DEFLATED, ENCODINGS[encoding])
+
+
+def compress(data, encoding, level):
+    stream = compressor(encoding, level)
+    return stream.compress(data) + stream.flush()
+
+
+def decompress(data, encoding, max_size=MAX_DECODED_SIZE):
+    """
+        :param encoding: <bytes> Content-Encoding of data
+        :raise DecodingError: Unknown encoding, corrupt data or more than max_size bytes
+    """
+
+    encoding = encoding.strip().lower()
+    if encoding == b'identity':
+        return data
+    if encoding not in ENCODINGS:
+        raise DecodingError("Unsupported content encoding {}".format(encoding.decode('ascii', 'replace')))
+    stream = zlib.decompressobj(ENCODINGS[encoding])
+    try:
+        decoded = stream.decompress(data, max_size)
+        if stream.unconsumed_tail:
+            raise DecodingError("Body larger than {} bytes once decoded".format(max_size))
+        decoded += stream.flush()
+    except zlib.error as error:
+        raise DecodingError("Corrupt {} body: {}".format(encoding.decode('ascii'), error))
+    if not stream.eof:
+        raise DecodingError("Truncated {} body".format(encoding.decode('ascii')))
+    return decoded
+
+
+@implementer(iweb._IRequestEncoder)
+class StreamEncoder:
+    """ Compresses everything written for one answer as a single stream. """
+
+    def __init__(self, encoding, level, request=None):
+        self.compressor = compressor(encoding, level)
+        self.request = request
+
+    def encode(self, data):
+        if self.request is not None and not self.request.startedWriting:
+            # The length of the compressed answer is not known in advance
+            self.request.responseHeaders.removeHeader(b'Content-Length')
+        return self.compressor.compress(data)
+
+    def finish(self):
+        return self.compressor.flush()
+
+
+@implementer(iweb._IRequestEncoderFactory)
+class CompressionEncoderFactory:
+    """ Encoder of the answers of a Klein app, see twisted.web.resource.EncodingResourceWrapper """
+
+    def __init__(self, level=3):
+        """
+            :param level: <int> zlib compression level, 1 (fastest) to 9 (smallest)
+        """
+
+        self.level = level
+
+    def encoderForRequest(self, request):
+        request.responseHeaders.setRawHeaders(b'Accept-Encoding', [ACCEPT_ENCODING])
+        encoding = choose_encoding(b','.join(request.requestHeaders.getRawHeaders(b'Accept-Encoding', [])))
+        if encoding is None:
+            return None
+        request.responseHeaders.setRawHeaders(b'Content-Encoding', [encoding])
+        request.responseHeaders.addRawHeader(b'Vary', b'Accept-Encoding')
+        return StreamEncoder(encoding, self.level, request)
+
+
+class DecodingRequest(TimedRequest):
+    """ A timed request whose compressed body, see Content-Encoding, is decoded before it is handled. """
+
+    def process(self):
+        encoding = self.getHeader(b'Content-Encoding')
+        if encoding is not None:
+            try:
+                self.content = BytesIO(decompress(self.content.read(), encoding))
+            except DecodingError as error:
+                self.site = self.channel.site
+                self.started = perf_counter()
+                self.setResponseCode(400 if encoding.strip().lower() in ENCODINGS else 415)
+                self.setHeader(b'Content-Type', b'application/json')
+                response = {
+                    "message": str(error),
+                }
+                self.write(json.dumps(response).encode('utf-8'))
+                self.finish()
+                return
+            self.requestHeaders.removeHeader(b'Content-Encoding')
+        super().process()
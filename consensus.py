@@ -0,0 +1,214 @@
+import hashlib
+import logging
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - numpy is optional, the pure Python scan is used instead
+    numpy = None
+
+from block import Block
+
+logger = logging.getLogger(__name__)
+
+INT64_MAX = 2 ** 63 - 1
+
+
+def valid_proof(last_proof, proof):
+    """
+        The legacy proof rule: p % p' == 0 and p' % 9 == 0
+
+        :param last_proof: <int> Previous proof p
+        :param proof: <int> Candidate proof p'
+    """
+
+    return last_proof % proof == 0 and proof % 9 == 0
+
+
+class LegacyRule:
+    """
+        The original proof of work: a proof p' such that p % p' == 0 and p' % 9 == 0,
+        p being the proof of the previous block. It has no adjustable difficulty.
+    """
+
+    name = "legacy"
+
+    def challenge(self, blocks, template):
+        """ What the miner needs to search for a proof of the block after blocks[-1]. """
+        return blocks[-1].proof
+
+    @staticmethod
+    def nonce_limit(last_proof, max_nonce):
+        # Divisors of a positive last proof are never larger than it
+        return max_nonce if last_proof <= 0 else min(max_nonce, last_proof + 1)
+
+    @staticmethod
+    def search(last_proof, start, stop):
+        """
+            Smallest valid proof in [start, stop), None if there is none.
+
+            With numpy the whole range is checked at once, otherwise candidate by candidate.
+        """
+
+        start = max(start, 1)
+        if start >= stop:
+            return None
+
+        if numpy is not None and last_proof <= INT64_MAX and stop <= INT64_MAX:
+            candidates = numpy.arange(start, stop, dtype=numpy.int64)
+            found = numpy.flatnonzero((last_proof % candidates == 0) & (candidates % 9 == 0))
+            return int(candidates[found[0]]) if len(found) else None
+
+        for proof in range(start, stop):
+            if valid_proof(last_proof, proof):
+                return proof
+        return None
+
+    def verify(self, blocks, block):
+        """
+            Check the proof of a block against its parent.
+
+            :param blocks: <list> The chain, at least up to the parent of block
+            :param block: <Block> The block to check
+        """
+
+        if block.index == 0:
+            return True
+        return block.proof > 0 and valid_proof(blocks[block.index - 1].proof, block.proof)
+
+    def work(self, blocks, block):
+        """ Every block weighs the same, the heaviest chain is the longest one. """
+        return 1
+
+    def checkpoint_state(self, blocks, height):
+        """ What checking the blocks after height needs besides the last headers, see checkpoint.py """
+        return {"name": self.name}
+
+    def load_checkpoint_state(self, state):
+        pass
+
+
+class HashTargetRule:
+    """
+        Hash based proof of work: the block hash, read as a number, must be below a target.
+
+        Every retarget_interval blocks the target is scaled by how long the previous interval
+        actually took compared to block_time per block, by at most a factor of 4 either way.
+        Verifying a received block costs no hashing beyond the block hash itself.
+    """
+
+    name = "sha256"
+
+    def __init__(self, block_time=10, retarget_interval=100, initial_target=2 ** 240, max_target=2 ** 255):
+        """
+            :param block_time: <int> Wanted number of seconds between two blocks
+            :param retarget_interval: <int> Number of blocks between two difficulty adjustments
+            :param initial_target: <int> Target of the first interval
+            :param max_target: <int> Easiest target allowed
+        """
+
+        self.block_time = block_time
+        self.retarget_interval = retarget_interval
+        self.initial_target = initial_target
+        self.max_target = max_target
+        # Hash of the last block of the interval before -> target of the interval
+        self.targets = {}
+
+    def target(self, blocks, height):
+        """
+            Target a block at a given height must be below.
+
+            :param blocks: <list> The chain, at least up to height - 1
+            :param height: <int> Height of the block
+        """
+
+        period = height // self.retarget_interval
+        target = self.initial_target
+        # Walk back to the newest interval with a known target, then forward again
+        first_unknown = period
+        while first_unknown > 0:
+            boundary = blocks[first_unknown * self.retarget_interval - 1].hash
+            if boundary in self.targets:
+                target = self.targets[boundary]
+                break
+            first_unknown -= 1
+
+        for each_period in range(first_unknown + 1, period + 1):
+            first = blocks[(each_period - 1) * self.retarget_interval]
+            last = blocks[each_period * self.retarget_interval - 1]
+            expected = self.block_time * (self.retarget_interval - 1)
+            actual = min(max(last.timestamp - first.timestamp, expected / 4), expected * 4)
+            target = min(self.max_target, int(target * actual / expected))
+            self.targets[last.hash] = target
+            logger.info("Retargeted at height %d to %064x", each_period * self.retarget_interval, target)
+
+        return target
+
+    def challenge(self, blocks, template):
+        prefix, suffix = template.proof_template()
+        return prefix, suffix, self.target(blocks, template.index)
+
+    @staticmethod
+    def nonce_limit(challenge, max_nonce):
+        return max_nonce
+
+    @staticmethod
+    def search(challenge, start, stop):
+        """ First proof in [start, stop) putting the block hash below the target, None if there is none. """
+
+        prefix, suffix, target = challenge
+        prefix_hash = hashlib.sha256(prefix)
+        for proof in range(start, stop):
+            block_hash = prefix_hash.copy()
+            block_hash.update(Block.encode_proof(proof) + suffix)
+            if int.from_bytes(block_hash.digest(), 'big') < target:
+                return proof
+        return None
+
+    def verify(self, blocks, block):
+        if block.index == 0:
+            return True
+        return int(block.hash, 16) < self.target(blocks, block.index)
+
+    def work(self, blocks, block):
+        """ Expected number of hashes to find a block, 2**256 / (target + 1). """
+
+        if block.index == 0:
+            return 1
+        return 2 ** 256 // (self.target(blocks, block.index) + 1)
+
+    def checkpoint_state(self, blocks, height):
+        """
+            The target of the interval of the block after height, keyed by the hash of the last
+            block of the interval before, so the walk back in target() stops at it.
+        """
+
+        period = (height + 1) // self.retarget_interval
+        targets = {}
+        if period > 0:
+            self.target(blocks, height + 1)
+            boundary = blocks[period * self.retarget_interval - 1].hash
+            targets[boundary] = self.targets[boundary]
+        return {"name": self.name, "targets": targets}
+
+    def load_checkpoint_state(self, state):
+        self.targets.update(state["targets"])
+
+
+RULES = {
+    LegacyRule.name: LegacyRule,
+    HashTargetRule.name: HashTargetRule,
+}
+
+
+def get_rule(name, **options):
+    """
+        Instantiate a proof rule by name.
+
+        :param name: <str> One of RULES
+        :param options: Keyword arguments for the rule
+    """
+
+    try:
+        return RULES[name](**options)
+    except KeyError:
+        raise ValueError("Unknown proof rule {}, expected one of {}".format(name, ", ".join(sorted(RULES))))
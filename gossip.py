@@ -0,0 +1,329 @@
+import logging
+import random
+import struct
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor, threads
+
+import serialization
+from block import Block
+from blockchain import ACCEPTED, CONNECTED, ORPHAN, REORGANIZED, SIDE_CHAIN
+from metrics import Registry
+from network import peer_url
+from signatures import SignatureVerifier, decode_binary, encode_record
+
+logger = logging.getLogger(__name__)
+
+INV_URL = "http://{}:{}/inv"
+GETDATA_URL = "http://{}:{}/getdata"
+
+BLOCK_ITEM = 0
+# Unsigned transactions, no longer accepted: any peer could spend from any address
+TRANSACTION_ITEM = 1
+SIGNED_TRANSACTION_ITEM = 2
+
+
+class SeenSet:
+    """ Recently seen inventory, the least recently seen items are forgotten first. """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.items = OrderedDict()
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, item):
+        self.items[item] = True
+        self.items.move_to_end(item)
+        while len(self.items) > self.max_size:
+            self.items.popitem(last=False)
+
+    def discard(self, item):
+        self.items.pop(item, None)
+
+
+def encode_items(items):
+    """ /getdata answer, see serialization.py """
+
+    parts = []
+    for kind, payload in items:
+        parts.append(serialization.INVENTORY_ITEM.pack(kind, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_items(content):
+    offset = 0
+    while offset < len(content):
+        kind, length = serialization.INVENTORY_ITEM.unpack_from(content, offset)
+        offset += serialization.INVENTORY_ITEM.size
+        yield kind, content[offset:offset + length]
+        offset += length
+
+
+class Gossip:
+    """
+        Inventory based relay of blocks and transactions.
+
+        New items are announced by id to a random subset of the peers (/inv). A peer asks the
+        announcer only for the items it lacks (/getdata), and once it accepted them announces
+        them in turn to its own random subset, never back to the sender. Ids already seen,
+        including those being fetched, are ignored, so announcements do not loop. Ids a fetch
+        did not bring into the chain or the mempool are forgotten again.
+
+        Transactions travel with their signature and are checked like those of /tx/batch,
+        the ones submitted unsigned, e.g. editing fees, are only mined by their node.
+    """
+
+    def __init__(self, blockchain, peers, peer_client, port, fanout=8, seen_size=100000, on_new_tip=None, registry=None,
+                 verifier=None, batch_delay=0.02):
+        """
+            :param blockchain: <Blockchain> The chain and mempool items are taken from and added to
+            :param peers: <PeerManager> Peers to relay to
+            :param peer_client: <PeerClient> Client used to talk to them
+            :param port: <int> Port the peers listen on
+            :param fanout: <int> Number of peers each item is announced to
+            :param seen_size: <int> Number of ids remembered
+            :param on_new_tip: <function> (Optional) Called when a received block changes the tip
+            :param registry: <Registry> (Optional) Where the relay metrics are registered
+            :param verifier: <SignatureVerifier> (Optional) Checks the signatures of received
+                transactions, one checking them in this process without one
+            :param batch_delay: <float> Seconds transactions wait to be announced with the next
+                ones, 0 to announce each at once
+        """
+
+        self.blockchain = blockchain
+        self.peers = peers
+        self.peer_client = peer_client
+        self.port = port
+        self.fanout = fanout
+        self.seen = SeenSet(seen_size)
+        self.on_new_tip = on_new_tip
+        self.verifier = verifier if verifier is not None else SignatureVerifier(workers=1)
+        self.batch_delay = batch_delay
+        # (blocks, transactions, excluded peers, Deferred) announcements not sent yet
+        self.waiting = []
+        self.flush_call = None
+
+        registry = registry if registry is not None else Registry()
+        self.validation_time = registry.histogram(
+            "peopleschain_block_validation_seconds", "Time to check and connect a block", labels=("source",)
+        )
+        self.relayed = registry.counter(
+            "peopleschain_gossip_items_total", "Blocks and transactions received by gossip", labels=("kind",)
+        )
+        self.inventories_sent = registry.counter(
+            "peopleschain_gossip_inventories_sent_total", "Announcements sent, each batching one or more ids"
+        )
+
+    def has_block(self, block_hash):
+        return self.blockchain.is_main(block_hash) or block_hash in self.blockchain.tree
+
+    def has_transaction(self, tx_id):
+        return tx_id in self.blockchain.unconfimed_transaction or self.blockchain.is_confirmed(tx_id)
+
+    def find_block(self, block_hash):
+        height = self.blockchain.height_of(block_hash)
+        if height is not None:
+            # Blocks below a checkpoint are only headers
+            return self.blockchain.blocks[height] if height >= self.blockchain.first_block_height else None
+        return self.blockchain.tree.side_blocks.get(block_hash)
+
+    def announce(self, blocks=(), transactions=(), exclude=()):
+        """
+            Announce ids to a random subset of the peers.
+
+            Transactions wait batch_delay for the next ones, so a burst goes out as one /inv,
+            one compressed body, per peer. Blocks are announced at once, with the transactions
+            waiting.
+
+            :param blocks: <list> Block hashes
+            :param transactions: <list> Transaction ids
+            :param exclude: <iterable> Peers not to announce to, e.g. the one the items came from
+            :return: <Deferred> Fires once the announcement was sent
+        """
+
+        for item in list(blocks) + list(transactions):
+            self.seen.add(item)
+        if not (blocks or transactions):
+            return defer.succeed(None)
+        sent = defer.Deferred()
+        self.waiting.append((list(blocks), list(transactions), frozenset(exclude), sent))
+        if blocks or self.batch_delay <= 0:
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = reactor.callLater(self.batch_delay, self.flush)
+        return sent
+
+    @defer.inlineCallbacks
+    def flush(self):
+        """ Send the waiting announcements, one /inv per peer. """
+
+        if self.flush_call is not None and self.flush_call.active():
+            self.flush_call.cancel()
+        self.flush_call = None
+        waiting, self.waiting = self.waiting, []
+        try:
+            # Peers are drawn once per set of excluded peers, e.g. once per sender of relayed items
+            candidates = self.peers.snapshot()
+            samples = {}
+            inventories = {}
+            for blocks, transactions, exclude, _ in waiting:
+                if exclude not in samples:
+                    allowed = [node for node in candidates if node not in exclude]
+                    samples[exclude] = random.sample(allowed, min(self.fanout, len(allowed)))
+                for node in samples[exclude]:
+                    node_blocks, node_transactions = inventories.setdefault(node, ({}, {}))
+                    node_blocks.update(dict.fromkeys(blocks))
+                    node_transactions.update(dict.fromkeys(transactions))
+            if not inventories:
+                return
+
+            nodes = list(inventories)
+            requests = []
+            for node in nodes:
+                node_blocks, node_transactions = inventories[node]
+                data = {
+                    "sender": self.peers.own_address,
+                    "blocks": list(node_blocks),
+                    "transactions": list(node_transactions),
+                }
+                requests.append(self.peer_client.request(node, b'POST', peer_url(INV_URL, node, self.port), data))
+            self.inventories_sent.inc(len(requests))
+            results = yield defer.DeferredList(requests, consumeErrors=True)
+            bad_nodes = set()
+            for node, (success, result) in zip(nodes, results):
+                if not success:
+                    logger.info("Announcing to %s failed: %s", node, result.getErrorMessage())
+                    bad_nodes.add(node)
+            self.peers.mark_failure(bad_nodes)
+            self.peers.mark_success(node for node in nodes if node not in bad_nodes)
+        finally:
+            for _, _, _, sent in waiting:
+                sent.callback(None)
+
+    def receive_inventory(self, sender, blocks, transactions):
+        """
+            Handle an announcement: fetch the items we neither have nor are already fetching.
+
+            :return: <dict> The ids requested from the sender
+        """
+
+        wanted_blocks = [block_hash for block_hash in blocks if block_hash not in self.seen and not self.has_block(block_hash)]
+        wanted_transactions = [tx_id for tx_id in transactions if tx_id not in self.seen and not self.has_transaction(tx_id)]
+        if wanted_blocks or wanted_transactions:
+            self.fetch(sender, wanted_blocks, wanted_transactions).addErrback(
+                lambda failure: logger.info("Fetching from %s failed: %s", sender, failure.getErrorMessage())
+            )
+        return {
+            "blocks": wanted_blocks,
+            "transactions": wanted_transactions,
+        }
+
+    def get_data(self, blocks, transactions):
+        """ Encoded blocks and mempool transactions for a /getdata request, unknown ids are skipped. """
+
+        items = []
+        for block_hash in blocks:
+            block = self.find_block(block_hash)
+            if block is not None:
+                items.append((BLOCK_ITEM, block.to_bytes()))
+        mempool = self.blockchain.unconfimed_transaction
+        for tx_id in transactions:
+            transaction = mempool.get(tx_id)
+            signature = mempool.signature(tx_id)
+            if transaction is not None and signature is not None:
+                items.append((SIGNED_TRANSACTION_ITEM, encode_record(transaction, *signature)))
+        return encode_items(items)
+
+    def accept_items(self, sender, items):
+        """
+            Add received blocks to the chain and transactions to the mempool, runs off the reactor thread.
+
+            :return: <tuple> Hashes of the blocks and ids of the transactions to relay, and the orphan blocks
+        """
+
+        relay_blocks = []
+        orphans = []
+        records = []
+        for kind, payload in items:
+            try:
+                if kind == BLOCK_ITEM:
+                    block = Block.from_bytes(payload)
+                    with self.validation_time.time(source="gossip"):
+                        result = self.blockchain.accept_block(block)
+                    self.relayed.inc(kind="block")
+                    if result in (CONNECTED, REORGANIZED, SIDE_CHAIN):
+                        relay_blocks.append(block.hash)
+                    elif result == ORPHAN:
+                        orphans.append(block)
+                elif kind == SIGNED_TRANSACTION_ITEM:
+                    records.extend(decode_binary(payload))
+                elif kind == TRANSACTION_ITEM:
+                    logger.warning("Unsigned transaction from %s ignored", sender)
+            except (ValueError, struct.error) as error:
+                logger.warning("Malformed item from %s: %s", sender, error)
+
+        # The same checks as /tx/batch: a valid signature by the key owning the sender address
+        valid_signatures = self.verifier.verify(records)
+        signed = [record for valid, record in zip(valid_signatures, records) if valid]
+        if len(signed) < len(records):
+            logger.warning("%d transactions from %s have an invalid signature", len(records) - len(signed), sender)
+        received_transactions = [transaction for transaction, _, _ in signed]
+        outcomes = self.blockchain.submit_transactions(
+            received_transactions, [(public_key, signature) for _, public_key, signature in signed]
+        )
+        self.relayed.inc(len(received_transactions), kind="transaction")
+        relay_transactions = [
+            transaction.tx_id for transaction, outcome in zip(received_transactions, outcomes) if outcome == ACCEPTED
+        ]
+        return relay_blocks, orphans, relay_transactions
+
+    def forget_missing(self, blocks, transactions):
+        for block_hash in blocks:
+            if not self.has_block(block_hash):
+                self.seen.discard(block_hash)
+        for tx_id in transactions:
+            if not self.has_transaction(tx_id):
+                self.seen.discard(tx_id)
+
+    @defer.inlineCallbacks
+    def fetch(self, sender, blocks, transactions):
+        for item in blocks + transactions:
+            self.seen.add(item)
+        data = {
+            "blocks": blocks,
+            "transactions": transactions,
+        }
+        tip = self.blockchain.last_block.hash
+        try:
+            content = yield self.peer_client.request(
+                sender, b'POST', peer_url(GETDATA_URL, sender, self.port), data, decode=False
+            )
+            items = list(decode_items(content))
+            # Checking blocks is CPU bound, the reactor keeps serving meanwhile
+            relay_blocks, orphans, relay_transactions = yield threads.deferToThread(self.accept_items, sender, items)
+        finally:
+            # Items the sender failed to send, or sent invalid or altered, are not kept as seen:
+            # a later announcement of the same ids, e.g. by an honest peer, tries again
+            self.forget_missing(blocks, transactions)
+
+        missing_parents = [
+            block.previous_hash for block in orphans if block.previous_hash not in self.seen
+        ]
+        orphans = [block.hash for block in orphans]
+
+        if self.blockchain.last_block.hash != tip and self.on_new_tip is not None:
+            self.on_new_tip()
+        if missing_parents:
+            # The announcer has the parents of its blocks, ask it for them instead of resyncing
+            yield self.fetch(sender, missing_parents, [])
+            relay_blocks.extend(
+                block_hash for block_hash in orphans
+                if self.blockchain.is_main(block_hash) or block_hash in self.blockchain.tree.side_blocks
+            )
+        yield self.announce(relay_blocks, relay_transactions, exclude={sender})
@@ -0,0 +1,104 @@
+"""
+    Concurrency limits of the HTTP routes.
+
+    Expensive routes run through a ConcurrencyLimit: a few requests run at once, a bounded
+    number wait their turn, and the others are turned away at once with 503 and a
+    Retry-After header instead of piling up behind the work already running.
+
+"""
+import functools
+import json
+
+from twisted.internet import defer
+
+# Route name -> (requests running at once, requests waiting), see Node.limits
+ROUTE_LIMITS = {
+    "mine": (1, 4),
+    "block": (4, 64),
+    "batch": (2, 8),
+    "chain": (4, 16),
+    "blocks": (4, 32),
+    "edit": (8, 64),
+}
+
+
+def parse_limits(text):
+    """
+        Limits as written in node.ini, e.g. "mine=1/4, chain=8/32"
+
+        :param text: <str> Comma separated route=running/waiting
+        :return: <dict> Route name -> (running, waiting)
+    """
+
+    limits = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        try:
+            name, value = item.split('=')
+            running, waiting = value.split('/')
+            limits[name.strip()] = (int(running), int(waiting))
+        except ValueError:
+            raise ValueError("Malformed route limit {!r}, expected route=running/waiting".format(item.strip()))
+    return limits
+
+
+class ConcurrencyLimit:
+
+    def __init__(self, concurrency, queue_size, retry_after=1):
+        """
+            :param concurrency: <int> Requests running at once
+            :param queue_size: <int> Requests waiting for one of them to finish
+            :param retry_after: <int> Seconds rejected clients are told to wait
+        """
+
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.retry_after = retry_after
+        self.semaphore = defer.DeferredSemaphore(concurrency)
+        self.rejected = 0
+
+    @property
+    def running(self):
+        return self.concurrency - self.semaphore.tokens
+
+    @property
+    def waiting(self):
+        return len(self.semaphore.waiting)
+
+    def run(self, request, function, *args, **kwargs):
+        """
+            Call function once a slot is free, or reject the request if too many are waiting.
+
+            :return: <Deferred> Fires with the result of function, or the 503 response
+        """
+
+        if self.semaphore.tokens == 0 and self.waiting >= self.queue_size:
+            self.rejected += 1
+            request.setResponseCode(503)
+            request.setHeader(b'Retry-After', str(self.retry_after).encode('ascii'))
+            response = {
+                "message": "Node busy, retry in {} s".format(self.retry_after),
+            }
+            return defer.succeed(json.dumps(response))
+        return self.semaphore.run(function, *args, **kwargs)
+
+    def to_dict(self):
+        return {
+            "concurrency": self.concurrency,
+            "queue_size": self.queue_size,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+def limited(name):
+    """ Run a route of a Node through its limit of that name, see Node.limits """
+
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(self, request, *args, **kwargs):
+            return self.limits[name].run(request, route, self, request, *args, **kwargs)
+        return wrapper
+    return decorator
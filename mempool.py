@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Mempool:
+    """
+        Unconfirmed transactions, keyed by tx_id.
+
+        Two heaps order the transactions by amount (the fee paid) and arrival: one gives the
+        best transactions for the next block, the other the worst ones to evict when the pool
+        is full. Removed transactions are dropped from the heaps lazily, so removing k
+        confirmed transactions costs O(k).
+    """
+
+    def __init__(self, max_size=50000):
+        """
+            :param max_size: <int> Maximum number of transactions held
+        """
+
+        self.max_size = max_size
+        self.transactions = {}      # tx_id -> transaction, in arrival order
+        self.arrivals = {}          # tx_id -> arrival sequence number
+        self.senders = {}           # handle -> set of tx_id
+        self.signatures = {}        # tx_id -> (public key, signature) of the signed ones, relayed with them
+        self.best = []              # (-amount, arrival, tx_id)
+        self.worst = []             # (amount, -arrival, tx_id)
+        self.sequence = itertools.count()
+        # Changes with every transaction added or removed, e.g. to key cached answers
+        self.version = 0
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.transactions
+
+    def __iter__(self):
+        return iter(list(self.transactions.values()))
+
+    def get(self, tx_id):
+        return self.transactions.get(tx_id)
+
+    def signature(self, tx_id):
+        """ (public key, signature) a transaction was submitted with, None if it was not signed. """
+        return self.signatures.get(tx_id)
+
+    def from_sender(self, handle):
+        """ Unconfirmed transactions sent by an address, in arrival order. """
+        return [self.transactions[tx_id] for tx_id in sorted(self.senders.get(handle, ()), key=self.arrivals.get)]
+
+    def add(self, transaction, signature=None):
+        """
+            Add a transaction, evicting the lowest paying one if the pool is full.
+
+            :param transaction: <Transaction> The transaction to add
+            :param signature: <tuple> (Optional) (public key, signature) it was checked with
+            :return: <bool> False if it is already known or pays too little to get in
+        """
+
+        if transaction.tx_id in self.transactions:
+            return False
+
+        if len(self.transactions) >= self.max_size:
+            lowest = self.peek_worst()
+            if lowest is None or lowest.amount >= transaction.amount:
+                return False
+            logger.info("Mempool full, evicting %s", lowest.tx_id)
+            self.remove(lowest.tx_id)
+
+        arrival = next(self.sequence)
+        self.transactions[transaction.tx_id] = transaction
+        self.arrivals[transaction.tx_id] = arrival
+        self.senders.setdefault(transaction.handle, set()).add(transaction.tx_id)
+        if signature is not None:
+            self.signatures[transaction.tx_id] = signature
+        heapq.heappush(self.best, (-transaction.amount, arrival, transaction.tx_id))
+        heapq.heappush(self.worst, (transaction.amount, -arrival, transaction.tx_id))
+        self.version += 1
+        return True
+
+    def remove(self, tx_id):
+        """ Remove a transaction, returning it or None if it is not in the pool. """
+
+        transaction = self.transactions.pop(tx_id, None)
+        if transaction is None:
+            return None
+        del self.arrivals[tx_id]
+        self.signatures.pop(tx_id, None)
+        self.version += 1
+        sender = self.senders[transaction.handle]
+        sender.discard(tx_id)
+        if not sender:
+            del self.senders[transaction.handle]
+        self.compact()
+        return transaction
+
+    def remove_confirmed(self, transactions):
+        """ Drop the transactions of a block that was just added to the chain. """
+
+        for transaction in transactions:
+            self.remove(transaction.tx_id)
+
+    def is_live(self, entry):
+        tx_id = entry[2]
+        arrival = entry[1] if entry[1] >= 0 else -entry[1]
+        return self.arrivals.get(tx_id) == arrival
+
+    def peek_worst(self):
+        while self.worst and not self.is_live(self.worst[0]):
+            heapq.heappop(self.worst)
+        return self.transactions[self.worst[0][2]] if self.worst else None
+
+    def pop(self):
+        """ Remove and return the best paying transaction, None if the pool is empty. """
+
+        while self.best:
+            entry = heapq.heappop(self.best)
+            if self.is_live(entry):
+                return self.remove(entry[2])
+        return None
+
+    def select(self, max_transactions):
+        """
+            Block template: the best paying transactions, earliest first among equal amounts.
+            They stay in the pool until the block is added.
+
+            :param max_transactions: <int> Maximum number of transactions in the block
+        """
+
+        live = (entry for entry in self.best if self.is_live(entry))
+        return [self.transactions[entry[2]] for entry in heapq.nsmallest(max_transactions, live)]
+
+    def compact(self):
+        """ Rebuild the heaps once most of their entries belong to removed transactions. """
+
+        if len(self.best) > 2 * len(self.transactions) + 64:
+            self.best = [entry for entry in self.best if self.is_live(entry)]
+            heapq.heapify(self.best)
+            self.worst = [entry for entry in self.worst if self.is_live(entry)]
+            heapq.heapify(self.worst)
@@ -0,0 +1,91 @@
+"""
+    Merkle tree over the transaction ids of a block.
+
+    Leaves are the raw 32 bytes of each tx_id. A parent is the sha256 of its two children;
+    a level with an odd number of nodes pairs its last node with itself. The root of a
+    block without transactions is 32 zero bytes.
+
+    That pairing means the ids [a, b, c, c] have the root of [a, b, c], so a block could be
+    altered without changing its hash. merkle_root refuses repeated ids and any level where
+    two siblings are equal, the form every such alteration takes.
+
+"""
+import hashlib
+
+EMPTY_ROOT = bytes(32)
+
+LEFT = "left"
+RIGHT = "right"
+
+
+class MutatedTree(ValueError):
+    pass
+
+
+def hash_pair(left, right):
+    return hashlib.sha256(left + right).digest()
+
+
+def next_level(level):
+    if len(level) % 2:
+        level = level + [level[-1]]
+    return [hash_pair(level[position], level[position + 1]) for position in range(0, len(level), 2)]
+
+
+def merkle_root(tx_ids):
+    """
+        :param tx_ids: <list> Hex transaction ids, in block order
+        :return: <bytes> The 32 byte root
+        :raises MutatedTree: If an id repeats or two siblings are equal
+    """
+
+    level = [bytes.fromhex(tx_id) for tx_id in tx_ids]
+    if not level:
+        return EMPTY_ROOT
+    if len(set(level)) != len(level):
+        raise MutatedTree("Transaction ids repeat")
+    while len(level) > 1:
+        for position in range(0, len(level) - 1, 2):
+            if level[position] == level[position + 1]:
+                raise MutatedTree("Merkle tree has two equal siblings")
+        level = next_level(level)
+    return level[0]
+
+
+def merkle_branch(tx_ids, position):
+    """
+        Sibling hashes from a leaf up to the root.
+
+        :param tx_ids: <list> Hex transaction ids, in block order
+        :param position: <int> Position of the transaction in the block
+        :return: <list> (hex sibling hash, side of the sibling) pairs, leaf level first
+    """
+
+    level = [bytes.fromhex(tx_id) for tx_id in tx_ids]
+    branch = []
+    while len(level) > 1:
+        if position % 2:
+            branch.append((level[position - 1].hex(), LEFT))
+        else:
+            sibling = level[position + 1] if position + 1 < len(level) else level[position]
+            branch.append((sibling.hex(), RIGHT))
+        level = next_level(level)
+        position //= 2
+    return branch
+
+
+def verify_branch(tx_id, branch, root):
+    """
+        Check that a transaction is committed to by a Merkle root.
+
+        :param tx_id: <str> Hex transaction id
+        :param branch: <list> Output of merkle_branch
+        :param root: <str> Hex Merkle root of the block
+        :return: <bool> True if the branch leads from tx_id to root
+    """
+
+    node = bytes.fromhex(tx_id)
+    for sibling, side in branch:
+        sibling = bytes.fromhex(sibling)
+        node = hash_pair(sibling, node) if side == LEFT else hash_pair(node, sibling)
+    return node.hex() == root
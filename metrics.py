@@ -0,0 +1,295 @@
+"""
+    Node metrics in the Prometheus text exposition format, and a sampling profiler.
+
+    Counters, gauges and histograms are registered by name in a Registry, which renders
+    them all for /metrics. A metric built with a function is read when it is rendered
+    instead of being updated, e.g. the size of the mempool.
+
+"""
+import sys
+import threading
+import traceback
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from time import perf_counter
+
+from twisted.web.resource import EncodingResourceWrapper
+from twisted.web.server import Request, Site
+from werkzeug.exceptions import HTTPException
+
+CONTENT_TYPE = b'text/plain; version=0.0.4'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        """
+            :param name: <str> Metric name
+            :param documentation: <str> Help text
+            :param labels: <tuple> Label names
+            :param function: <function> (Optional) Returns the value when rendered, or without
+                labels, or a dict of label values tuple -> value with them
+        """
+
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.function = function
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def current(self):
+        if self.function is None:
+            with self.lock:
+                return dict(self.values)
+        value = self.function()
+        if not self.labels:
+            return {} if value is None else {(): value}
+        return {key: value for key, value in value.items() if value is not None}
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for key, value in sorted(self.current().items()):
+            lines.append("{}{} {}".format(self.name, format_labels(self.labels, key), format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+    """ Observations counted in cumulative buckets, with their count and sum. """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            # A new list, so a render holding the previous one never sees it change
+            counts = list(counts)
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[position] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for key, (counts, total) in sorted(self.current().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append("{}_bucket{} {}".format(
+                    self.name, format_labels(self.labels, key, [("le", format_value(bound))]), cumulative
+                ))
+            lines.append("{}_count{} {}".format(self.name, format_labels(self.labels, key), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, format_labels(self.labels, key), format_value(total)))
+        return lines
+
+
+class Registry:
+    """ The metrics of a node, by name. Registering a name twice returns the existing metric. """
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.labels != metric.labels:
+                raise ValueError("Metric {} is already registered differently".format(metric.name))
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=(), function=None):
+        return self.register(Counter(name, documentation, labels, function))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        for name in sorted(self.metrics):
+            lines.extend(self.metrics[name].render())
+        return "\n".join(lines) + "\n"
+
+
+class TimedRequest(Request):
+    """ A request that records its latency, from the moment it is processed to the last byte written. """
+
+    def process(self):
+        self.started = perf_counter()
+        super().process()
+
+    def finish(self):
+        super().finish()
+        self.site.record(self, perf_counter() - self.started)
+
+
+class MetricsSite(Site):
+    """ A Site for a Klein app that times every request by the route it matched. """
+
+    requestFactory = TimedRequest
+
+    def __init__(self, app, histogram, encoders=(), **kwargs):
+        """
+            :param app: <Klein> The application, its routes label the requests
+            :param histogram: <Histogram> Latencies, labelled by route and method
+            :param encoders: <list> (Optional) Encoder factories of the answers, e.g. compression
+        """
+
+        resource = app.resource()
+        if encoders:
+            resource = EncodingResourceWrapper(resource, list(encoders))
+        super().__init__(resource, **kwargs)
+        self.app = app
+        self.histogram = histogram
+
+    def route_of(self, request):
+        """ The rule a request matched, e.g. /view/<address>, so paths with ids share a label. """
+
+        try:
+            rule, _ = self.app.url_map.bind("").match(
+                request.path.decode('utf-8', 'replace'), request.method.decode('ascii', 'replace'), return_rule=True
+            )
+            return rule.rule
+        except HTTPException:
+            return "unmatched"
+
+    def record(self, request, seconds):
+        self.histogram.observe(seconds, route=self.route_of(request), method=request.method.decode('ascii', 'replace'))
+
+
+class StackSampler:
+    """
+        Sampling profiler: a thread that records the stack of every other thread at a fixed
+        interval, so the hottest stacks can be dumped without instrumenting the code.
+        Costs nothing until started.
+    """
+
+    def __init__(self, interval=0.01, max_depth=30):
+        """
+            :param interval: <float> Seconds between two samples
+            :param max_depth: <int> Innermost frames kept per stack
+        """
+
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = StackCounter()
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, interval=None):
+        if self.running:
+            return False
+        if interval is not None:
+            self.interval = interval
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        if not self.running:
+            return False
+        self.stopping.set()
+        self.thread.join()
+        return True
+
+    def run(self):
+        own_id = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            stacks = []
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = traceback.extract_stack(frame)[-self.max_depth:]
+                stacks.append(";".join("{}:{}:{}".format(f.filename.rsplit('/', 1)[-1], f.name, f.lineno) for f in frames))
+            with self.lock:
+                self.stacks.update(stacks)
+                self.samples += 1
+
+    def dump(self, limit=50):
+        """
+            The most sampled stacks in the collapsed format of flame graph tools, outermost frame
+            first: "file:function:line;...;file:function:line count"
+        """
+
+        with self.lock:
+            stacks = self.stacks.most_common(limit)
+        return "\n".join("{} {}".format(stack, count) for stack, count in stacks) + "\n"
+
+    def to_dict(self):
+        return {
+            "running": self.running,
+            "interval": self.interval,
+            "samples": self.samples,
+        }
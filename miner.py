@@ -0,0 +1,143 @@
+import logging
+import multiprocessing
+import os
+import threading
+from time import time
+
+logger = logging.getLogger(__name__)
+
+# Set in each worker process by init_worker
+cancel_event = None
+candidates_counter = None
+
+
+def init_worker(event, counter):
+    global cancel_event, candidates_counter
+    cancel_event = event
+    candidates_counter = counter
+
+
+def scan(search, challenge, worker, workers, batch_size, max_nonce):
+    """
+        Scan every workers-th batch of the nonce space, starting with batch number worker.
+
+        Stops at the first valid proof, at max_nonce, or when another worker found one.
+
+        :param search: <function> search(challenge, start, stop) of the proof rule
+        :param challenge: What the proof rule needs to check a candidate
+    """
+
+    start = 1 + worker * batch_size
+    while start < max_nonce and not cancel_event.is_set():
+        stop = min(start + batch_size, max_nonce)
+        proof = search(challenge, start, stop)
+        with candidates_counter.get_lock():
+            candidates_counter.value += stop - start
+        if proof is not None:
+            cancel_event.set()
+            return proof
+        start += workers * batch_size
+    return None
+
+
+class Miner:
+    """
+        Proof of work engine running in a pool of worker processes.
+
+        The nonce space is split in batches handed out round robin to the workers, each
+        batch is checked by the proof rule in one step (vectorized for the legacy rule).
+        mine() blocks until a proof is found or the job is cancelled, so it must run off
+        the reactor thread.
+    """
+
+    def __init__(self, workers=None, batch_size=100000, max_nonce=2 ** 40):
+        """
+            :param workers: <int> (Optional) Number of worker processes, one per core by default
+            :param batch_size: <int> Number of candidates checked at once
+            :param max_nonce: <int> Upper bound of the nonce space
+        """
+
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.max_nonce = max_nonce
+        self.cancel_event = multiprocessing.Event()
+        self.candidates = multiprocessing.Value('Q', 0)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.job = None
+        self.last_job = None
+        # Candidates checked by the finished jobs
+        self.total_candidates = 0
+
+    def start_pool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(
+                self.workers, initializer=init_worker, initargs=(self.cancel_event, self.candidates)
+            )
+        return self.pool
+
+    def mine(self, rule, challenge, height=None):
+        """
+            Find a proof for the next block.
+
+            :param rule: <object> The proof rule, see consensus.py
+            :param challenge: What the rule needs to search, from rule.challenge
+            :param height: <int> (Optional) Height of the block being mined, for status only
+            :return: <int> The proof, None if cancelled or the nonce space is exhausted
+        """
+
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("Already mining")
+        try:
+            pool = self.start_pool()
+            self.cancel_event.clear()
+            with self.candidates.get_lock():
+                self.candidates.value = 0
+            self.job = {"height": height, "rule": rule.name, "started": time()}
+
+            max_nonce = rule.nonce_limit(challenge, self.max_nonce)
+            results = [
+                pool.apply_async(scan, (rule.search, challenge, worker, self.workers, self.batch_size, max_nonce))
+                for worker in range(self.workers)
+            ]
+            proofs = [proof for proof in (result.get() for result in results) if proof is not None]
+
+            job = dict(self.job, finished=time(), candidates=self.candidates.value)
+            job["proof"] = min(proofs) if proofs else None
+            job["cancelled"] = not proofs and self.cancel_event.is_set()
+            self.last_job = job
+            self.total_candidates += job["candidates"]
+            return job["proof"]
+        finally:
+            self.job = None
+            self.lock.release()
+
+    def cancel(self):
+        """ Stop the running job, e.g. because a competing block arrived. """
+        if self.job is not None:
+            logger.info("Cancelling mining of block %s", self.job["height"])
+            self.cancel_event.set()
+
+    def status(self):
+        job = self.job
+        if job is None:
+            return {"mining": False, "last_job": self.last_job, "workers": self.workers}
+
+        elapsed = time() - job["started"]
+        candidates = self.candidates.value
+        return {
+            "mining": True,
+            "height": job["height"],
+            "elapsed": elapsed,
+            "candidates": candidates,
+            "candidates_per_second": candidates / elapsed if elapsed else 0,
+            "workers": self.workers,
+            "last_job": self.last_job,
+        }
+
+    def close(self):
+        if self.pool is not None:
+            self.cancel_event.set()
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
@@ -0,0 +1,192 @@
+import json
+import logging
+from collections import deque
+from io import BytesIO
+from time import perf_counter
+
+from twisted.internet import defer, reactor
+from twisted.web.client import Agent, FileBodyProducer, HTTPConnectionPool, readBody
+from twisted.web.http_headers import Headers
+
+from compression import ACCEPT_ENCODING, MIN_COMPRESSED_SIZE, choose_encoding, compress, decompress
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT = b'application/json'
+BINARY_CONTENT = b'application/octet-stream'
+
+
+class PeerError(Exception):
+    pass
+
+
+def peer_url(url_template, node, port):
+    """
+        Fill a URL template for a peer.
+
+        :param node: <str> The peer, "host", or "host:port" when it does not listen on the common port
+        :param port: <int> The common port of the network
+    """
+
+    host, _, node_port = node.partition(':')
+    return url_template.format(host, node_port or port)
+
+
+class PeerStats:
+    """ Request counts and recent latencies of a single peer. """
+
+    def __init__(self, window=100):
+        self.requests = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds, success, sent=0, received=0):
+        self.requests += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        if success:
+            self.latencies.append(seconds)
+        else:
+            self.failures += 1
+
+    def to_dict(self):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "last_latency": self.latencies[-1] if self.latencies else None,
+            "mean_latency": sum(latencies) / len(latencies) if latencies else None,
+            "p99_latency": latencies[int(len(latencies) * 0.99)] if latencies else None,
+        }
+
+
+class PeerClient:
+    """
+        Non-blocking JSON requests to peers.
+
+        Requests go through Twisted's Agent with a persistent connection pool, so each
+        peer keeps a few open connections instead of one TCP handshake per message, and
+        never block the reactor. Every request has a timeout and its latency is recorded
+        per peer. With a compression level, answers are asked for compressed and bodies
+        are compressed for the peers whose answers advertised an encoding, see compression.py
+    """
+
+    def __init__(self, timeout=10, connections_per_peer=4, compression_level=None):
+        """
+            :param timeout: <int> Seconds before a request to a peer is abandoned
+            :param connections_per_peer: <int> Idle connections kept open per peer
+            :param compression_level: <int> (Optional) zlib level of the bodies sent, None to
+                neither send nor ask for compressed bodies
+        """
+
+        self.timeout = timeout
+        self.compression_level = compression_level
+        # peer -> encoding it accepts for request bodies, learnt from its answers
+        self.request_encodings = {}
+        self.pool = HTTPConnectionPool(reactor, persistent=True)
+        self.pool.maxPersistentPerHost = connections_per_peer
+        self.agent = Agent(reactor, connectTimeout=timeout, pool=self.pool)
+        self.stats = {}
+
+    def peer_stats(self, node):
+        if node not in self.stats:
+            self.stats[node] = PeerStats()
+        return self.stats[node]
+
+    @defer.inlineCallbacks
+    def request(self, node, method, url, data=None, body=None, decode=True):
+        """
+            Send a request to a peer and decode its JSON answer.
+
+            :param node: <str> The peer, used for latency accounting
+            :param method: <bytes> HTTP method
+            :param url: <str> Full URL
+            :param data: <dict> (Optional) Body, sent as JSON
+            :param body: <bytes> (Optional) Binary body, sent instead of data
+            :param decode: <bool> False to get the raw response body
+            :return: <Deferred> Fires with the decoded response
+        """
+
+        content_type = JSON_CONTENT
+        if body is not None:
+            content_type = BINARY_CONTENT
+        elif data is not None:
+            body = json.dumps(data).encode('utf-8')
+        headers = Headers({b'Content-Type': [content_type]})
+        if self.compression_level is not None:
+            headers.setRawHeaders(b'Accept-Encoding', [ACCEPT_ENCODING])
+            encoding = self.request_encodings.get(node)
+            if body is not None and encoding is not None and len(body) >= MIN_COMPRESSED_SIZE:
+                body = compress(body, encoding, self.compression_level)
+                headers.setRawHeaders(b'Content-Encoding', [encoding])
+        producer = None if body is None else FileBodyProducer(BytesIO(body))
+
+        sent = len(body) if body is not None else 0
+        started = perf_counter()
+        try:
+            deferred = self.agent.request(method, url.encode('utf-8'), headers, producer)
+            deferred.addTimeout(self.timeout, reactor)
+            response = yield deferred
+            content = yield readBody(response)
+            received = len(content)
+            if self.compression_level is not None:
+                self.request_encodings[node] = choose_encoding(b','.join(response.headers.getRawHeaders(b'Accept-Encoding', [])))
+            if response.code != 200:
+                raise PeerError("{} answered {}".format(node, response.code))
+            encoding = response.headers.getRawHeaders(b'Content-Encoding')
+            if encoding:
+                content = decompress(content, encoding[-1])
+            if decode:
+                result = json.loads(content) if content else None
+            else:
+                result = content
+        except Exception:
+            self.peer_stats(node).record(perf_counter() - started, False, sent)
+            raise
+        self.peer_stats(node).record(perf_counter() - started, True, sent, received)
+        return result
+
+    def get_json(self, node, url):
+        return self.request(node, b'GET', url)
+
+    def post_json(self, node, url, data):
+        return self.request(node, b'POST', url, data)
+
+    def post_bytes(self, node, url, body):
+        return self.request(node, b'POST', url, body=body)
+
+    def broadcast(self, nodes, url_template, port, data=None, body=None):
+        """
+            POST the same payload to many peers at once.
+
+            :param nodes: <iterable> Peers to send to
+            :param url_template: <str> URL with placeholders for host and port
+            :param port: <int> Port the peers listen on
+            :param data: <dict> (Optional) Body, sent as JSON
+            :param body: <bytes> (Optional) Binary body, sent instead of data
+            :return: <Deferred> Fires with the set of peers that failed
+        """
+
+        nodes = list(nodes)
+        requests = [
+            self.request(node, b'POST', peer_url(url_template, node, port), data, body)
+            for node in nodes
+        ]
+        deferred = defer.DeferredList(requests, consumeErrors=True)
+
+        def collect_failures(results):
+            bad_nodes = set()
+            for node, (success, result) in zip(nodes, results):
+                if not success:
+                    logger.info("Broadcast to %s failed: %s", node, result.getErrorMessage())
+                    bad_nodes.add(node)
+            return bad_nodes
+
+        return deferred.addCallback(collect_failures)
+
+    def close(self):
+        return self.pool.closeCachedConnections()
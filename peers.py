@@ -0,0 +1,205 @@
+import logging
+import socket
+from time import time
+
+import requests
+from twisted.internet import defer, task
+
+from network import peer_url
+
+logger = logging.getLogger(__name__)
+
+NODES_URL = "http://{}:{}/nodes"
+LOCAL_ADDRESS = "127.0.0.1"
+
+
+def resolve_own_address(fallback=LOCAL_ADDRESS):
+    """
+        Address of the interface used for outgoing traffic.
+
+        Connecting a UDP socket sends nothing, it only asks the kernel for a route. Without
+        any route (no network) the fallback is returned.
+    """
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.connect(('8.8.8.8', 80))
+        return s.getsockname()[0]
+    except OSError:
+        return fallback
+    finally:
+        s.close()
+
+
+def listed_nodes(answer):
+    """ Peers listed in a /nodes answer, None if the answer is not usable. """
+
+    nodes = answer.get("full_nodes") if isinstance(answer, dict) else None
+    if not isinstance(nodes, list) or not all(isinstance(node, str) for node in nodes):
+        return None
+    return nodes
+
+
+class PeerRecord:
+    """ What we know about one peer. """
+
+    def __init__(self):
+        self.last_seen = None
+        self.failures = 0
+        # Moving average of request outcomes, 1.0 when every request succeeds
+        self.score = 1.0
+
+    def success(self):
+        self.last_seen = time()
+        self.failures = 0
+        self.score = 0.8 * self.score + 0.2
+
+    def failure(self):
+        self.failures += 1
+        self.score = 0.8 * self.score
+
+    def to_dict(self):
+        return {
+            "last_seen": self.last_seen,
+            "failures": self.failures,
+            "score": self.score,
+        }
+
+
+class PeerManager:
+    """
+        The table of peers and this node's own address.
+
+        The own address is resolved once, unless configured, and refreshed with the peer
+        table on a background timer instead of on every message. Broadcasts work on a
+        snapshot of the table rather than crawling the network before each send.
+    """
+
+    def __init__(self, seeds, port, peer_client, own_address=None, refresh_interval=60, max_failures=3):
+        """
+            :param seeds: <iterable> Peers known at startup
+            :param port: <int> Port the peers listen on
+            :param peer_client: <PeerClient> Client used for background refreshes
+            :param own_address: <str> (Optional) Configured address of this node, skips resolution
+            :param refresh_interval: <int> Seconds between two refreshes of the peer table
+            :param max_failures: <int> Consecutive failures after which a peer is dropped
+        """
+
+        self.port = port
+        self.peer_client = peer_client
+        self.configured_address = own_address
+        self.refresh_interval = refresh_interval
+        self.max_failures = max_failures
+        self.peers = {}
+        self.refresher = None
+
+        self.own_address = own_address or resolve_own_address()
+        for node in seeds:
+            self.add(node)
+
+    def resolve(self):
+        """ Re-resolve the own address, e.g. after the network interface changed. """
+
+        if self.configured_address is not None:
+            return self.own_address
+        address = resolve_own_address(fallback=self.own_address)
+        if address != self.own_address:
+            logger.info("Own address changed from %s to %s", self.own_address, address)
+            self.peers.pop(address, None)
+            self.own_address = address
+        return address
+
+    def add(self, node):
+        if node and node != self.own_address and node not in self.peers:
+            self.peers[node] = PeerRecord()
+
+    def update(self, nodes):
+        for node in nodes:
+            self.add(node)
+
+    def remove(self, nodes):
+        for node in nodes:
+            self.peers.pop(node, None)
+
+    def mark_success(self, nodes):
+        for node in nodes:
+            if node in self.peers:
+                self.peers[node].success()
+
+    def mark_failure(self, nodes):
+        """ Lower the score of peers that failed, dropping those failing too often. """
+
+        for node in nodes:
+            record = self.peers.get(node)
+            if record is None:
+                continue
+            record.failure()
+            if record.failures >= self.max_failures:
+                logger.info("Dropping unreachable peer %s", node)
+                del self.peers[node]
+
+    def snapshot(self):
+        """ Current peers, healthiest first. """
+        return sorted(self.peers, key=lambda node: self.peers[node].score, reverse=True)
+
+    def __contains__(self, node):
+        return node in self.peers
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self.peers)
+
+    def crawl_blocking(self):
+        """ Ask every peer for its peers, with blocking requests. Used at startup before the reactor runs. """
+
+        found = set()
+        for node in self.snapshot():
+            try:
+                response = requests.get(peer_url(NODES_URL, node, self.port), timeout=self.peer_client.timeout)
+                nodes = listed_nodes(response.json()) if response.status_code == 200 else None
+                if nodes is not None:
+                    found.update(nodes)
+                    self.mark_success([node])
+                    continue
+            except (requests.exceptions.RequestException, ValueError):
+                pass
+            self.mark_failure([node])
+        self.update(found)
+
+    @defer.inlineCallbacks
+    def refresh(self):
+        """ Ask every peer for its peers without blocking, updating last-seen and health. """
+
+        self.resolve()
+        nodes = self.snapshot()
+        results = yield defer.DeferredList(
+            [self.peer_client.get_json(node, peer_url(NODES_URL, node, self.port)) for node in nodes],
+            consumeErrors=True
+        )
+
+        found = set()
+        for node, (success, all_nodes) in zip(nodes, results):
+            listed = listed_nodes(all_nodes) if success else None
+            if listed is not None:
+                found.update(listed)
+                self.mark_success([node])
+            else:
+                self.mark_failure([node])
+        self.update(found)
+
+    def start(self):
+        """ Refresh the peer table every refresh_interval seconds from now on. """
+
+        self.refresher = task.LoopingCall(self.refresh)
+        self.refresher.start(self.refresh_interval, now=False).addErrback(
+            lambda failure: logger.warning("Peer refresh stopped: %s", failure.getErrorMessage())
+        )
+
+    def stop(self):
+        if self.refresher is not None and self.refresher.running:
+            self.refresher.stop()
+
+    def to_dict(self):
+        return {node: record.to_dict() for node, record in self.peers.items()}
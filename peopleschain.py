@@ -1,26 +1,57 @@
 import pyelliptic
 import json
+import serialization
 import hashlib
-import socket
-
-from blockchain import Blockchain
+import struct
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from blockchain import Blockchain, ACCEPTED, BLOCK_REWARD, CONNECTED, INVALID, KNOWN, NETWORK, ORPHAN, REORGANIZED, SIDE_CHAIN
+from blockstore import BlockStore
+from cache import LRUCache, ResponseCache
+from compression import CompressionEncoderFactory, DecodingRequest
+from consensus import get_rule, valid_proof
+from gossip import Gossip
+from limits import ROUTE_LIMITS, ConcurrencyLimit, limited, parse_limits
+from metrics import CONTENT_TYPE, MetricsSite, Registry, StackSampler
+from miner import Miner
+from network import PeerClient, peer_url
+from peers import PeerManager, resolve_own_address
+from signatures import MalformedRecord, SignatureVerifier, decode_binary, decode_lines, load_key, new_key
+from sync import ChainSync, CheckpointSync, SyncError, MAX_BLOCKS, MAX_HEADERS
 from transaction import Transaction
 from block import Block
+from checkpoint import CHUNK_SIZE, Checkpoint
 from profile import Profile
 
 import requests
 from klein import Klein
+from twisted.internet import defer, reactor, task, threads
+from twisted.python import log
 from uuid import uuid4
 
+import argparse
 import configparser
+import logging
 import os.path
+import sys
+
+logger = logging.getLogger(__name__)
 
 FULL_NODE_PORT = 19003
-NODES_URL = "http://{}:{}/nodes"
+BLOCK_STORE_PATH = os.path.join("data", "blocks")
 NEW_NODES_URL = "http://{}:{}/nodes/register"
-NEW_BLOCK_URL = "http://{}:{}/block/new"
 NEW_USER_URL = "http://{}:{}/user/add"
-CHAIN_URL = "http://{}:{}/chain"
+USERS_URL = "http://{}:{}/users"
+# Transactions per page of /address/<address>/history
+MAX_HISTORY = 1000
+
+BLOCK_MESSAGES = {
+    SIDE_CHAIN: "Block added to a side chain",
+    ORPHAN: "Block kept until its parent arrives",
+    KNOWN: "Block already known",
+    INVALID: "Invalid block",
+}
 
 class Node:
 
@@ -32,228 +63,372 @@ class Node:
     if os.path.exists('node.ini'):
 
         # Read the required variables - Node Identifier, Blockchain, privatekey, other file paths
-        pass
+        config.read('node.ini')
     else:
         # TODO : Generate a privatekey key for the node_identifier
         config['DEFAULT'] = {'ServerAliveInterval': 45,
             'Compression': 'yes',
-            'CompressionLevel': '3'
+            'CompressionLevel': '3',
+            'Port': FULL_NODE_PORT,
+            'ProofRule': 'legacy',
+            'MaxBlockTransactions': 1000,
+            'MaxBatchTransactions': 10000,
+            'GossipFanout': 8,
+            'GossipBatchMs': 20,
+            'LogLevel': 'INFO',
+            'Profiling': 'no',
+            'CheckpointQuorum': 0,
+            'TrustedCheckpointKeys': '',
+            'RouteLimits': '',
+            'RetryAfter': 1,
+            'ResponseCacheMB': 32,
+            'BlockCacheMB': 32,
             }
         config['NODE-ID'] = {}
 
-    def __init__(self, node_identifier=None, blockchain=None):
+    def __init__(self, node_identifier=None, blockchain=None, seeds=None, own_address=None, port=None, serve=True):
         """
             :param node_identifier: <str> (Optional) A Globally unique Identifier for each node, also acts as wallet address
             :param blockchain: <blockchain> (Optional) If a global uuid exists, so will a blockchain file/object.
+            :param seeds: <list> (Optional) Peers to start from, instead of the ones in node.ini
+            :param own_address: <str> (Optional) Address peers reach this node at, instead of the host in node.ini
+            :param port: <int> (Optional) Port to listen on, instead of the one in node.ini. Peers are
+                expected on the same port unless their address is given as "host:port"
+            :param serve: <bool> False to build the node without starting its workers and HTTP server,
+                e.g. to serve several nodes from one reactor
         """
 
+        self.port = port or self.config['NODE-ID'].getint('Port', FULL_NODE_PORT)
+        # Level of the compressed traffic with peers and clients, None when disabled
+        self.compression_level = None
+        if self.config['NODE-ID'].getboolean('Compression', True):
+            self.compression_level = self.config['NODE-ID'].getint('CompressionLevel', 3)
+        self.chain_sync = None
+        # Set when the chain must be brought up to date from the peers once the node runs
+        self.sync_pending = False
+        self.checkpoint = None
+        own_address = own_address or self.config['NODE-ID'].get('host')
+        if own_address is None and self.port != FULL_NODE_PORT:
+            # Several nodes may share the host, each on its own port
+            own_address = "{}:{}".format(resolve_own_address(), self.port)
+
         if node_identifier is None and blockchain is None:
             # Generate a globally unique address for this node
             self.node_identifier = str(uuid4()).replace('-','')
             self.config['NODE-ID']['node_identifier'] = self.node_identifier
 
-            self.peer_nodes = set(['192.168.2.10']) #TODO: figure out how to deal with first node
-            self.config['NODE-ID']['peer_nodes'] = ', '.join(self.peer_nodes)
-
-            existing_chain = self.synchronize()
-
-            if existing_chain is not None:
-                # TODO: add functions to initiate transaction and block from JSON
-
-                remote_blocks = []
-                remote_users = []
-                for block in existing_chain["Blocks"]:
-                    current_transactions = []
-                    for block_transaction in existing_chain["Blocks"][block]["transactions"]:
-                        block_transaction_json = json.loads(block_transaction)
-                        current_amount = block_transaction_json["amount"]
-                        current_destination = block_transaction_json["destination"]
-                        current_handle = block_transaction_json["handle"]
-                        current_data = block_transaction_json["data"]
-                        current_timestamp = block_transaction_json["timestamp"]
-                        transaction = Transaction(current_handle, current_data, current_amount, current_destination, current_timestamp)
-                        current_transactions.append(transaction)
-                    current_index = int(block)
-                    current_proof = existing_chain["Blocks"][block]["proof"]
-                    current_block_previous_hash = existing_chain["Blocks"][block]["previous_hash"]
-                    current_block_timestamp = existing_chain["Blocks"][block]["timestamp"]
-                    current_block = Block(current_index, current_transactions, current_proof, current_block_previous_hash, current_block_timestamp)
-                    remote_blocks.append(current_block)
-                for user in existing_chain["Users"]:
-                    current_user_address = user
-                    current_user_data = existing_chain["Users"][user]["data"]
-                    current_user_name = existing_chain["Users"][user]["name"]
-                    current_user_balance = existing_chain["Users"][user]["balance"]
-                    current_user = Profile(current_user_address, current_user_name, current_user_balance,current_user_data)
-                    remote_users.append(current_user)
-                self.Peopleschain = Blockchain(remote_blocks, remote_users)
-
-                print ("Blockchain created")
+            if seeds is None:
+                seeds = ['192.168.2.10'] #TODO: figure out how to deal with first node
+            # Own address from node.ini when set, so nodes without network access still know it
+            self.peer_client = PeerClient(compression_level=self.compression_level)
+            self.peers = PeerManager(seeds, self.port, self.peer_client, own_address=own_address)
+            self.config['NODE-ID']['peer_nodes'] = ', '.join(self.peers)
 
-            else:
-                self.Peopleschain = Blockchain()
+            block_store = BlockStore(BLOCK_STORE_PATH)
+            self.config['NODE-ID']['block_store'] = BLOCK_STORE_PATH
 
-            # TODO: ADD Blockchain file path to config file
+            rule = get_rule(self.config['NODE-ID'].get('ProofRule', 'legacy'))
+
+            if 'checkpoint_private_key' not in self.config['NODE-ID']:
+                # Key the checkpoints this node publishes are signed with
+                key = new_key()
+                self.config['NODE-ID']['checkpoint_private_key'] = key.get_privkey().hex()
+                self.config['NODE-ID']['checkpoint_public_key'] = key.get_pubkey().hex()
+
+            self.peers.crawl_blocking()
+            checkpoint = Checkpoint.load(block_store.path)
+            if checkpoint is None and len(block_store) == 0:
+                # A new node starts from a checkpoint, only the blocks after it are downloaded
+                checkpoint = self.fetch_checkpoint()
+
+            # Blocks already on disk are opened lazily, only the delta is fetched from peers, in
+            # the background once the node serves requests
+            self.Peopleschain = Blockchain(store=block_store, rule=rule, checkpoint=checkpoint)
+            self.sync_pending = True
 
             with open('node.ini', 'w') as configfile:
                 self.config.write(configfile)
         else:
             self.node_identifier = node_identifier
-            self.peer_nodes = set(config['PEER-NODES'])
+            if seeds is None:
+                seeds = [node for node in self.config['NODE-ID'].get('peer_nodes', '').split(', ') if node]
+            self.peer_client = PeerClient(compression_level=self.compression_level)
+            self.peers = PeerManager(seeds, self.port, self.peer_client, own_address=own_address)
             self.Peopleschain = blockchain
 
-        self.app.run('0.0.0.0', FULL_NODE_PORT)
+        self.checkpoint_key = None
+        if 'checkpoint_private_key' in self.config['NODE-ID']:
+            self.checkpoint_key = load_key(
+                bytes.fromhex(self.config['NODE-ID']['checkpoint_private_key']),
+                bytes.fromhex(self.config['NODE-ID']['checkpoint_public_key'])
+            )
+        self.miner = Miner()
+        self.verifier = SignatureVerifier()
+        # RouteLimits in node.ini overrides some of the defaults, e.g. "mine=1/4, chain=8/32"
+        route_limits = dict(ROUTE_LIMITS, **parse_limits(self.config['NODE-ID'].get('RouteLimits', '')))
+        retry_after = self.config['NODE-ID'].getint('RetryAfter', 1)
+        self.limits = {
+            name: ConcurrencyLimit(concurrency, queue_size, retry_after)
+            for name, (concurrency, queue_size) in route_limits.items()
+        }
+        # Answers of the read-heavy routes, and the JSON of the blocks /chain lists
+        self.cache = ResponseCache(self.config['NODE-ID'].getint('ResponseCacheMB', 32) * 1024 * 1024)
+        self.block_cache = LRUCache(self.config['NODE-ID'].getint('BlockCacheMB', 32) * 1024 * 1024)
+        self.metrics = Registry()
+        self.gossip = Gossip(
+            self.Peopleschain, self.peers, self.peer_client, self.port,
+            fanout=self.config['NODE-ID'].getint('GossipFanout', 8), on_new_tip=self.miner.cancel,
+            registry=self.metrics, verifier=self.verifier, batch_delay=self.config['NODE-ID'].getint('GossipBatchMs', 20) / 1000
+        )
+        self.register_metrics()
+        self.sampler = StackSampler()
+        if not serve:
+            if self.sync_pending:
+                self.broadcast_node().addErrback(self.log_failure, "Announcing this node")
+                self.synchronize()
+            return
+
+        # Fork the workers before the reactor starts any threads
+        self.miner.start_pool()
+        self.verifier.start_pool()
+        if self.sync_pending:
+            loader = ProcessPoolExecutor()
+            # The executor forks all its workers on the first task
+            loader.submit(int).result()
+            reactor.callWhenRunning(self.load_chain, loader)
+        self.peers.start()
+        # Enough threads for every limited route at full concurrency, plus gossip and checkpoints
+        reactor.suggestThreadPoolSize(sum(limit.concurrency for limit in self.limits.values()) + 8)
+        log.startLogging(sys.stdout)
+        reactor.listenTCP(self.port, self.site(), interface='0.0.0.0')
+        reactor.run()
+
+    def site(self):
+        """ The HTTP interface of the node, timing every request by route and compressing answers. """
+
+        encoders = []
+        if self.compression_level is not None:
+            encoders.append(CompressionEncoderFactory(self.compression_level))
+        return MetricsSite(self.app, self.request_latency, encoders, requestFactory=DecodingRequest)
+
+    def register_metrics(self):
+        """ Metrics served on /metrics, most are read from the node's state when scraped. """
+
+        metrics = self.metrics
+        self.request_latency = metrics.histogram(
+            "peopleschain_http_request_seconds", "Time to answer HTTP requests", labels=("route", "method")
+        )
+        self.validation_time = metrics.histogram(
+            "peopleschain_block_validation_seconds", "Time to check and connect a block", labels=("source",)
+        )
+        self.blocks_mined = metrics.counter("peopleschain_blocks_mined_total", "Blocks mined by this node")
+        metrics.gauge("peopleschain_chain_height", "Height of the main chain", function=lambda: len(self.Peopleschain.blocks) - 1)
+        metrics.gauge("peopleschain_mempool_transactions", "Unconfirmed transactions", function=lambda: len(self.Peopleschain.unconfimed_transaction))
+        metrics.gauge("peopleschain_orphan_blocks", "Blocks waiting for their parent", function=lambda: len(self.Peopleschain.tree.orphans))
+        metrics.gauge("peopleschain_peers", "Peers in the peer table", function=lambda: len(self.peers))
+        metrics.counter(
+            "peopleschain_pow_candidates_total", "Proof of work candidates checked",
+            function=lambda: self.miner.total_candidates + (self.miner.candidates.value if self.miner.job else 0)
+        )
+        metrics.gauge("peopleschain_pow_candidates_per_second", "Proof of work rate of the running or last job", function=self.pow_rate)
+
+        def limit_stat(name):
+            return lambda: {(route,): limit.to_dict()[name] for route, limit in self.limits.items()}
+
+        metrics.gauge("peopleschain_route_running_requests", "Requests of a limited route being handled", ("route",), limit_stat("running"))
+        metrics.gauge("peopleschain_route_waiting_requests", "Requests of a limited route waiting their turn", ("route",), limit_stat("waiting"))
+        metrics.counter("peopleschain_route_rejected_total", "Requests of a limited route answered with 503", ("route",), limit_stat("rejected"))
+
+        def peer_stat(name):
+            return lambda: {(node,): stats.to_dict()[name] for node, stats in self.peer_client.stats.items()}
+
+        metrics.gauge("peopleschain_peer_rtt_mean_seconds", "Mean latency of the recent requests to a peer", ("peer",), peer_stat("mean_latency"))
+        metrics.gauge("peopleschain_peer_rtt_p99_seconds", "99th percentile latency of the recent requests to a peer", ("peer",), peer_stat("p99_latency"))
+        metrics.counter("peopleschain_peer_requests_total", "Requests sent to a peer", ("peer",), peer_stat("requests"))
+        metrics.counter("peopleschain_peer_failures_total", "Failed requests to a peer", ("peer",), peer_stat("failures"))
+        metrics.gauge(
+            "peopleschain_sync_target_height", "Tip height of the peer the chain was last synchronized from",
+            function=lambda: self.chain_sync and self.chain_sync.target_height
+        )
+        metrics.counter(
+            "peopleschain_sync_downloaded_blocks_total", "Blocks downloaded by the last synchronization",
+            function=lambda: self.chain_sync and self.chain_sync.downloaded
+        )
+
+        def cache_requests():
+            results = {}
+            for result, counts in (("hit", self.cache.hits), ("miss", self.cache.misses), ("not_modified", self.cache.not_modified)):
+                results.update({(route, result): count for route, count in counts.items()})
+            return results
+
+        metrics.counter(
+            "peopleschain_cache_requests_total", "Requests of cached routes, answered from the cache, built or answered 304",
+            ("route", "result"), cache_requests
+        )
+        metrics.counter(
+            "peopleschain_cache_bytes_saved_total", "Bytes of cached answers not sent again thanks to a 304",
+            ("route",), lambda: {(route,): count for route, count in self.cache.bytes_saved.items()}
+        )
+        metrics.gauge(
+            "peopleschain_cache_bytes", "Size of the cached answers and block JSON", ("cache",),
+            lambda: {("answers",): self.cache.answers.size, ("blocks",): self.block_cache.size}
+        )
+        metrics.counter(
+            "peopleschain_block_json_cache_total", "Block JSON looked up for /chain, found or built", ("result",),
+            lambda: {("hit",): self.block_cache.hits, ("miss",): self.block_cache.misses}
+        )
+
+    def pow_rate(self):
+        status = self.miner.status()
+        if status["mining"]:
+            return status["candidates_per_second"]
+        job = status["last_job"]
+        if job is None or job["finished"] <= job["started"]:
+            return None
+        return job["candidates"] / (job["finished"] - job["started"])
 
     def my_node(self):
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(('8.8.8.8', 80))
-        my_node = s.getsockname()[0]
-        s.close()
-        return my_node
-
-    def request_nodes(self, node, port):
-        url = NODES_URL.format(node, port)
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                all_nodes = response.json()
-                return all_nodes
-        except requests.exceptions.RequestException as re:
-            pass
-        return None
+        return self.peers.own_address
 
-    def remove_nodes(self, nodes):
-        for node in nodes:
-            self.peer_nodes.discard(node)
+    @defer.inlineCallbacks
+    def send_to_peers(self, url_template, data=None, body=None):
+        """
+            POST data (as JSON) or body (binary) to a snapshot of the peer table in parallel,
+            recording failures.
 
+            :return: <Deferred> Fires once every peer answered or timed out
+        """
 
-    def request_nodes_from_all(self):
-        full_nodes = self.peer_nodes.copy()
-        bad_nodes = set()
+        nodes = self.peers.snapshot()
+        bad_nodes = yield self.peer_client.broadcast(nodes, url_template, self.port, data, body)
+        self.peers.mark_failure(bad_nodes)
+        self.peers.mark_success(node for node in nodes if node not in bad_nodes)
 
-        for node in full_nodes:
-            if node == self.my_node():
-                continue
-            all_nodes = self.request_nodes(node, FULL_NODE_PORT)
-            if all_nodes is not None:
-                full_nodes = full_nodes.union(all_nodes["full_nodes"])
-            else:
-                bad_nodes.add(node)
-        self.peer_nodes = full_nodes
-        self.remove_nodes(bad_nodes)
-        bad_nodes = set()
-        return
+    @staticmethod
+    def log_failure(failure, action):
+        logger.warning("%s failed: %s", action, failure.getErrorMessage())
 
     def broadcast_node(self):
 
-        self.request_nodes_from_all()
-        bad_nodes = set()
         data = {
             "host": self.my_node()
         }
+        return self.send_to_peers(NEW_NODES_URL, data)
 
-        for node in self.peer_nodes:
-            if node == self.my_node():
-                continue
-            url = NEW_NODES_URL.format(node, FULL_NODE_PORT)
-            try:
-                requests.post(url, json=data)
-            except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-
-        self.remove_nodes(bad_nodes)
-        bad_nodes.clear()
+    def broadcast_block(self, block):
+        # Only the hash is announced, peers that lack the block fetch it from us
+        return self.gossip.announce(blocks=[block.hash])
 
-        return
+    def broadcast_transactions(self, transactions):
+        return self.gossip.announce(transactions=[transaction.tx_id for transaction in transactions])
 
-    def broadcast_block(self, block):
+    def broadcast_user(self, user):
 
-        self.request_nodes_from_all()
-        bad_nodes = set()
         data = {
-            "index": block.index,
-            "transactions": [transaction.toJSON() for transaction in block.transactions],
-            "proof": block.proof,
-            "previous_hash": block.previous_hash,
-            "timestamp": block.timestamp,
+            "address": user.address,
         }
+        return self.send_to_peers(NEW_USER_URL, data)
 
-        for node in self.peer_nodes:
-            if node == self.my_node():
+    def fetch_checkpoint(self):
+        """ The newest checkpoint the peers offer that can be trusted, see CheckpointSync. """
+
+        trusted_keys = [key.strip() for key in self.config['NODE-ID'].get('TrustedCheckpointKeys', '').split(',') if key.strip()]
+        # Unsigned checkpoints are only trusted by a quorum of peers when node.ini opts in
+        checkpoint_sync = CheckpointSync(
+            self.port, trusted_keys, quorum=self.config['NODE-ID'].getint('CheckpointQuorum', 0) or None
+        )
+        checkpoint = checkpoint_sync.run(self.peers.snapshot())
+        self.peers.mark_failure(checkpoint_sync.bad_nodes)
+        return checkpoint
+
+    def current_checkpoint(self):
+        """
+            The checkpoint offered to new nodes: at the newest balance snapshot deep enough below
+            the tip not to be reorganized away. It is built, and signed, once per snapshot.
+        """
+
+        chain = self.Peopleschain
+        deepest = len(chain.blocks) - 1 - chain.tree.max_depth
+        heights = chain.state.snapshot_heights()
+        if chain.state.base is not None:
+            heights.append(chain.state.base[0])
+        for height in sorted(heights, reverse=True):
+            if not 0 < height <= deepest:
                 continue
-            url = NEW_BLOCK_URL.format(node, FULL_NODE_PORT)
-            try:
-                requests.post(url, json=data)
-            except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
+            if self.checkpoint is not None and self.checkpoint.height == height:
+                return self.checkpoint
+            snapshot = chain.state.read_snapshot(height)
+            if snapshot is None or snapshot[0] != chain.blocks[height].hash:
+                continue
+            checkpoint = Checkpoint.from_chain(chain, height, snapshot[1])
+            if self.checkpoint_key is not None:
+                checkpoint.sign(self.checkpoint_key)
+            self.checkpoint = checkpoint
+            return checkpoint
+        return None
+
+    def load_chain(self, executor):
+        """
+            Bring the chain up to date from the peers in a thread while the node serves
+            requests, each downloaded batch of blocks is served once it is connected.
 
-        self.remove_nodes(bad_nodes)
-        bad_nodes.clear()
+            :param executor: <ProcessPoolExecutor> Checks the downloaded blocks, shut down when done
+        """
 
-        return
+        self.broadcast_node().addErrback(self.log_failure, "Announcing this node")
+        loading = threads.deferToThread(self.synchronize, self.peers.snapshot(), executor)
+        loading.addErrback(self.log_failure, "Synchronizing")
+        loading.addBoth(lambda _: executor.shutdown(wait=False))
+        return loading
 
-    def broadcast_user(self, user):
+    def synchronize(self, peers=None, executor=None):
+        """
+            Fetch the blocks we are missing from the peer with the best tip, then its users.
+            Blocks until done, the peer table is only updated through the reactor.
 
-        bad_nodes = set()
+            :param peers: <list> (Optional) Peers to synchronize with, the peer table by default
+            :param executor: <ProcessPoolExecutor> (Optional) Process pool the blocks are checked in
+        """
 
-        data = {
-            "address": user.address,
-        }
+        peers = self.peers.snapshot() if peers is None else peers
+        chain_sync = self.chain_sync = ChainSync(self.Peopleschain, self.port, executor=executor)
+        try:
+            best_node = chain_sync.run(peers)
+        except SyncError as error:
+            logger.warning("Synchronization failed: %s", error)
+            best_node = None
 
-        for node in self.peer_nodes:
-            if node == self.my_node():
-                continue
-            url = NEW_USER_URL.format(node, FULL_NODE_PORT)
-            try:
-                requests.post(url, json=data)
-            except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-
-        self.remove_nodes(bad_nodes)
-        bad_nodes.clear()
-
-    def synchronize(self):
-        """ Download blockchain from other nodes, make the longest chain my chain. """
-
-        self.request_nodes_from_all()
-        self.broadcast_node()
-        bad_nodes = set()
-        longest = 0
-        for node in self.peer_nodes:
-            if node == self.my_node():
-                continue
-            url = CHAIN_URL.format(node, FULL_NODE_PORT)
-            try:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    remote_chain = response.json()
-                    if len(remote_chain["Blocks"]) > longest:
-                        my_chain = remote_chain
-                        longest = len(remote_chain["Blocks"])
-            except requests.exceptions.RequestException as re:
-                bad_nodes.add(node)
-
-        self.remove_nodes(bad_nodes)
-        bad_nodes.clear()
-
-        if longest > 0:
-            return my_chain
-        else:
+        reactor.callFromThread(self.peers.mark_failure, chain_sync.bad_nodes)
+        if best_node is None:
             return None
 
-    def proof_of_work(self, last_proof):
+        url = peer_url(USERS_URL, best_node, self.port)
+        try:
+            response = requests.get(url)
+            if response.status_code == 200:
+                for address, user in response.json()["Users"].items():
+                    self.Peopleschain.add_user(Profile(address, user["name"], user["balance"], user["data"]))
+        except requests.exceptions.RequestException as re:
+            reactor.callFromThread(self.peers.mark_failure, [best_node])
+
+        logger.info("Blockchain synchronized from %s", best_node)
+        return best_node
+
+    def proof_of_work(self, template):
         """
-            A simple proof of work algorithm:
+            Find the proof of a block with the chain's proof rule, see consensus.py.
+            The legacy rule:
                 - Find a number p' such that p % p' == 0 and p % 9 == 0
                 - p: Previous proof, p': New proof
 
-        """
+            Runs on the miner's worker processes and blocks until done, call it off the reactor.
 
-        proof = 1
-        while self.valid_proof(last_proof, proof) is False:
-            proof += 1
+            :param template: <Block> The block to mine, its proof is ignored
+        """
 
-        return proof
+        rule = self.Peopleschain.rule
+        challenge = rule.challenge(self.Peopleschain.blocks, template)
+        return self.miner.mine(rule, challenge, template.index)
 
     @staticmethod
     def valid_proof(last_proof, proof):
@@ -265,20 +440,18 @@ class Node:
         :return: True if found else False
 
         """
-        print ("Trying proof: {}".format(proof))
-        return (last_proof % proof == 0 and proof % 9 == 0)
+        return valid_proof(last_proof, proof)
 
     def add_profile(self, address):
 
-        if address in [user.address for user in self.Peopleschain.users]:
+        user_profile = Profile(address)
+        if not self.Peopleschain.add_user(user_profile):
             return None, None
 
-        user_profile = Profile(address)
-        self.Peopleschain.users.append(user_profile)
         response = {
             "message": "New User Profile Created.",
             "address": address,
-            "balance": user_profile.balance,
+            "balance": self.Peopleschain.balance_of(address),
         }
         return response, user_profile
 
@@ -288,20 +461,32 @@ class Node:
     @app.route('/create', methods=['GET'])
     def create_profile(self, request):
 
-        response, user_profile = self.add_profile(self.node_identifier)
+        # The chain may be locked by a block being connected, wait for it off the reactor thread
+        adding = threads.deferToThread(self.add_profile, self.node_identifier)
+        adding.addCallback(self.announce_profile)
+        return adding
+
+    def announce_profile(self, result):
+        response, user_profile = result
         if response is None:
             response = {
                 "message": "User already exists!",
             }
             return json.dumps(response)
-        self.broadcast_user(user_profile)
+        self.broadcast_user(user_profile).addErrback(self.log_failure, "Broadcasting user")
         return json.dumps(response)
 
     @app.route('/user/add', methods=['POST'])
     def add_user(self, request):
 
         request_body = json.loads(request.content.read())
-        response, user_profile = self.add_profile(request_body["address"])
+        adding = threads.deferToThread(self.add_profile, request_body["address"])
+        adding.addCallback(self.profile_added)
+        return adding
+
+    @staticmethod
+    def profile_added(result):
+        response, _ = result
         if response is None:
             response = {
                 "message": "User already exists",
@@ -311,18 +496,16 @@ class Node:
 
     @app.route('/view/<address>', methods=['GET'])
     def view_profile(self, request, address):
+        key = ('view', address, self.Peopleschain.last_block.hash, self.Peopleschain.users_version)
+        return self.cache.respond(request, 'view', key, lambda: self.profile_json(address))
 
-        for user in self.Peopleschain.users:
-            if address == user.address:
+    def profile_json(self, address):
 
-                response = {
-                    "address": user.address,
-                    "name": user.name,
-                    "balance": user.balance,
-                    "data": user.data,
-                }
-
-                return json.dumps(response)
+        user = self.Peopleschain.get_user(address)
+        if user is not None:
+            response = user.to_dict()
+            response["balance"] = self.Peopleschain.balance_of(address)
+            return json.dumps(response)
 
         response = {
             "message": "User does not exist"
@@ -331,78 +514,254 @@ class Node:
         return json.dumps(response)
 
     @app.route('/edit/<address>', methods=['POST'])
+    @limited('edit')
     def edit_profile(self, request, address):
 
+        request_body = json.loads(request.content.read())
+        editing = threads.deferToThread(self.apply_edit, address, request_body)
+        editing.addCallback(self.announce_edit)
+        return editing
+
+    def apply_edit(self, address, request_body):
+        """
+            Charge the editing fee and change the profile, runs off the reactor thread.
+            Holds the chain's lock so two edits cannot both spend the same balance.
+
+            :return: <tuple> The response and the fee transaction, None if it was not accepted
+        """
+
         # Transaction Fee for any kind of editing
         transaction_fee = 20
-        request_body = json.loads(request.content.read())
-        for user in self.Peopleschain.users:
-            if address == user.address:
-                if user.balance >= transaction_fee:
-                    transaction_data = {}
-                    user.balance -= transaction_fee # TODO add a transfer function
-                    response = {
-                        "message": "Profile Updated",
-                    }
-                    if 'name' in request_body.keys():
-                        user.edit_name(request_body['name'])
-                        transaction_data['name'] = request_body['name']
-                        response["Name Changed to: "] = request_body['name']
-                    if 'data' in request_body.keys():
-                        user.add_data(request_body['data'])
-                        response["Added data"] = request_body['data']
-                        transaction_data['user-data'] = request_body['data']
-                    user_transaction = Transaction(user.address, transaction_data, 20, "Network")
-                    self.Peopleschain.push_unconfirmed_transaction(user_transaction)
-
-                    return json.dumps(response)
-                else:
-                    response = {
-                        "message": "Not enough balance",
-                    }
-
-                    return json.dumps(response)
+        with self.Peopleschain.lock:
+            user = self.Peopleschain.get_user(address)
+            if user is None:
+                response = {
+                    "message": "User Not Found",
+                }
+                return response, None
+
+            # Balances only change when the fee is confirmed, fees still in the mempool are reserved
+            if self.Peopleschain.available_balance(user.address) < transaction_fee:
+                response = {
+                    "message": "Not enough balance",
+                }
+                return response, None
+
+            transaction_data = {}
+            if 'name' in request_body.keys():
+                transaction_data['name'] = request_body['name']
+            if 'data' in request_body.keys():
+                transaction_data['user-data'] = request_body['data']
+            user_transaction = Transaction(user.address, transaction_data, transaction_fee, "Network")
+            if not self.Peopleschain.push_unconfirmed_transaction(user_transaction):
+                response = {
+                    "message": "Transaction rejected, the mempool is full",
+                }
+                return response, None
+
+            response = {
+                "message": "Profile Updated",
+            }
+            if 'name' in request_body.keys():
+                user.edit_name(request_body['name'])
+                response["Name Changed to: "] = request_body['name']
+            if 'data' in request_body.keys():
+                user.add_data(request_body['data'])
+                response["Added data"] = request_body['data']
+            # Cached answers hold the profile as it was
+            self.Peopleschain.users_version += 1
+
+        return response, user_transaction
+
+    def announce_edit(self, result):
+        # The fee is not signed by the user, peers only relay signed transactions: it is
+        # confirmed by this node's miner
+        response, _ = result
+        return json.dumps(response)
+
+    @app.route('/tx/batch', methods=['POST'])
+    @limited('batch')
+    def submit_batch(self, request):
+        """
+            Submit many signed transactions at once, as newline-delimited JSON or as binary
+            records (application/octet-stream), see signatures.py. Signatures are checked in
+            the verifier's process pool, and the batch committed, off the reactor thread.
+        """
+
+        content = request.content.read()
+        try:
+            if request.getHeader('Content-Type') == 'application/octet-stream':
+                records = decode_binary(content)
+            else:
+                records = decode_lines(content)
+        except MalformedRecord as error:
+            response = {
+                "message": "Malformed batch: {}".format(error),
+            }
+            return json.dumps(response)
+
+        max_transactions = self.config['NODE-ID'].getint('MaxBatchTransactions', 10000)
+        if len(records) > max_transactions:
+            response = {
+                "message": "Batch too large, at most {} transactions".format(max_transactions),
+            }
+            return json.dumps(response)
+
+        verifying = threads.deferToThread(self.commit_batch, records)
+        verifying.addCallback(self.announce_batch, records)
+        return verifying
 
+    def commit_batch(self, records):
+        """
+            Insert the transactions with a valid signature into the mempool, in one step.
+
+            :return: <tuple> The transactions with a valid signature and their outcomes
+        """
+
+        valid_signatures = self.verifier.verify(records)
+        signed = [record for valid, record in zip(valid_signatures, records) if valid]
+        transactions = [transaction for transaction, _, _ in signed]
+        signatures = [(public_key, signature) for _, public_key, signature in signed]
+        return transactions, self.Peopleschain.submit_transactions(transactions, signatures)
+
+    def announce_batch(self, result, records):
+        signed, outcomes = result
+        accepted = [transaction for transaction, outcome in zip(signed, outcomes) if outcome == ACCEPTED]
+        self.broadcast_transactions(accepted).addErrback(self.log_failure, "Announcing transactions")
+
+        rejected = Counter(outcome for outcome in outcomes if outcome != ACCEPTED)
+        rejected["invalid signature"] = len(records) - len(signed)
         response = {
-            "message": "User Not Found",
+            "accepted": [transaction.tx_id for transaction in accepted],
+            "rejected": {outcome: count for outcome, count in rejected.items() if count},
         }
 
         return json.dumps(response)
 
     @app.route('/mine', methods=['GET'])
+    @limited('mine')
     def mine(self, request):
-        # We run the proof of work algorithm to get the next proof
-        last_block = self.Peopleschain.last_block
-        last_proof = last_block.proof
-        proof = self.proof_of_work(last_proof)
-        print ("Proof of work: {}".format(proof))
+        if self.miner.job is not None:
+            response = {
+                "message": "Already mining",
+            }
+            return json.dumps(response)
+
+        # We run the proof of work algorithm to get the next proof, away from the reactor thread
+        mining = threads.deferToThread(self.mine_block)
+        mining.addCallback(self.announce_mined_block)
+        mining.addErrback(self.mining_busy)
+        return mining
+
+    def mine_block(self):
+        """
+            Mine a block on the tip and add it to the chain, runs off the reactor thread.
+
+            :return: <tuple> The new block, None if none was added, and the response
+        """
+
         # We must send a reward for finding the proof
-        reward_transaction  = Transaction("Network", {"message": "Block reward"}, 200, self.node_identifier)
+        reward_transaction  = Transaction(NETWORK, {"message": "Block reward"}, BLOCK_REWARD, self.node_identifier)
+
+        last_block = self.Peopleschain.last_block
+        max_transactions = self.config['NODE-ID'].getint('MaxBlockTransactions', 1000)
+        transactions = self.Peopleschain.block_template_transactions(max_transactions - 1) + [reward_transaction]
+        template = Block(last_block.index + 1, transactions, 0, last_block.hash, self.Peopleschain.next_block_time())
+
+        proof = self.proof_of_work(template)
+        return self.commit_mined_block(proof, template, last_block)
+
+    def announce_mined_block(self, result):
+        new_block, response = result
+        if new_block is not None:
+            # The block is committed locally, peers are notified in the background
+            self.broadcast_block(new_block).addErrback(self.log_failure, "Broadcasting block")
+        return json.dumps(response)
+
+    @staticmethod
+    def mining_busy(failure):
+        # Two requests can pass the check above before the first job starts, the miner refuses the second
+        failure.trap(RuntimeError)
+        response = {
+            "message": "Already mining",
+        }
+        return json.dumps(response)
 
-        self.Peopleschain.push_unconfirmed_transaction(reward_transaction)
+    @app.route('/mine/status', methods=['GET'])
+    def mine_status(self, request):
+        return json.dumps(self.miner.status())
 
-        # Add money to the node
-        for user in self.Peopleschain.users:
-            if user.address == self.node_identifier:
-                user.balance += 200
+    def commit_mined_block(self, proof, template, last_block):
+        """
+            Add the mined block to the chain, unless another block got there first.
 
-        new_index = last_block.index + 1
-        previous_hash = last_block.hash
+            :param proof: <int> The proof found by the miner, None if mining was cancelled
+            :param template: <Block> The block that was mined
+            :param last_block: <Block> The tip the block was mined on
+            :return: <tuple> The new block, None if none was added, and the response
+        """
 
-        new_block = Block(new_index, self.Peopleschain.unconfimed_transaction, proof, previous_hash)
-        self.Peopleschain.add_block(new_block)
+        if proof is None and not self.miner.last_job["cancelled"]:
+            response = {
+                "message": "No valid proof exists for the last block",
+            }
+            return None, response
+
+        # The tip must not change between the check and the block being added
+        with self.Peopleschain.lock:
+            if proof is None or self.Peopleschain.last_block.hash != last_block.hash:
+                response = {
+                    "message": "Mining cancelled, a competing block arrived",
+                }
+                return None, response
+
+            logger.debug("Proof of work: %d", proof)
+
+            new_block = Block(template.index, template.transactions, proof, template.previous_hash, template.timestamp)
+            # Adding the block drops its transactions from the mempool, those that arrived while mining stay
+            with self.validation_time.time(source="mined"):
+                added = self.Peopleschain.add_block(new_block)
+            if not added:
+                # e.g. a template transaction the chain no longer accepts, see the node's log
+                response = {
+                    "message": "Mined block is invalid, it was not added to the chain",
+                }
+                return None, response
+        self.blocks_mined.inc()
 
-        #Once the block has been created, reset unconfimed_transaction
-        self.Peopleschain.unconfimed_transaction = []
         # Broadcast new block to other nodes
         # TODO: Receive confirmation from other nodes, about the validity of the block, if more than 50% success, only then add block to chain
-        self.broadcast_block(new_block)
-        return json.dumps(str(new_block))
+        return new_block, str(new_block)
 
 
-    @app.route('/chain', methods=['GET'])
-    def view_chain(self, request):
+    @staticmethod
+    def query_int(request, name, default=None):
+        """
+            Read an integer query string argument.
+
+            :param request: <Request> The incoming request
+            :param name: <str> Name of the argument
+            :param default: Value returned when the argument is missing or malformed
+        """
 
+        values = request.args.get(name.encode('utf-8'))
+        if not values:
+            return default
+        try:
+            return int(values[0])
+        except ValueError:
+            return default
+
+    @staticmethod
+    def block_json(block):
+        return {
+            "transactions": [transaction.toJSON() for transaction in block.transactions],
+            "timestamp": block.timestamp,
+            "proof": block.proof,
+            "previous_hash": block.previous_hash
+        }
+
+    def mempool_json(self):
         unconfimed_transaction_json = {}
         for each_transaction in self.Peopleschain.unconfimed_transaction:
             unconfimed_transaction_json[each_transaction.tx_id] = {
@@ -412,45 +771,424 @@ class Node:
                 "timestamp": each_transaction.timestamp,
                 "destination": each_transaction.destination
             }
-        blocks_json = {}
-        for each_block in self.Peopleschain.blocks:
-            blocks_json[each_block.index] = {
-                "transactions": [transaction.toJSON() for transaction in each_block.transactions],
-                "timestamp": each_block.timestamp,
-                "proof": each_block.proof,
-                "previous_hash": each_block.previous_hash
+        return unconfimed_transaction_json
+
+    def user_json(self, user):
+        return {
+            "name": user.name,
+            "balance": self.Peopleschain.balance_of(user.address),
+            "data": user.data,
+        }
+
+    @app.route('/chain', methods=['GET'])
+    @limited('chain')
+    def view_chain(self, request):
+        """
+            Stream the chain, one block per chunk.
+
+            Without arguments the whole chain is sent along with users and unconfirmed
+            transactions. from_height, to_height (inclusive), limit and cursor select a
+            range of blocks only; next_cursor is set when more blocks remain.
+        """
+
+        cursor = self.query_int(request, 'cursor')
+        from_height = self.query_int(request, 'from_height', 0)
+        to_height = self.query_int(request, 'to_height')
+        limit = self.query_int(request, 'limit')
+        full_chain = not any(name in request.args for name in (b'cursor', b'from_height', b'to_height', b'limit'))
+
+        # The blocks are read with the tip they belong to, a reorganization while streaming
+        # cannot mix two chains in the answer or in the cache
+        with self.Peopleschain.lock:
+            chain_height = len(self.Peopleschain.blocks) - 1
+            if cursor is not None:
+                from_height = cursor
+            # A chain started from a checkpoint only has the blocks after it
+            from_height = max(from_height, self.Peopleschain.first_block_height)
+            to_height = chain_height if to_height is None else min(to_height, chain_height)
+            last_height = to_height
+            if limit is not None:
+                last_height = min(to_height, from_height + max(limit, 1) - 1)
+            blocks = self.Peopleschain.blocks[from_height:last_height + 1] if from_height <= last_height else []
+            key = ('chain', from_height, last_height, full_chain, self.Peopleschain.last_block.hash)
+            if full_chain:
+                key += (self.Peopleschain.users_version, self.Peopleschain.unconfimed_transaction.version)
+        next_cursor = last_height + 1 if last_height < to_height else None
+
+        request.setHeader(b'Content-Type', b'application/json')
+        answer = self.cache.lookup(request, 'chain', key)
+        if answer is not None:
+            return answer
+
+        # The answer is kept for the next requests if it fits in the cache
+        parts = []
+        size = 0
+
+        def write(data):
+            nonlocal parts, size
+            request.write(data)
+            if parts is not None and size + len(data) <= self.cache.answers.max_bytes:
+                parts.append(data)
+                size += len(data)
+            else:
+                parts = None
+
+        def write_chunks():
+            write(b'{"Blocks": {')
+            separator = b''
+            for height, block in enumerate(blocks, from_height):
+                write(separator + '"{}": '.format(height).encode('utf-8') + self.block_fragment(block))
+                separator = b', '
+                yield
+            write('}}, "next_cursor": {}'.format(json.dumps(next_cursor)).encode('utf-8'))
+            if full_chain:
+                write(b', "Users": {')
+                separator = b''
+                users, _ = self.Peopleschain.list_users()
+                for each_user in users:
+                    write(separator + '{}: {}'.format(json.dumps(each_user.address), json.dumps(self.user_json(each_user))).encode('utf-8'))
+                    separator = b', '
+                yield
+                write('}}, "unconfirmed_transaction": {}'.format(json.dumps(self.mempool_json())).encode('utf-8'))
+            write(b'}')
+            if parts is not None:
+                self.cache.store(key, b''.join(parts))
+
+        # Let the reactor serve other requests between blocks, stop if the client goes away
+        streaming = task.cooperate(write_chunks())
+        request.notifyFinish().addErrback(lambda failure: streaming.stop())
+        return streaming.whenDone()
+
+    def block_fragment(self, block):
+        """ JSON of a block as listed by /chain, built once: blocks never change. """
+
+        fragment = self.block_cache.get(block.hash)
+        if fragment is None:
+            fragment = json.dumps(self.block_json(block)).encode('utf-8')
+            self.block_cache.put(block.hash, fragment)
+        return fragment
+
+    @app.route('/blocks', methods=['GET'])
+    @limited('blocks')
+    def view_blocks(self, request):
+        """
+            Blocks from_height to to_height (inclusive, at most MAX_BLOCKS) in their binary
+            encoding, as length prefixed records, see serialization.py
+        """
+
+        chain_height = len(self.Peopleschain.blocks) - 1
+        from_height = max(self.query_int(request, 'from_height', 0), self.Peopleschain.first_block_height)
+        to_height = min(self.query_int(request, 'to_height', chain_height), chain_height, from_height + MAX_BLOCKS - 1)
+
+        request.setHeader(b'Content-Type', b'application/octet-stream')
+        return serialization.encode_records(
+            self.Peopleschain.encoded_block(height) for height in range(from_height, to_height + 1)
+        )
+
+    @app.route('/chain/tip', methods=['GET'])
+    def view_tip(self, request):
+        """ Height, hash and cumulative work of the tip, peers sync to the chain with the most work. """
+
+        def tip_json(tip):
+            last_block, chain_work = tip
+            response = {
+                "height": last_block.index,
+                "hash": last_block.hash,
+                "chain_work": chain_work,
             }
 
-        users_json = {}
-        for each_user in self.Peopleschain.users:
-            users_json[each_user.address] = {
-                "name": each_user.name,
-                "balance": each_user.balance,
-                "data": each_user.data,
+            return json.dumps(response)
+
+        # The work of a reopened chain is computed once from its blocks, and waits for the chain lock
+        return threads.deferToThread(self.Peopleschain.tip).addCallback(tip_json)
+
+    @app.route('/headers', methods=['GET'])
+    def view_headers(self, request):
+        """ Up to count (at most MAX_HEADERS) block headers, starting at height from. """
+
+        from_height = max(self.query_int(request, 'from', 0), self.Peopleschain.first_header_height)
+        count = min(max(self.query_int(request, 'count', MAX_HEADERS), 0), MAX_HEADERS)
+        to_height = min(from_height + count, len(self.Peopleschain.blocks))
+
+        headers = [self.Peopleschain.blocks[height].header_dict() for height in range(from_height, to_height)]
+
+        response = {
+            "headers": headers,
+        }
+
+        return json.dumps(response)
+
+    @app.route('/checkpoint', methods=['GET'])
+    def view_checkpoint(self, request):
+        """ Manifest of the checkpoint new nodes can start from, see checkpoint.py """
+
+        # Building a checkpoint encodes every balance, keep it off the reactor thread
+        building = threads.deferToThread(self.current_checkpoint)
+        building.addCallback(self.checkpoint_manifest)
+        return building
+
+    @staticmethod
+    def checkpoint_manifest(checkpoint):
+        if checkpoint is None:
+            response = {
+                "message": "No checkpoint yet",
             }
+            return json.dumps(response)
 
-        data = {
-            "unconfirmed_transaction": unconfimed_transaction_json,
-            "Blocks":  blocks_json,
+        return json.dumps(checkpoint.manifest())
+
+    @app.route('/checkpoint/<content_hash>/<int:position>', methods=['GET'])
+    def view_checkpoint_chunk(self, request, content_hash, position):
+
+        building = threads.deferToThread(self.current_checkpoint)
+        building.addCallback(self.checkpoint_chunk, request, content_hash, position)
+        return building
+
+    @staticmethod
+    def checkpoint_chunk(checkpoint, request, content_hash, position):
+        if checkpoint is None or checkpoint.content_hash != content_hash or position >= checkpoint.chunk_count():
+            # Not a JSON message: the client expects the raw chunk and must try another peer
+            request.setResponseCode(404)
+            return b''
+
+        request.setHeader(b'Content-Type', b'application/octet-stream')
+        return checkpoint.chunk(position, CHUNK_SIZE)
+
+    @app.route('/tx/<tx_id>/proof', methods=['GET'])
+    def view_transaction_proof(self, request, tx_id):
+        """
+            Merkle branch proving a confirmed transaction is part of its block. A client that
+            trusts the header can check it with merkle.verify_branch.
+        """
+
+        found = self.Peopleschain.find_transaction(tx_id)
+        if found is None:
+            response = {
+                "message": "Transaction is not confirmed"
+            }
+            return json.dumps(response)
+
+        block = self.Peopleschain.blocks[found[1]]
+        response = {
+            "tx_id": tx_id,
+            "header": block.header_dict(),
+            "branch": block.merkle_branch(tx_id),
+        }
+
+        return json.dumps(response)
+
+    @app.route('/tx/<tx_id>', methods=['GET'])
+    def view_transaction(self, request, tx_id):
+        """ A confirmed transaction with the height of its block, or an unconfirmed one. """
+
+        found = self.Peopleschain.find_transaction(tx_id)
+        if found is not None:
+            transaction, height = found
+            response = {
+                "transaction": transaction.to_dict(),
+                "confirmed": True,
+                "height": height,
+                "confirmations": len(self.Peopleschain.blocks) - height,
+            }
+            return json.dumps(response)
+
+        transaction = self.Peopleschain.unconfimed_transaction.get(tx_id)
+        if transaction is not None:
+            response = {
+                "transaction": transaction.to_dict(),
+                "confirmed": False,
+            }
+            return json.dumps(response)
+
+        response = {
+            "message": "Transaction does not exist"
+        }
+
+        return json.dumps(response)
+
+    @app.route('/block/<block_hash>', methods=['GET'])
+    def view_block(self, request, block_hash):
+        """ A block of the main chain or of a side chain, by hash. """
+
+        height = self.Peopleschain.height_of(block_hash)
+        if height is not None:
+            return self.view_block_at(request, height)
+
+        block = self.Peopleschain.tree.side_blocks.get(block_hash)
+        if block is None:
+            response = {
+                "message": "Block does not exist"
+            }
+            return json.dumps(response)
+
+        response = block.to_dict()
+        response["main_chain"] = False
+        return json.dumps(response)
+
+    @app.route('/block/height/<int:height>', methods=['GET'])
+    def view_block_at(self, request, height):
+        """ The block of the main chain at a height. """
+
+        if height >= len(self.Peopleschain.blocks):
+            response = {
+                "message": "Block does not exist"
+            }
+            return json.dumps(response)
+
+        if height < self.Peopleschain.first_block_height:
+            try:
+                header = self.Peopleschain.blocks[height].header_dict()
+            except IndexError:
+                header = None
+            response = {
+                "message": "Only the headers of blocks below height {} are kept".format(self.Peopleschain.first_block_height),
+                "header": header,
+            }
+            return json.dumps(response)
+
+        response = self.Peopleschain.blocks[height].to_dict()
+        response["main_chain"] = True
+        return json.dumps(response)
+
+    @app.route('/address/<address>/history', methods=['GET'])
+    def view_address_history(self, request, address):
+        """
+            Confirmed transactions sent or received by an address, oldest first, limit
+            (at most MAX_HISTORY) at a time; next_cursor is set when more remain.
+        """
+
+        limit = min(max(self.query_int(request, 'limit', MAX_HISTORY), 1), MAX_HISTORY)
+        cursor = request.args.get(b'cursor', [b''])[0].decode('utf-8', 'replace')
+        try:
+            history, next_cursor = self.Peopleschain.address_history(address, cursor, limit)
+        except ValueError as error:
+            response = {
+                "message": str(error)
+            }
+            return json.dumps(response)
+
+        response = {
+            "address": address,
+            "transactions": [dict(transaction.to_dict(), height=height) for transaction, height in history],
+            "next_cursor": next_cursor,
+        }
+
+        return json.dumps(response)
+
+    @app.route('/users', methods=['GET'])
+    def view_users(self, request):
+        """ Registered users, optionally paginated with cursor (offset) and limit. """
+
+        cursor = max(self.query_int(request, 'cursor', 0), 0)
+        limit = self.query_int(request, 'limit')
+        stop = None if limit is None else cursor + max(limit, 1)
+
+        users, user_count = self.Peopleschain.list_users(cursor, stop)
+        users_json = {}
+        for each_user in users:
+            users_json[each_user.address] = self.user_json(each_user)
+
+        next_cursor = None
+        if stop is not None and stop < user_count:
+            next_cursor = stop
+
+        response = {
             "Users": users_json,
+            "next_cursor": next_cursor,
+        }
+
+        return json.dumps(response)
+
+    @app.route('/mempool', methods=['GET'])
+    def view_mempool(self, request):
+
+        response = {
+            "unconfirmed_transaction": self.mempool_json(),
         }
 
-        return json.dumps(data)
+        return json.dumps(response)
 
     @app.route('/nodes')
     def view_nodes(self, request):
+        nodes = self.peers.snapshot()
+
+        def build():
+            response = {
+                "full_nodes" : nodes
+            }
+
+            return json.dumps(response)
+
+        return self.cache.respond(request, 'nodes', ('nodes', tuple(nodes)), build)
+
+    @app.route('/nodes/stats', methods=['GET'])
+    def view_node_stats(self, request):
+        """ Health of each peer in the table, and request latencies of each peer we talked to. """
+
         response = {
-            "full_nodes" : list(self.peer_nodes)
+            "own_address": self.my_node(),
+            "peers": self.peers.to_dict(),
+            "latency": {node: stats.to_dict() for node, stats in self.peer_client.stats.items()},
         }
 
         return json.dumps(response)
 
+    @app.route('/metrics', methods=['GET'])
+    def view_metrics(self, request):
+        """ Every metric of the node in the Prometheus text format. """
+
+        request.setHeader(b'Content-Type', CONTENT_TYPE)
+        return self.metrics.render()
+
+    def profiling_disabled(self):
+        if self.config['NODE-ID'].getboolean('Profiling', False):
+            return None
+        response = {
+            "message": "Profiling is disabled, set Profiling = yes in node.ini",
+        }
+        return json.dumps(response)
+
+    @app.route('/profiler', methods=['GET'])
+    def view_profiler(self, request):
+        return self.profiling_disabled() or json.dumps(self.sampler.to_dict())
+
+    @app.route('/profiler/stacks', methods=['GET'])
+    def view_profiler_stacks(self, request):
+        """ The limit (50 by default) most sampled stacks, in the collapsed format of flame graph tools. """
+
+        disabled = self.profiling_disabled()
+        if disabled:
+            return disabled
+        request.setHeader(b'Content-Type', b'text/plain')
+        return self.sampler.dump(self.query_int(request, 'limit', 50))
+
+    @app.route('/profiler/<action>', methods=['POST'])
+    def toggle_profiler(self, request, action):
+        """ Start (optionally with interval=<ms> between samples) or stop the sampling profiler. """
+
+        disabled = self.profiling_disabled()
+        if disabled:
+            return disabled
+
+        if action == 'start':
+            interval = self.query_int(request, 'interval')
+            self.sampler.start(None if interval is None else max(interval, 1) / 1000)
+        elif action == 'stop':
+            self.sampler.stop()
+        else:
+            response = {
+                "message": "Unknown action, use start or stop",
+            }
+            return json.dumps(response)
+
+        return json.dumps(self.sampler.to_dict())
+
     @app.route('/nodes/register', methods=['POST'])
     def register_nodes(self, request):
         request_body = json.loads(request.content.read())
         host = request_body['host']
-        print (host)
-        self.peer_nodes.add(host)
+        logger.debug("Registering node %s", host)
+        self.peers.add(host)
         response = {
             "message": "Node registered",
             "Status": 200
@@ -459,28 +1197,131 @@ class Node:
         return json.dumps(response)
 
     @app.route('/block/new', methods=['POST'])
+    @limited('block')
     def register_block(self, request):
-        request_body = json.loads(request.content.read())
-        new_block_transactions = []
-        #TODO: repetition. refer prior to do to extract such data
-        for each_new_transaction in request_body["transactions"]:
-            each_new_transaction_json = json.loads(each_new_transaction)
-            this_amount = each_new_transaction_json["amount"]
-            this_destination = each_new_transaction_json["destination"]
-            this_handle = each_new_transaction_json["handle"]
-            this_data = each_new_transaction_json["data"]
-            this_timestamp = each_new_transaction_json["timestamp"]
-            this_transaction = Transaction(this_handle, this_data, this_amount, this_destination, this_timestamp)
-            new_block_transactions.append(this_transaction)
-        new_block = Block(request_body['index'], this_transaction, request_body['proof'], request_body['previous_hash'], request_body['timestamp'])
-        #TODO: Check validity of block, only then add to chain
-        self.Peopleschain.add_block(new_block)
+        """ Accepts a block in its binary encoding (application/octet-stream) or as JSON. """
+
+        content = request.content.read()
+        try:
+            if request.getHeader('Content-Type') == 'application/octet-stream':
+                new_block = Block.from_bytes(content)
+            else:
+                request_body = json.loads(content)
+                request_body["transactions"] = [json.loads(transaction) for transaction in request_body["transactions"]]
+                new_block = Block.from_dict(request_body)
+        except (ValueError, KeyError, TypeError, struct.error) as error:
+            request.setResponseCode(400)
+            response = {
+                "message": "Malformed block: {}".format(error),
+            }
+            return json.dumps(response)
+
+        accepting = threads.deferToThread(self.accept_block, new_block, "push")
+        accepting.addCallback(self.block_accepted, new_block)
+        return accepting
+
+    def accept_block(self, block, source):
+        """
+            Check and connect a block, runs off the reactor thread.
+
+            :param block: <Block> The block received
+            :param source: <str> Where it came from, labels the validation time
+            :return: <tuple> The outcome of Blockchain.accept_block, and whether the tip changed
+        """
+
+        with self.Peopleschain.lock:
+            tip = self.Peopleschain.last_block.hash
+            with self.validation_time.time(source=source):
+                result = self.Peopleschain.accept_block(block)
+            return result, self.Peopleschain.last_block.hash != tip
+
+    def block_accepted(self, outcome, new_block):
+        result, new_tip = outcome
+        if new_tip:
+            # Whatever we were mining now builds on a stale tip
+            self.miner.cancel()
+        if result in (CONNECTED, REORGANIZED, SIDE_CHAIN):
+            # Relay what we accepted, peers that already have it will not fetch it
+            self.broadcast_block(new_block).addErrback(self.log_failure, "Relaying block")
+
+        if result == CONNECTED:
+            response = {
+                "Success": "New Block Added"
+            }
+        elif result == REORGANIZED:
+            response = {
+                "Success": "Chain reorganized"
+            }
+        else:
+            response = {
+                "message": BLOCK_MESSAGES[result],
+            }
+
+        return json.dumps(response)
+
+    @staticmethod
+    def inventory_ids(request_body):
+        """
+            :param request_body: <dict> Decoded /inv or /getdata body
+            :return: <tuple> The block hashes and transaction ids it lists
+            :raise ValueError: The body is not an object of id lists
+        """
+
+        if not isinstance(request_body, dict):
+            raise ValueError("Expected a JSON object")
+        lists = request_body.get("blocks", []), request_body.get("transactions", [])
+        for ids in lists:
+            if not isinstance(ids, list) or not all(isinstance(item, str) for item in ids):
+                raise ValueError("blocks and transactions must be lists of ids")
+        return lists
+
+    @staticmethod
+    def malformed(request, error):
+        request.setResponseCode(400)
+        response = {
+            "message": "Malformed request: {}".format(error),
+        }
+        return json.dumps(response)
+
+    @app.route('/inv', methods=['POST'])
+    def receive_inventory(self, request):
+        """ Ids of blocks and transactions a peer has, we fetch the ones we lack from it. """
+
+        try:
+            request_body = json.loads(request.content.read())
+            blocks, transactions = self.inventory_ids(request_body)
+            sender = request_body.get("sender")
+            if not isinstance(sender, str):
+                raise ValueError("sender must be an address")
+        except ValueError as error:
+            return self.malformed(request, error)
+        wanted = self.gossip.receive_inventory(sender, blocks, transactions)
+
         response = {
-            "Success": "New Block Added"
+            "wanted": wanted,
         }
 
         return json.dumps(response)
 
+    @app.route('/getdata', methods=['POST'])
+    def get_data(self, request):
+        """ Blocks and transactions by id, in their binary encoding, see gossip.py """
+
+        try:
+            blocks, transactions = self.inventory_ids(json.loads(request.content.read()))
+        except ValueError as error:
+            return self.malformed(request, error)
+        request.setHeader(b'Content-Type', b'application/octet-stream')
+        return self.gossip.get_data(blocks, transactions)
+
 if __name__ == '__main__':
 
-    node = Node()
+    parser = argparse.ArgumentParser(description="PeoplesChain full node")
+    parser.add_argument("--port", type=int, help="Port to listen on, {} by default".format(FULL_NODE_PORT))
+    parser.add_argument("--host", help="Address peers reach this node at, host or host:port")
+    parser.add_argument("--seeds", nargs='*', help="Peers to start from, host or host:port, none for the first node")
+    parser.add_argument("--log-level", default=Node.config['NODE-ID'].get('LogLevel', 'INFO'), help="DEBUG, INFO, WARNING or ERROR")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper())
+    node = Node(seeds=args.seeds, own_address=args.host, port=args.port)
@@ -1,4 +1,11 @@
+class InsufficientBalance(Exception):
+    pass
+
+
 class Profile:
+    """ An account. Slots keep the memory of a registry with millions of users low. """
+
+    __slots__ = ('address', 'name', 'balance', 'data')
 
     def __init__(self, address, name=None, balance=None, data=None):
         # Add option for a signature ( For security )
@@ -26,8 +33,28 @@ class Profile:
             self.data[key] = new_data[key]
 
     def transfer(self, amount):
+        """
+            Take an amount from the balance the profile was created with. The confirmed balance
+            of an address is kept by the chain's account state, see state.py.
+        """
 
         if amount > self.balance:
-            return "Not enough balance"
-        else:
-            self.balance -= amount
+            raise InsufficientBalance("{} has {}, needs {}".format(self.address, self.balance, amount))
+        self.balance -= amount
+
+    def to_dict(self):
+        return {
+            "address": self.address,
+            "name": self.name,
+            "balance": self.balance,
+            "data": self.data,
+        }
+
+    @classmethod
+    def from_dict(cls, profile_dict):
+        return cls(
+            profile_dict["address"],
+            profile_dict.get("name"),
+            profile_dict.get("balance"),
+            profile_dict.get("data")
+        )
@@ -0,0 +1,113 @@
+"""
+    Compact binary format shared by Transaction and Block.
+
+    Every encoding starts with a one byte format version. Numbers are big endian, strings
+    are UTF-8 with a length prefix, and free-form JSON (transaction data) is stored in its
+    canonical form: sorted keys, no whitespace.
+
+    Transaction, version 1:
+        version B | timestamp d | amount kind B | amount 8 bytes (q or d) |
+        handle length H | destination length H (0xFFFF for None) | data length I |
+        handle | destination | data
+
+    Block, version 2:
+        header: version B | index I | previous hash 32s | merkle root 32s | timestamp d | proof Q
+        body: transaction count I | (transaction length I | transaction) * count
+
+    The block hash is the sha256 of the header only, which commits to the transactions
+    through the Merkle root of their ids (see merkle.py).
+
+    Block range, as answered to /blocks:
+        (block length I | block) * count
+
+    Inventory item, as answered to /getdata:
+        kind B (0 block, 1 transaction, 2 signed transaction) | length I | block, transaction
+        or signed transaction
+
+    Signed transaction, as submitted to /tx/batch:
+        transaction length I | public key length H | signature length H |
+        transaction | public key | signature
+
+"""
+import json
+import math
+import struct
+
+VERSION = 1
+BLOCK_VERSION = 2
+
+TRANSACTION_HEADER = struct.Struct(">BdB8sHHI")
+BLOCK_HEADER = struct.Struct(">BI32s32sdQ")
+LENGTH = struct.Struct(">I")
+PROOF = struct.Struct(">Q")
+SIGNED_TRANSACTION = struct.Struct(">IHH")
+INVENTORY_ITEM = struct.Struct(">BI")
+# Offset of the proof in a block header, the header is split around it when mining
+PROOF_OFFSET = struct.calcsize(">BI32s32sd")
+
+INTEGER_AMOUNT = 0
+FLOAT_AMOUNT = 1
+NO_STRING = 0xFFFF
+NO_HASH = bytes(32)
+
+
+class SerializationError(ValueError):
+    pass
+
+
+def check_version(buffer, version=VERSION):
+    if len(buffer) == 0 or buffer[0] != version:
+        raise SerializationError("Unsupported encoding version")
+
+
+def encode_records(payloads):
+    """ Length prefixed records, e.g. a range of encoded blocks. """
+    return b''.join(LENGTH.pack(len(payload)) + payload for payload in payloads)
+
+
+def decode_records(content):
+    records = []
+    offset = 0
+    while offset < len(content):
+        length, = LENGTH.unpack_from(content, offset)
+        offset += LENGTH.size
+        if offset + length > len(content):
+            raise SerializationError("Truncated record at byte {}".format(offset))
+        records.append(content[offset:offset + length])
+        offset += length
+    return records
+
+
+def canonical_json(value):
+    return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def pack_amount(amount):
+    if isinstance(amount, int):
+        return INTEGER_AMOUNT, struct.pack(">q", amount)
+    # NaN compares false to every balance and infinity is above them all
+    if not math.isfinite(amount):
+        raise SerializationError("Amount {} is not a finite number".format(amount))
+    return FLOAT_AMOUNT, struct.pack(">d", amount)
+
+
+def unpack_amount(kind, raw):
+    if kind == INTEGER_AMOUNT:
+        return struct.unpack(">q", raw)[0]
+    amount = struct.unpack(">d", raw)[0]
+    if not math.isfinite(amount):
+        raise SerializationError("Amount {} is not a finite number".format(amount))
+    return amount
+
+
+def pack_hash(block_hash):
+    """ Raw bytes of a hex block hash; the genesis block has 0 instead of a hash. """
+    if not block_hash:
+        return NO_HASH
+    return bytes.fromhex(block_hash)
+
+
+def unpack_hash(raw):
+    if raw == NO_HASH:
+        return 0
+    return raw.hex()
@@ -0,0 +1,163 @@
+import binascii
+import hashlib
+import json
+import multiprocessing
+import os
+import struct
+
+import pyelliptic
+
+import serialization
+from transaction import Transaction
+
+CURVE = 'secp256k1'
+
+
+class MalformedRecord(ValueError):
+    pass
+
+
+def address_of(public_key):
+    """ The address a public key spends from, the same length as a node identifier. """
+    return hashlib.sha256(public_key).hexdigest()[:32]
+
+
+def new_key():
+    return pyelliptic.ECC(curve=CURVE)
+
+
+def load_key(private_key, public_key):
+    """
+        :param private_key: <bytes> As returned by get_privkey()
+        :param public_key: <bytes> As returned by get_pubkey()
+    """
+    return pyelliptic.ECC(curve=CURVE, privkey=private_key, pubkey=public_key)
+
+
+def sign_transaction(key, transaction):
+    """
+        :param key: <pyelliptic.ECC> Key holding the private key of the sender
+        :param transaction: <Transaction> Transaction sent from address_of(key.get_pubkey())
+        :return: <bytes> ECDSA signature of the transaction's binary encoding
+    """
+    return key.sign(transaction.to_bytes())
+
+
+def verify_records(records):
+    """
+        Check ECDSA signatures, runs in worker processes.
+
+        :param records: <list> (message, public key, signature) bytes
+        :return: <list> One bool per record
+    """
+
+    results = []
+    for message, public_key, signature in records:
+        try:
+            results.append(bool(pyelliptic.ECC(pubkey=public_key, curve=CURVE).verify(signature, message)))
+        except Exception:
+            # Keys that do not decode to a point of the curve
+            results.append(False)
+    return results
+
+
+def encode_record(transaction, public_key, signature):
+    """ Binary form of a signed transaction, see serialization.py """
+
+    transaction_bytes = transaction.to_bytes()
+    header = serialization.SIGNED_TRANSACTION.pack(len(transaction_bytes), len(public_key), len(signature))
+    return b''.join((header, transaction_bytes, public_key, signature))
+
+
+def decode_binary(content):
+    """ Signed transactions from concatenated binary records. """
+
+    records = []
+    offset = 0
+    while offset < len(content):
+        try:
+            transaction_length, key_length, signature_length = \
+                serialization.SIGNED_TRANSACTION.unpack_from(content, offset)
+        except struct.error:
+            raise MalformedRecord("Truncated record at byte {}".format(offset))
+        offset += serialization.SIGNED_TRANSACTION.size
+        end = offset + transaction_length + key_length + signature_length
+        if end > len(content):
+            raise MalformedRecord("Truncated record at byte {}".format(offset))
+        transaction_bytes = content[offset:offset + transaction_length]
+        offset += transaction_length
+        public_key = content[offset:offset + key_length]
+        offset += key_length
+        signature = content[offset:end]
+        offset = end
+        try:
+            transaction = Transaction.from_bytes(transaction_bytes)
+        except (ValueError, struct.error) as error:
+            raise MalformedRecord(str(error))
+        records.append((transaction, public_key, signature))
+    return records
+
+
+def decode_lines(content):
+    """
+        Signed transactions from newline-delimited JSON, one object per line:
+        {"transaction": <Transaction.to_dict>, "public_key": <hex>, "signature": <hex>}
+    """
+
+    records = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            transaction = Transaction.from_dict(record["transaction"])
+            records.append((transaction, binascii.unhexlify(record["public_key"]), binascii.unhexlify(record["signature"])))
+        except (ValueError, KeyError, TypeError, binascii.Error) as error:
+            raise MalformedRecord(str(error))
+    return records
+
+
+class SignatureVerifier:
+    """
+        Verifies batches of signatures in a pool of worker processes, in chunks so each
+        task carries enough work to pay for the round trip to the worker.
+    """
+
+    def __init__(self, workers=None, chunk_size=250):
+        """
+            :param workers: <int> (Optional) Number of worker processes, one per core by default
+            :param chunk_size: <int> Number of signatures per task
+        """
+
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.pool = None
+
+    def start_pool(self):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(self.workers)
+        return self.pool
+
+    def verify(self, records):
+        """
+            :param records: <list> (transaction, public key, signature) as decoded from a batch
+            :return: <list> One bool per record: the signature is valid and the key owns the sender address
+        """
+
+        messages = [(transaction.to_bytes(), public_key, signature) for transaction, public_key, signature in records]
+        chunks = [messages[start:start + self.chunk_size] for start in range(0, len(messages), self.chunk_size)]
+        if len(chunks) <= 1:
+            results = [verify_records(chunk) for chunk in chunks]
+        else:
+            results = self.start_pool().map(verify_records, chunks)
+        signed = [valid for chunk in results for valid in chunk]
+        return [
+            valid and transaction.handle == address_of(public_key)
+            for valid, (transaction, public_key, _) in zip(signed, records)
+        ]
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
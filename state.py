@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+NETWORK = "Network"
+INITIAL_BALANCE = 100
+
+SNAPSHOT_NAME = "state{:010d}.json"
+SNAPSHOT_PATTERN = re.compile(r"state(\d{10})\.json$")
+
+
+def apply_transactions(balances, transactions, sign=1):
+    """
+        Move the amounts of transactions between accounts, or back when sign is -1.
+
+        :param balances: <dict> address -> balance, missing addresses hold INITIAL_BALANCE
+    """
+
+    for transaction in transactions:
+        if transaction.handle != NETWORK:
+            balances[transaction.handle] = balances.get(transaction.handle, INITIAL_BALANCE) - sign * transaction.amount
+        if transaction.destination and transaction.destination != NETWORK:
+            balances[transaction.destination] = balances.get(transaction.destination, INITIAL_BALANCE) + sign * transaction.amount
+
+
+class AccountState:
+    """
+        Balances derived from the confirmed blocks, the only place they change.
+
+        Blocks are applied in order. Every snapshot_interval blocks a copy of the balances
+        is kept, in memory and, with a path, on disk. Rolling back to a lower height restores
+        the last snapshot below it and replays the blocks after it; reopening a node loads
+        the last snapshot on disk and replays only the tail of the chain. A chain started from
+        a checkpoint has no blocks to replay below it, the checkpoint's balances are its base.
+    """
+
+    def __init__(self, path=None, snapshot_interval=1000, keep_snapshots=3):
+        """
+            :param path: <str> (Optional) Directory the snapshots are written to
+            :param snapshot_interval: <int> Number of blocks between snapshots
+            :param keep_snapshots: <int> Number of snapshots kept, the older ones are dropped
+        """
+
+        self.path = path
+        self.snapshot_interval = snapshot_interval
+        self.keep_snapshots = keep_snapshots
+        self.balances = {}
+        self.height = -1
+        self.block_hash = None
+        # height -> (block hash, balances)
+        self.snapshots = {}
+        # (height, block hash, balances) of the checkpoint the chain started from
+        self.base = None
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def balance(self, address):
+        return self.balances.get(address, INITIAL_BALANCE)
+
+    def apply_block(self, block):
+        apply_transactions(self.balances, block.transactions)
+        self.height = block.index
+        self.block_hash = block.hash
+        if self.height % self.snapshot_interval == 0:
+            self.snapshot()
+
+    def reset(self, balances, height, block_hash):
+        """ Replace the state, e.g. with the balances rebuilt by a full chain validation. """
+
+        self.balances = balances
+        self.height = height
+        self.block_hash = block_hash
+
+    def restore(self, balances, height, block_hash):
+        """ Start from the balances of a checkpoint, rollbacks never go below it. """
+
+        self.base = (height, block_hash, dict(balances))
+        self.reset(dict(balances), height, block_hash)
+
+    def snapshot(self):
+        self.snapshots[self.height] = (self.block_hash, dict(self.balances))
+        if self.path is not None:
+            self.write_snapshot()
+        for height in self.snapshot_heights()[self.keep_snapshots:]:
+            self.drop_snapshot(height)
+
+    def snapshot_heights(self):
+        """ Heights of the snapshots in memory or on disk, highest first. """
+        return sorted(set(self.snapshots) | set(self.snapshots_on_disk()), reverse=True)
+
+    def snapshot_file(self, height):
+        return os.path.join(self.path, SNAPSHOT_NAME.format(height))
+
+    def write_snapshot(self):
+        snapshot = {
+            "height": self.height,
+            "hash": self.block_hash,
+            "balances": self.balances,
+        }
+        # Write then rename, a crash never leaves a half written snapshot
+        temporary_file = self.snapshot_file(self.height) + ".tmp"
+        with open(temporary_file, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temporary_file, self.snapshot_file(self.height))
+
+    def drop_snapshot(self, height):
+        self.snapshots.pop(height, None)
+        if self.path is not None:
+            try:
+                os.remove(self.snapshot_file(height))
+            except FileNotFoundError:
+                pass
+
+    def snapshots_on_disk(self):
+        """ Heights of the snapshots written to path, highest first. """
+
+        if self.path is None:
+            return []
+        heights = []
+        for name in os.listdir(self.path):
+            match = SNAPSHOT_PATTERN.match(name)
+            if match:
+                heights.append(int(match.group(1)))
+        return sorted(heights, reverse=True)
+
+    def read_snapshot(self, height):
+        if height in self.snapshots:
+            return self.snapshots[height]
+        if self.base is not None and self.base[0] == height:
+            return self.base[1], self.base[2]
+        try:
+            with open(self.snapshot_file(height)) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError):
+            logger.warning("Unreadable state snapshot at height %d", height)
+            return None
+        return snapshot["hash"], snapshot["balances"]
+
+    def rollback(self, blocks, length):
+        """
+            Bring the state to the end of blocks[:length]: restore the last snapshot of that
+            chain and replay the blocks after it.
+
+            :param blocks: <list> The chain, a list of blocks or a BlockStore
+            :param length: <int> Number of blocks the state must cover
+            :return: <int> Number of blocks replayed
+        """
+
+        start = 0
+        self.reset({}, -1, None)
+        for height in self.snapshot_heights():
+            if height >= length:
+                self.drop_snapshot(height)
+                continue
+            snapshot = self.read_snapshot(height)
+            # A snapshot of a block that is no longer in the chain is useless
+            if snapshot is None or snapshot[0] != blocks[height].hash:
+                self.drop_snapshot(height)
+                continue
+            block_hash, balances = snapshot
+            self.reset(dict(balances), height, block_hash)
+            self.snapshots[height] = snapshot
+            start = height + 1
+            break
+        else:
+            if self.base is not None and self.base[0] < length:
+                height, block_hash, balances = self.base
+                self.reset(dict(balances), height, block_hash)
+                start = height + 1
+
+        for height in range(start, length):
+            self.apply_block(blocks[height])
+        logger.info("State at height %d, %d blocks replayed", self.height, length - start)
+        return length - start
+
+    def load(self, blocks):
+        """ Rebuild the state of a reopened chain from the last snapshot on disk. """
+        return self.rollback(blocks, len(blocks))
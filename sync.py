@@ -0,0 +1,376 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+import serialization
+from block import Block
+from blockchain import InvalidBlock
+from checkpoint import Checkpoint, CheckpointError
+from network import peer_url
+from signatures import verify_records
+
+logger = logging.getLogger(__name__)
+
+TIP_URL = "http://{}:{}/chain/tip"
+HEADERS_URL = "http://{}:{}/headers"
+BLOCKS_URL = "http://{}:{}/blocks"
+CHECKPOINT_URL = "http://{}:{}/checkpoint"
+
+MAX_HEADERS = 2000
+MAX_BLOCKS = 1000
+
+
+class SyncError(Exception):
+    pass
+
+
+class ChainSync:
+    """
+        Headers-first synchronization against a set of peers.
+
+        The peer whose chain has the most work is chosen, the last block both chains share is
+        located by walking that peer's headers backwards, and the headers above it are
+        checked for their hashes and linkage, which does not depend on the number of
+        transactions. Only then are the blocks downloaded in their binary encoding, in
+        batches spread over every peer that reported the same tip, and matched against the
+        checked headers.
+
+        When the peer's chain extends ours, each batch is connected as soon as it arrives
+        and its predecessors are connected, so the blocks already loaded can be served
+        while the rest downloads. A fork is only switched to once all of it is downloaded,
+        and only if it has more work than the local chain, see Blockchain.reorganize.
+    """
+
+    def __init__(self, blockchain, port, batch_size=500, workers=4, timeout=10, executor=None):
+        """
+            :param blockchain: <Blockchain> The local chain to bring up to date
+            :param port: <int> Port the peers listen on
+            :param batch_size: <int> Number of blocks requested at once, at most MAX_BLOCKS
+            :param workers: <int> Number of concurrent requests
+            :param timeout: <int> Seconds before a peer request is abandoned
+            :param executor: <Executor> (Optional) Process pool the blocks are checked in, see
+                Blockchain.load_blocks. One is started for each run without it.
+        """
+
+        self.blockchain = blockchain
+        self.port = port
+        self.batch_size = min(batch_size, MAX_BLOCKS)
+        self.workers = workers
+        self.timeout = timeout
+        self.executor = executor
+        self.session = requests.Session()
+        self.bad_nodes = set()
+        # Progress of the last run
+        self.target_height = None
+        self.downloaded = 0
+
+    def get_json(self, url, params=None):
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def fetch_tip(self, node):
+        try:
+            tip = self.get_json(peer_url(TIP_URL, node, self.port))
+            if not isinstance(tip["height"], int) or not isinstance(tip.get("chain_work", 0), int):
+                raise ValueError("Malformed tip")
+            return tip
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+            self.bad_nodes.add(node)
+            return None
+
+    def fetch_tips(self, nodes):
+        """ {node: {"height": .., "hash": ..}} for every peer that answered. """
+
+        nodes = list(nodes)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            tips = executor.map(self.fetch_tip, nodes)
+        return {node: tip for node, tip in zip(nodes, tips) if tip is not None}
+
+    def fetch_headers(self, node, from_height, count):
+        params = {"from": from_height, "count": count}
+        return self.get_json(peer_url(HEADERS_URL, node, self.port), params)["headers"]
+
+    def find_common_ancestor(self, node, remote_height):
+        """
+            Height of the last block shared with a peer, -1 if even the genesis blocks differ.
+            A chain started from a checkpoint is only compared down to its oldest header.
+
+            :param node: <str> The peer to compare against
+            :param remote_height: <int> Height of the peer's tip
+        """
+
+        blocks = self.blockchain.blocks
+        oldest = self.blockchain.first_header_height
+        height = min(len(blocks) - 1, remote_height)
+        while height >= oldest:
+            from_height = max(oldest, height - MAX_HEADERS + 1)
+            headers = self.fetch_headers(node, from_height, height - from_height + 1)
+            for header in reversed(headers):
+                # A peer started from a checkpoint may answer with later headers than asked
+                if oldest <= header["index"] <= height and blocks[header["index"]].hash == header["hash"]:
+                    return header["index"]
+            height = from_height - 1
+        return oldest - 1
+
+    def fetch_header_range(self, node, from_height, to_height):
+        headers = []
+        while from_height <= to_height:
+            batch = self.fetch_headers(node, from_height, min(MAX_HEADERS, to_height - from_height + 1))
+            if not batch or batch[0]["index"] != from_height:
+                raise SyncError("{} has no headers from height {}".format(node, from_height))
+            headers.extend(batch)
+            from_height += len(batch)
+        return headers
+
+    @staticmethod
+    def check_headers(headers, previous_hash, tip_hash):
+        """
+            Check that headers hash to what they claim and form a chain ending at the tip.
+
+            :param headers: <list> Headers as served by /headers, in height order
+            :param previous_hash: <str> Hash the first header must point to, None to skip the check
+            :param tip_hash: <str> Hash the last header must have
+        """
+
+        for header in headers:
+            if Block.hash_header(header) != header["hash"]:
+                raise SyncError("Header {} does not match its hash".format(header["index"]))
+            if previous_hash is not None and header["previous_hash"] != previous_hash:
+                raise SyncError("Header {} does not extend the chain".format(header["index"]))
+            previous_hash = header["hash"]
+        if previous_hash != tip_hash:
+            raise SyncError("Headers do not end at the advertised tip")
+
+    def fetch_blocks(self, node, from_height, to_height):
+        """ Binary encodings of a range of blocks, see serialization.py """
+
+        params = {"from_height": from_height, "to_height": to_height}
+        response = self.session.get(peer_url(BLOCKS_URL, node, self.port), params=params, timeout=self.timeout)
+        response.raise_for_status()
+        encodings = serialization.decode_records(response.content)
+        if len(encodings) != to_height - from_height + 1:
+            raise ValueError("{} sent {} blocks for heights {} to {}".format(node, len(encodings), from_height, to_height))
+        return encodings
+
+    def download(self, nodes, from_height, to_height):
+        """
+            Download a range of blocks in batches, spread round robin over several peers.
+            Later batches keep downloading while the first ones are consumed.
+
+            :param nodes: <list> Peers that all have the range
+            :return: <generator> (first height, block encodings) per batch, in height order
+        """
+
+        batches = [
+            (start, min(start + self.batch_size - 1, to_height))
+            for start in range(from_height, to_height + 1, self.batch_size)
+        ]
+
+        def fetch_batch(position):
+            start, stop = batches[position]
+            # Start with the assigned peer, fall back to the others if it fails
+            for attempt in range(len(nodes)):
+                node = nodes[(position + attempt) % len(nodes)]
+                try:
+                    return self.fetch_blocks(node, start, stop)
+                except (requests.exceptions.RequestException, ValueError, KeyError):
+                    self.bad_nodes.add(node)
+            raise SyncError("No peer could serve blocks {} to {}".format(start, stop))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for (start, _), batch in zip(batches, executor.map(fetch_batch, range(len(batches)))):
+                self.downloaded += len(batch)
+                yield start, batch
+
+    def load(self, node, encodings, headers, executor):
+        """ Blocks rebuilt from their encodings, checked against the headers of their heights. """
+
+        try:
+            blocks = self.blockchain.load_blocks(encodings, executor)
+        except InvalidBlock as error:
+            raise SyncError("Invalid block from {}: {}".format(node, error))
+        for block, header in zip(blocks, headers):
+            if block.hash != header["hash"]:
+                raise SyncError("Block {} does not match its header".format(block.index))
+        return blocks
+
+    def is_behind(self, tip):
+        """ Whether a peer's tip has more work than the local chain. """
+
+        local_height = len(self.blockchain.blocks) - 1
+        if "chain_work" in tip:
+            return tip["chain_work"] > self.blockchain.chain_work(local_height)
+        return tip["height"] > local_height
+
+    def run(self, nodes):
+        """
+            Bring the local chain up to the best tip among the peers. A peer that fails or
+            sends an invalid chain is marked bad and the next best one is tried.
+
+            :param nodes: <set> Peers to synchronize with
+            :return: <str> The peer the chain was synchronized from, None if already up to date
+            :raise: <SyncError> If no peer ahead of the local chain could be synchronized from
+        """
+
+        tips = self.fetch_tips(nodes)
+        # Peers that do not report their chain work are only ranked by height
+        ranked = sorted(tips, key=lambda node: (tips[node].get("chain_work", 0), tips[node]["height"]), reverse=True)
+        error = None
+        for node in ranked:
+            if not self.is_behind(tips[node]):
+                break
+            try:
+                self.sync_from(node, tips)
+                return node
+            except SyncError as sync_error:
+                logger.warning("Synchronization from %s failed: %s", node, sync_error)
+                self.bad_nodes.add(node)
+                error = sync_error
+        if error is not None:
+            raise error
+        return None
+
+    def sync_from(self, best_node, tips):
+        """
+            :param best_node: <str> The peer to synchronize from
+            :param tips: <dict> Tips of every peer, those on the same tip share the download
+        """
+
+        best_tip = tips[best_node]
+        self.target_height = best_tip["height"]
+        try:
+            ancestor = self.find_common_ancestor(best_node, best_tip["height"])
+            if ancestor + 1 < self.blockchain.first_block_height:
+                raise SyncError("{} forked below the checkpoint this chain started from".format(best_node))
+            logger.info("Syncing heights %d to %d from %s", ancestor + 1, best_tip["height"], best_node)
+            headers = self.fetch_header_range(best_node, ancestor + 1, best_tip["height"])
+            previous_hash = self.blockchain.blocks[ancestor].hash if ancestor >= 0 else None
+            self.check_headers(headers, previous_hash, best_tip["hash"])
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError, IndexError) as error:
+            raise SyncError("Could not fetch headers from {}: {}".format(best_node, error))
+
+        sources = [best_node] + [
+            node for node, tip in tips.items()
+            if node != best_node and tip["hash"] == best_tip["hash"]
+        ]
+        fork_height = ancestor + 1
+        extending = fork_height == len(self.blockchain.blocks)
+        executor = self.executor or ProcessPoolExecutor(max_workers=os.cpu_count())
+        new_blocks = []
+        try:
+            # Blocks are checked in the process pool, add_block then only checks them against the chain
+            for start, encodings in self.download(sources, fork_height, best_tip["height"]):
+                blocks = self.load(best_node, encodings, headers[start - fork_height:], executor)
+                if not extending:
+                    new_blocks.extend(blocks)
+                elif not self.blockchain.extend(blocks):
+                    raise SyncError("Chain from {} is invalid at height {}".format(best_node, start))
+        finally:
+            if executor is not self.executor:
+                executor.shutdown()
+
+        if not extending and not self.blockchain.reorganize(fork_height, new_blocks):
+            raise SyncError("Chain from {} is invalid".format(best_node))
+
+
+class CheckpointSync:
+    """
+        Download of the newest checkpoint offered by the peers, for a new node to start from.
+
+        A checkpoint is trusted when it is signed by one of the trusted keys, or when quorum
+        peers offer the same content hash if a quorum is set: peers are learnt from /nodes
+        answers, so one attacker can offer a checkpoint under many addresses. Its chunks are
+        downloaded in parallel, spread round robin over the peers offering it, and the whole is
+        checked against the content hash before it is used.
+    """
+
+    def __init__(self, port, trusted_keys=(), quorum=None, workers=4, timeout=10):
+        """
+            :param port: <int> Port the peers listen on
+            :param trusted_keys: <iterable> Hex public keys whose signature is enough to trust a checkpoint
+            :param quorum: <int> (Optional) Number of peers offering the same checkpoint that is
+                enough to trust it unsigned, only signed checkpoints are trusted without
+            :param workers: <int> Number of concurrent requests
+            :param timeout: <int> Seconds before a peer request is abandoned
+        """
+
+        self.port = port
+        self.trusted_keys = set(trusted_keys)
+        self.quorum = quorum
+        self.workers = workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.bad_nodes = set()
+
+    def fetch_manifest(self, node):
+        try:
+            response = self.session.get(peer_url(CHECKPOINT_URL, node, self.port), timeout=self.timeout)
+            response.raise_for_status()
+            manifest = response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            self.bad_nodes.add(node)
+            return None
+        return manifest if "content_hash" in manifest else None
+
+    def is_trusted(self, manifest, sources):
+        public_key = manifest.get("public_key")
+        if public_key in self.trusted_keys and manifest.get("signature"):
+            try:
+                record = (manifest["content_hash"].encode('ascii'), bytes.fromhex(public_key), bytes.fromhex(manifest["signature"]))
+            except ValueError:
+                record = None
+            if record is not None and verify_records([record])[0]:
+                return True
+        return self.quorum is not None and len(sources) >= self.quorum
+
+    def fetch_chunk(self, node, manifest, position):
+        url = peer_url(CHECKPOINT_URL, node, self.port) + "/{}/{}".format(manifest["content_hash"], position)
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    def download(self, nodes, manifest):
+        """ The checkpoint's encoding, each chunk from its assigned peer or, failing that, the others. """
+
+        def fetch(position):
+            for attempt in range(len(nodes)):
+                node = nodes[(position + attempt) % len(nodes)]
+                try:
+                    return self.fetch_chunk(node, manifest, position)
+                except requests.exceptions.RequestException:
+                    self.bad_nodes.add(node)
+            raise SyncError("No peer could serve checkpoint chunk {}".format(position))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return b''.join(executor.map(fetch, range(manifest["chunks"])))
+
+    def run(self, nodes):
+        """
+            :param nodes: <iterable> Peers to ask
+            :return: <Checkpoint> The highest trusted checkpoint that could be downloaded, None if there is none
+        """
+
+        nodes = list(nodes)
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            manifests = executor.map(self.fetch_manifest, nodes)
+
+        offers = {}
+        for node, manifest in zip(nodes, manifests):
+            if manifest is not None:
+                offers.setdefault(manifest["content_hash"], (manifest, []))[1].append(node)
+
+        for manifest, sources in sorted(offers.values(), key=lambda offer: offer[0]["height"], reverse=True):
+            if not self.is_trusted(manifest, sources):
+                logger.info("Checkpoint at height %d is not signed by a trusted key", manifest["height"])
+                continue
+            try:
+                checkpoint = Checkpoint.decode(self.download(sources, manifest), manifest["content_hash"])
+            except (SyncError, CheckpointError) as error:
+                logger.warning("Checkpoint at height %d unusable: %s", manifest["height"], error)
+                continue
+            logger.info("Downloaded the checkpoint at height %d from %d peers", checkpoint.height, len(sources))
+            return checkpoint
+        return None
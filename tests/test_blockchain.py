@@ -0,0 +1,139 @@
+import struct
+from time import time
+
+import pytest
+
+import serialization
+from block import Block
+from blockchain import ACCEPTED, CONNECTED, DUPLICATE, MAX_FUTURE_BLOCK_TIME, REORGANIZED, SIDE_CHAIN, Blockchain, check_blocks
+from blockstore import BlockStore
+from consensus import HashTargetRule
+from transaction import Transaction
+
+
+def next_block(chain, transactions, spacing=10, timestamp=None):
+    """ A block on the tip of chain, with a proof found under the chain's rule. """
+
+    last_block = chain.last_block
+    timestamp = last_block.timestamp + spacing if timestamp is None else timestamp
+    template = Block(last_block.index + 1, transactions, 0, last_block.hash, timestamp)
+    challenge = chain.rule.challenge(chain.blocks, template)
+    proof = chain.rule.search(challenge, 1, chain.rule.nonce_limit(challenge, 10 ** 7))
+    return Block(template.index, template.transactions, proof, template.previous_hash, timestamp)
+
+
+def reward(chain, miner):
+    return Transaction("Network", {"message": "Block reward", "height": len(chain.blocks)}, 1, miner, chain.last_block.timestamp + 1)
+
+
+def grow(chain, count, spacing, miner="miner"):
+    for _ in range(count):
+        assert chain.add_block(next_block(chain, [reward(chain, miner)], spacing))
+    return chain
+
+
+def sha256_rule():
+    return HashTargetRule(block_time=10, retarget_interval=4, initial_target=2 ** 250)
+
+
+def test_confirmed_transaction_is_not_confirmed_again():
+    chain = Blockchain()
+    transaction = Transaction("alice", {"n": 1}, 50, "bob", chain.last_block.timestamp + 1)
+    assert chain.add_block(next_block(chain, [transaction]))
+
+    assert not chain.add_block(next_block(chain, [transaction]))
+    assert chain.submit_transactions([transaction]) == [DUPLICATE]
+    assert chain.balance_of("alice") == 50
+
+
+def test_replay_rejected_after_reopening_the_store(tmp_path):
+    chain = Blockchain(store=BlockStore(str(tmp_path)))
+    transaction = Transaction("alice", {"n": 1}, 50, "bob", chain.last_block.timestamp + 1)
+    assert chain.add_block(next_block(chain, [transaction]))
+    chain.blocks.close()
+    chain.index.close()
+
+    reopened = Blockchain(store=BlockStore(str(tmp_path)))
+    assert not reopened.add_block(next_block(reopened, [transaction]))
+    assert reopened.submit_transactions([transaction]) == [DUPLICATE]
+    assert reopened.balance_of("alice") == 50
+    assert reopened.balance_of("bob") == 150
+    assert reopened.find_transaction(transaction.tx_id)[1] == 1
+
+
+def test_block_timestamps_are_bounded():
+    chain = grow(Blockchain(), 12, 10)
+    median = chain.median_time_past(chain.blocks)
+
+    assert not chain.add_block(next_block(chain, [reward(chain, "a")], timestamp=median))
+    assert not chain.add_block(next_block(chain, [reward(chain, "b")], timestamp=time() + MAX_FUTURE_BLOCK_TIME + 60))
+    assert not chain.add_block(next_block(chain, [reward(chain, "c")], timestamp=float("nan")))
+    assert chain.add_block(next_block(chain, [reward(chain, "d")], timestamp=median + 1))
+
+
+def test_reorganize_keeps_the_chain_with_more_work():
+    # Blocks a second apart make the target harder, blocks 1000 s apart make it easier
+    heavy = grow(Blockchain(rule=sha256_rule()), 8, 1, "heavy")
+    light = grow(Blockchain(rule=sha256_rule()), 11, 1000, "light")
+    assert len(light.blocks) > len(heavy.blocks)
+    assert light.chain_work(len(light.blocks) - 1) < heavy.chain_work(len(heavy.blocks) - 1)
+    heavy_tip = heavy.last_block.hash
+
+    assert not heavy.reorganize(1, list(light.blocks)[1:])
+    assert heavy.last_block.hash == heavy_tip
+    assert len(heavy.blocks) == 9
+
+    assert light.reorganize(1, list(heavy.blocks)[1:])
+    assert light.last_block.hash == heavy_tip
+
+
+def test_non_finite_amounts_are_rejected():
+    chain = Blockchain()
+    for amount in (float("nan"), float("inf"), -float("inf")):
+        with pytest.raises(ValueError):
+            Transaction("alice", {}, amount, "bob")
+        with pytest.raises(ValueError):
+            Block.from_dict(dict(next_block(chain, []).to_dict(), transactions=[
+                {"handle": "alice", "data": {}, "amount": amount, "destination": "bob", "timestamp": 1}
+            ]))
+
+    # A block relayed in the binary encoding, its amount patched to NaN after it was mined
+    transaction = Transaction("alice", {"n": 1}, 0.5, "bob", chain.last_block.timestamp + 1)
+    encoding = bytearray(next_block(chain, [transaction]).to_bytes())
+    amount_offset = encoding.index(struct.pack(">d", 0.5))
+    encoding[amount_offset:amount_offset + 8] = struct.pack(">d", float("nan"))
+    with pytest.raises(serialization.SerializationError):
+        Block.from_bytes(bytes(encoding), lazy=True)
+    with pytest.raises(ValueError):
+        check_blocks([bytes(encoding)])
+    assert len(chain.blocks) == 1
+
+
+def test_mempool_drops_transactions_a_peer_block_made_unaffordable():
+    chain, peer = Blockchain(), Blockchain()
+    timestamp = chain.last_block.timestamp + 1
+    spent_here = Transaction("alice", {"n": 1}, 80, "bob", timestamp)
+    spent_there = Transaction("alice", {"n": 2}, 60, "carol", timestamp)
+    assert chain.submit_transactions([spent_here]) == [ACCEPTED]
+
+    assert chain.accept_block(next_block(peer, [spent_there])) == CONNECTED
+    assert spent_here.tx_id not in chain.unconfimed_transaction
+    # The next template is valid, the node keeps mining
+    assert chain.add_block(next_block(chain, chain.block_template_transactions(10) + [reward(chain, "miner")]))
+
+
+def test_reorganization_returns_only_affordable_transactions_to_the_mempool():
+    chain, other = Blockchain(), Blockchain()
+    timestamp = chain.last_block.timestamp + 1
+    unaffordable = Transaction("alice", {"n": 1}, 80, "bob", timestamp)
+    affordable = Transaction("dave", {"n": 2}, 10, "erin", timestamp)
+    assert chain.add_block(next_block(chain, [unaffordable, affordable]))
+
+    branch = [next_block(other, [Transaction("alice", {"n": 3}, 60, "carol", timestamp)])]
+    assert other.add_block(branch[0])
+    branch.append(next_block(other, [reward(other, "miner")]))
+    assert chain.accept_block(branch[0]) == SIDE_CHAIN
+    assert chain.accept_block(branch[1]) == REORGANIZED
+
+    assert [transaction.tx_id for transaction in chain.unconfimed_transaction] == [affordable.tx_id]
+    assert chain.add_block(next_block(chain, chain.block_template_transactions(10)))
@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+from blockchain import Blockchain
+from blockstore import INDEX_ENTRY, INDEX_NAME, BlockStore
+from test_blockchain import grow
+
+
+@pytest.fixture
+def blocks():
+    return list(grow(Blockchain(), 8, 10).blocks)
+
+
+def fill(path, blocks, **kwargs):
+    store = BlockStore(path, **kwargs)
+    for block in blocks:
+        store.append(block)
+    return store
+
+
+def test_blocks_read_back_after_reopening(tmp_path, blocks):
+    # Small segments, so the blocks span several files
+    fill(str(tmp_path), blocks, segment_size=400).close()
+    assert len(os.listdir(str(tmp_path))) > 2
+
+    store = BlockStore(str(tmp_path), segment_size=400)
+    assert len(store) == len(blocks)
+    assert [block.hash for block in store] == [block.hash for block in blocks]
+    assert store.height_of(blocks[5].hash) == 5
+    assert store.get_by_hash(blocks[3].hash).hash == blocks[3].hash
+    store.close()
+
+
+def test_truncate_forgets_the_removed_blocks(tmp_path, blocks):
+    store = fill(str(tmp_path), blocks, segment_size=400)
+    del store[4:]
+    assert len(store) == 4
+    assert store.height_of(blocks[3].hash) == 3
+    assert all(store.height_of(block.hash) is None for block in blocks[4:])
+    with pytest.raises(IndexError):
+        store[4]
+
+    # The store appends after the cut, also once reopened
+    store.append(blocks[4])
+    store.close()
+    store = BlockStore(str(tmp_path), segment_size=400)
+    assert [block.hash for block in store] == [block.hash for block in blocks[:5]]
+    assert store.height_of(blocks[5].hash) is None
+    store.close()
+
+
+def test_torn_index_entry_is_dropped(tmp_path, blocks):
+    fill(str(tmp_path), blocks).close()
+    with open(os.path.join(str(tmp_path), INDEX_NAME), 'ab') as index_file:
+        index_file.write(b'\0' * (INDEX_ENTRY.size // 2))
+
+    store = BlockStore(str(tmp_path))
+    assert len(store) == len(blocks)
+    assert os.path.getsize(os.path.join(str(tmp_path), INDEX_NAME)) == len(blocks) * INDEX_ENTRY.size
+    store.close()
+
+
+def test_only_trailing_slices_can_be_deleted(tmp_path, blocks):
+    store = fill(str(tmp_path), blocks)
+    with pytest.raises(TypeError):
+        del store[2:4]
+    store.close()
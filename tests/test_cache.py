@@ -0,0 +1,74 @@
+from twisted.web.test.requesthelper import DummyRequest
+
+from cache import LRUCache, ResponseCache, etag_matches
+
+
+def request_with(if_none_match=None):
+    request = DummyRequest([b''])
+    if if_none_match is not None:
+        request.requestHeaders.setRawHeaders(b'If-None-Match', [if_none_match])
+    return request
+
+
+def test_lru_cache_drops_the_least_recently_used():
+    cache = LRUCache(10)
+    cache.put("a", b'aaaa')
+    cache.put("b", b'bbbb')
+    assert cache.get("a") == b'aaaa'
+    cache.put("c", b'cccc')
+    assert cache.get("b") is None
+    assert cache.get("a") == b'aaaa'
+    assert cache.size == 8
+
+    # Too large to be kept at all
+    cache.put("d", bytes(11))
+    assert cache.get("d") is None
+    assert len(cache) == 2
+
+
+def test_etag_matches_weakly_and_in_lists():
+    assert etag_matches(b'"x"', b'"x"')
+    assert etag_matches(b'W/"x"', b'"x"')
+    assert etag_matches(b'"y", "x"', b'"x"')
+    assert etag_matches(b'*', b'"x"')
+    assert not etag_matches(b'"y"', b'"x"')
+    assert not etag_matches(None, b'"x"')
+
+
+def test_answer_built_once_and_not_sent_again_to_a_current_client():
+    cache = ResponseCache(1024)
+    built = []
+
+    def build():
+        built.append(1)
+        return '{"answer": 1}'
+
+    first = request_with()
+    assert cache.respond(first, "chain", ("chain", "tip"), build) == b'{"answer": 1}'
+    etag = first.responseHeaders.getRawHeaders(b'ETag')[0]
+    assert cache.respond(request_with(), "chain", ("chain", "tip"), build) == b'{"answer": 1}'
+    assert len(built) == 1
+
+    current = request_with(etag)
+    assert cache.respond(current, "chain", ("chain", "tip"), build) == b''
+    assert current.responseCode == 304
+    assert cache.bytes_saved == {"chain": len(b'{"answer": 1}')}
+
+    # Another tip is another answer, with another ETag
+    stale = request_with(etag)
+    assert cache.respond(stale, "chain", ("chain", "next tip"), build) == b'{"answer": 1}'
+    assert stale.responseHeaders.getRawHeaders(b'ETag')[0] != etag
+    assert len(built) == 2
+    assert (cache.hits, cache.misses, cache.not_modified) == ({"chain": 1}, {"chain": 2}, {"chain": 1})
+
+
+def test_etags_differ_between_nodes_and_encodings():
+    key = ("chain", "tip")
+    assert ResponseCache(1024).etag(key) != ResponseCache(1024).etag(key)
+
+    cache = ResponseCache(1024)
+    plain, compressed = request_with(), request_with()
+    compressed.responseHeaders.setRawHeaders(b'Content-Encoding', [b'gzip'])
+    cache.lookup(plain, "chain", key)
+    cache.lookup(compressed, "chain", key)
+    assert plain.responseHeaders.getRawHeaders(b'ETag') != compressed.responseHeaders.getRawHeaders(b'ETag')
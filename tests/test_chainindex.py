@@ -0,0 +1,81 @@
+import pytest
+
+from blockchain import Blockchain
+from chainindex import ChainIndex
+from test_blockchain import next_block
+from transaction import Transaction
+
+
+@pytest.fixture
+def blocks():
+    """ Five blocks after the genesis, each with two payments from alice. """
+
+    chain = Blockchain()
+    for height in range(1, 6):
+        timestamp = chain.last_block.timestamp + 1
+        assert chain.add_block(next_block(chain, [
+            Transaction("alice", {"n": height}, 1, "bob", timestamp),
+            Transaction("alice", {"n": -height}, 1, "carol", timestamp),
+        ]))
+    return list(chain.blocks)
+
+
+def indexed(blocks, path=None):
+    index = ChainIndex(path)
+    index.catch_up(blocks)
+    return index
+
+
+def test_transaction_read_back_from_its_location(blocks):
+    index = indexed(blocks)
+    transaction = blocks[3].transactions[1]
+    height, position, offset, length = index.find_transaction(transaction.tx_id)
+    assert (height, position) == (3, 1)
+    assert Transaction.from_bytes(blocks[3].to_bytes()[offset:offset + length]).tx_id == transaction.tx_id
+    assert index.find_transaction("00" * 32) is None
+    assert index.find_transaction("not hex") is None
+
+
+def test_address_history_pages(blocks):
+    index = indexed(blocks)
+    entries, cursor = index.address_history("alice", limit=4)
+    assert [(height, position) for _, height, position, _, _ in entries] == [(1, 0), (1, 1), (2, 0), (2, 1)]
+    entries, cursor = index.address_history("alice", cursor, limit=10)
+    assert len(entries) == 6 and cursor is None
+    assert [height for _, height, _, _, _ in index.address_history("bob")[0]] == [1, 2, 3, 4, 5]
+    with pytest.raises(ValueError):
+        index.address_history("alice", "x")
+
+
+def test_truncate_forgets_the_removed_blocks(blocks):
+    index = indexed(blocks)
+    index.truncate(blocks, 3)
+    assert index.height == 2
+    assert index.find_transaction(blocks[3].transactions[0].tx_id) is None
+    assert index.find_transaction(blocks[2].transactions[0].tx_id) is not None
+    assert [height for _, height, _, _, _ in index.address_history("bob")[0]] == [1, 2]
+
+
+def test_reopened_index_catches_up(tmp_path, blocks):
+    path = str(tmp_path / "index.sqlite")
+    indexed(blocks[:3], path).close()
+
+    index = indexed(blocks, path)
+    assert index.height == 5
+    assert index.find_transaction(blocks[5].transactions[0].tx_id)[0] == 5
+    index.close()
+
+    # An index of another chain is rebuilt
+    other = Blockchain()
+    other.add_block(next_block(other, [], spacing=20))
+    index = indexed(list(other.blocks), path)
+    assert index.height == 1
+    assert index.find_transaction(blocks[1].transactions[0].tx_id) is None
+    index.close()
+
+
+def test_recent_transactions(blocks):
+    index = indexed(blocks)
+    recent = index.recent_transactions(4, blocks[2].transactions[0].timestamp)
+    assert set(recent) == {transaction.tx_id for block in blocks[3:5] for transaction in block.transactions}
+    assert recent[blocks[4].transactions[0].tx_id] == blocks[4].transactions[0].timestamp
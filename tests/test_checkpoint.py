@@ -0,0 +1,82 @@
+import pytest
+
+from blockchain import ACCEPTED, DUPLICATE, EXPIRED, TRANSACTION_EXPIRY, Blockchain
+from checkpoint import Checkpoint, CheckpointError
+from signatures import new_key
+from sync import CheckpointSync
+from test_blockchain import grow, next_block
+from transaction import Transaction
+
+
+def checkpoint_at_tip(chain):
+    height = len(chain.blocks) - 1
+    checkpoint = Checkpoint.from_chain(chain, height, dict(chain.balances))
+    return Checkpoint.decode(checkpoint.data, checkpoint.content_hash)
+
+
+def test_replay_rejected_below_the_checkpoint():
+    chain = Blockchain()
+    transaction = Transaction("alice", {"n": 1}, 50, "bob", chain.last_block.timestamp + 1)
+    assert chain.add_block(next_block(chain, [transaction]))
+    grow(chain, 3, 10)
+
+    started = Blockchain(checkpoint=checkpoint_at_tip(chain))
+    assert not started.add_block(next_block(started, [transaction]))
+    assert started.submit_transactions([transaction]) == [DUPLICATE]
+    assert started.balances == chain.balances
+
+
+def test_checkpoint_only_carries_unexpired_transactions():
+    chain = Blockchain()
+    old = Transaction("alice", {"n": 1}, 50, "bob", chain.last_block.timestamp + 1)
+    assert chain.add_block(next_block(chain, [old]))
+    # Blocks four hours apart move the median time past beyond the old transaction's expiry
+    grow(chain, 40, 4 * 60 * 60)
+    recent = Transaction("carol", {"n": 2}, 10, "dave", chain.last_block.timestamp + 1)
+    assert chain.add_block(next_block(chain, [recent]))
+
+    checkpoint = checkpoint_at_tip(chain)
+    assert recent.tx_id in checkpoint.transactions
+    assert old.tx_id not in checkpoint.transactions
+    assert len(checkpoint.transactions) < len(chain.blocks) // 2
+
+    started = Blockchain(checkpoint=checkpoint)
+    assert started.submit_transactions([old, recent]) == [EXPIRED, DUPLICATE]
+    assert not started.add_block(next_block(started, [old]))
+    assert not started.add_block(next_block(started, [recent]))
+    # A checkpoint of a chain started from one carries on the transactions that have not expired
+    grow(started, 3, 60)
+    assert recent.tx_id in checkpoint_at_tip(started).transactions
+
+
+def test_tampered_checkpoint_is_refused():
+    checkpoint = checkpoint_at_tip(grow(Blockchain(), 3, 10))
+    tampered = checkpoint.data.replace(b'"balances":{', b'"balances":{"mallory":1000000,')
+    with pytest.raises(CheckpointError):
+        Checkpoint.decode(tampered, checkpoint.content_hash)
+
+
+def test_unsigned_checkpoints_are_only_trusted_by_an_opted_in_quorum():
+    checkpoint = checkpoint_at_tip(grow(Blockchain(), 3, 10))
+    sources = ["a", "b", "c"]
+    assert not CheckpointSync(0).is_trusted(checkpoint.manifest(), sources)
+    assert CheckpointSync(0, quorum=3).is_trusted(checkpoint.manifest(), sources)
+    assert not CheckpointSync(0, quorum=4).is_trusted(checkpoint.manifest(), sources)
+
+    key, other_key = new_key(), new_key()
+    checkpoint.sign(key)
+    assert CheckpointSync(0, trusted_keys=[key.get_pubkey().hex()]).is_trusted(checkpoint.manifest(), sources[:1])
+    assert not CheckpointSync(0, trusted_keys=[other_key.get_pubkey().hex()]).is_trusted(checkpoint.manifest(), sources)
+    forged = dict(checkpoint.manifest(), content_hash="00" * 32)
+    assert not CheckpointSync(0, trusted_keys=[key.get_pubkey().hex()]).is_trusted(forged, sources)
+
+
+def test_transaction_expiry_is_measured_against_the_median_time_past():
+    chain = grow(Blockchain(), 12, 4 * 60 * 60)
+    median = chain.median_time_past(chain.blocks)
+    expired = Transaction("alice", {"n": 1}, 1, "bob", median - TRANSACTION_EXPIRY)
+    current = Transaction("alice", {"n": 2}, 1, "bob", median - TRANSACTION_EXPIRY + 1)
+
+    assert chain.submit_transactions([expired, current]) == [EXPIRED, ACCEPTED]
+    assert not chain.add_block(next_block(chain, [expired]))
+    assert chain.add_block(next_block(chain, [current]))
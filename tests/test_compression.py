@@ -0,0 +1,36 @@
+import zlib
+
+import pytest
+
+from compression import DecodingError, choose_encoding, compress, decompress
+
+
+def test_choose_encoding_follows_the_other_sides_preference():
+    assert choose_encoding(None) is None
+    assert choose_encoding(b'br') is None
+    assert choose_encoding(b'gzip, deflate') == b'gzip'
+    assert choose_encoding(b'deflate') == b'deflate'
+    assert choose_encoding(b'gzip;q=0.5, deflate;q=0.8') == b'deflate'
+    assert choose_encoding(b'gzip;q=0, *') == b'deflate'
+    assert choose_encoding(b'*;q=0') is None
+
+
+def test_round_trip():
+    data = b'{"Blocks": {}}' * 1000
+    for encoding in (b'gzip', b'deflate'):
+        compressed = compress(data, encoding, 3)
+        assert len(compressed) < len(data)
+        assert decompress(compressed, encoding) == data
+    assert decompress(data, b'identity') == data
+
+
+def test_bad_bodies_are_refused():
+    data = bytes(10000)
+    with pytest.raises(DecodingError):
+        decompress(compress(data, b'gzip', 3), b'gzip', max_size=1000)
+    with pytest.raises(DecodingError):
+        decompress(compress(data, b'gzip', 3)[:-10], b'gzip')
+    with pytest.raises(DecodingError):
+        decompress(b'not compressed', b'deflate')
+    with pytest.raises(DecodingError):
+        decompress(zlib.compress(data), b'br')
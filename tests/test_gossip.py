@@ -0,0 +1,155 @@
+import socket
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+from block import Block
+from blockchain import ACCEPTED, Blockchain
+from gossip import BLOCK_ITEM, SIGNED_TRANSACTION_ITEM, TRANSACTION_ITEM, encode_items
+from peopleschain import Node
+from signatures import address_of, encode_record, new_key, sign_transaction
+from transaction import Transaction
+
+
+def free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def signed_transactions(count, key_count=10):
+    """ Transactions from several keys, and the (public key, signature) of each. """
+
+    keys = [new_key() for _ in range(key_count)]
+    transactions = []
+    signatures = []
+    for n in range(count):
+        key = keys[n % key_count]
+        transaction = Transaction(address_of(key.get_pubkey()), {"n": n}, 1, "Network")
+        transactions.append(transaction)
+        signatures.append((key.get_pubkey(), sign_transaction(key, transaction)))
+    return transactions, signatures
+
+
+def received(node, kind):
+    return node.gossip.relayed.current().get((kind,), 0)
+
+
+class GossipNetworkTest(unittest.TestCase):
+    """ Nodes served by this reactor on loopback, each peering with its two neighbours of a ring. """
+
+    node_count = 6
+    timeout = 30
+
+    def setUp(self):
+        self.genesis = Blockchain().blocks[0]
+        ports = [free_port() for _ in range(self.node_count)]
+        addresses = ["127.0.0.1:{}".format(port) for port in ports]
+        self.nodes = []
+        for index, (port, address) in enumerate(zip(ports, addresses)):
+            seeds = [addresses[index - 1], addresses[(index + 1) % self.node_count]]
+            node = Node(address, Blockchain(blocks=[self.genesis]), seeds=seeds, own_address=address, port=port, serve=False)
+            listening = reactor.listenTCP(port, node.site(), interface="127.0.0.1")
+            self.addCleanup(listening.stopListening)
+            self.addCleanup(node.peer_client.close)
+            self.nodes.append(node)
+
+    def busy(self):
+        return any(node.gossip.waiting or node.gossip.flush_call is not None for node in self.nodes)
+
+    @defer.inlineCallbacks
+    def wait_until(self, condition):
+        while not condition():
+            yield task.deferLater(reactor, 0.01, lambda: None)
+        # Let the last announcements, of items every node already has, finish
+        quiet = 0
+        while quiet < 20:
+            quiet = 0 if self.busy() else quiet + 1
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+    @defer.inlineCallbacks
+    def test_transactions_reach_every_node_once(self):
+        transactions, signatures = signed_transactions(50)
+        origin = self.nodes[0]
+        self.assertEqual(origin.Peopleschain.submit_transactions(transactions, signatures), [ACCEPTED] * 50)
+        # Announced one by one, sent as one /inv per peer
+        for transaction in transactions:
+            origin.broadcast_transactions([transaction])
+
+        yield self.wait_until(lambda: all(
+            transaction.tx_id in node.Peopleschain.unconfimed_transaction
+            for node in self.nodes for transaction in transactions
+        ))
+        self.assertEqual(origin.gossip.inventories_sent.current(), {(): 2})
+        for node in self.nodes[1:]:
+            self.assertEqual(received(node, "transaction"), len(transactions))
+
+    @defer.inlineCallbacks
+    def test_block_reaches_every_node_once(self):
+        reward = Transaction("Network", {"message": "Block reward"}, 200, "miner", self.genesis.timestamp + 1)
+        block = Block(1, [reward], 9, self.genesis.hash, self.genesis.timestamp + 10)
+        origin = self.nodes[0]
+        origin.Peopleschain.accept_block(block)
+        origin.broadcast_block(block)
+
+        yield self.wait_until(lambda: all(node.Peopleschain.last_block.hash == block.hash for node in self.nodes))
+        for node in self.nodes[1:]:
+            self.assertEqual(received(node, "block"), 1)
+
+
+class FetchTest(unittest.TestCase):
+    """ A node fetching from a peer whose /getdata answers are scripted. """
+
+    def setUp(self):
+        self.node = Node("me", Blockchain(), seeds=[], own_address="127.0.0.1:1", port=1, serve=False)
+        self.answers = []
+        self.node.peer_client.request = lambda *args, **kwargs: defer.succeed(encode_items(self.answers.pop(0)))
+        self.node.gossip.announce = lambda *args, **kwargs: defer.succeed(None)
+
+    @defer.inlineCallbacks
+    def test_ids_a_peer_did_not_deliver_can_be_fetched_again(self):
+        gossip = self.node.gossip
+        genesis = self.node.Peopleschain.last_block
+        block = Block(1, [], 9, genesis.hash, genesis.timestamp + 10)
+        invalid = Block(1, [], 10, genesis.hash, genesis.timestamp + 10)
+        transactions, signatures = signed_transactions(1)
+        record = encode_record(transactions[0], *signatures[0])
+
+        # Another, invalid, block and no transaction, then nothing decodable
+        self.answers = [[(BLOCK_ITEM, invalid.to_bytes())], [(BLOCK_ITEM, b"junk")]]
+        for _ in range(2):
+            self.assertEqual(gossip.receive_inventory("peer", [block.hash], [transactions[0].tx_id]), {
+                "blocks": [block.hash], "transactions": [transactions[0].tx_id],
+            })
+            yield task.deferLater(reactor, 0.1, lambda: None)
+            self.assertNotIn(block.hash, gossip.seen)
+            self.assertNotIn(transactions[0].tx_id, gossip.seen)
+
+        self.answers = [[(BLOCK_ITEM, block.to_bytes()), (SIGNED_TRANSACTION_ITEM, record)]]
+        gossip.receive_inventory("peer", [block.hash], [transactions[0].tx_id])
+        yield task.deferLater(reactor, 0.1, lambda: None)
+        self.assertEqual(self.node.Peopleschain.last_block.hash, block.hash)
+        self.assertIn(transactions[0].tx_id, self.node.Peopleschain.unconfimed_transaction)
+        self.assertEqual(gossip.receive_inventory("peer", [block.hash], [transactions[0].tx_id]), {
+            "blocks": [], "transactions": [],
+        })
+
+
+def test_only_validly_signed_transactions_are_accepted():
+    node = Node("me", Blockchain(), seeds=[], own_address="127.0.0.1:1", port=1, serve=False)
+    key, other_key = new_key(), new_key()
+    forged = Transaction("victim", {"n": 1}, 5, "thief")
+    wrong_key = Transaction(address_of(key.get_pubkey()), {"n": 2}, 5, "Network")
+    signed = Transaction(address_of(key.get_pubkey()), {"n": 3}, 5, "Network")
+    items = [
+        (TRANSACTION_ITEM, forged.to_bytes()),
+        (SIGNED_TRANSACTION_ITEM, encode_record(wrong_key, other_key.get_pubkey(), sign_transaction(other_key, wrong_key))),
+        (SIGNED_TRANSACTION_ITEM, encode_record(signed, key.get_pubkey(), sign_transaction(key, signed))),
+        (SIGNED_TRANSACTION_ITEM, b"truncated"),
+    ]
+
+    relay_blocks, orphans, relay_transactions = node.gossip.accept_items("peer", items)
+    assert relay_transactions == [signed.tx_id]
+    assert [transaction.tx_id for transaction in node.Peopleschain.unconfimed_transaction] == [signed.tx_id]
+    # Served to peers with its signature
+    assert node.gossip.get_data([], [signed.tx_id])[:1] == bytes([SIGNED_TRANSACTION_ITEM])
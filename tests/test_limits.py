@@ -0,0 +1,36 @@
+import json
+
+import pytest
+from twisted.internet import defer
+from twisted.web.test.requesthelper import DummyRequest
+
+from limits import ConcurrencyLimit, parse_limits
+
+
+def test_parse_limits():
+    assert parse_limits("") == {}
+    assert parse_limits("mine=1/4, chain=8/32") == {"mine": (1, 4), "chain": (8, 32)}
+    with pytest.raises(ValueError):
+        parse_limits("mine=1")
+
+
+def test_requests_over_the_queue_are_turned_away():
+    limit = ConcurrencyLimit(1, 1, retry_after=3)
+    work = [defer.Deferred() for _ in range(3)]
+    answers = [limit.run(DummyRequest([b'']), lambda d=d: d) for d in work[:2]]
+    assert limit.to_dict()["running"] == 1 and limit.waiting == 1
+
+    rejected_request = DummyRequest([b''])
+    rejected = limit.run(rejected_request, lambda: work[2])
+    assert rejected_request.responseCode == 503
+    assert rejected_request.responseHeaders.getRawHeaders(b'Retry-After') == [b'3']
+    assert "retry in 3 s" in json.loads(rejected.result)["message"]
+    assert limit.rejected == 1
+
+    # The waiting request runs once the first one finishes
+    work[0].callback("first")
+    assert answers[0].result == "first"
+    assert limit.running == 1 and limit.waiting == 0
+    work[1].callback("second")
+    assert answers[1].result == "second"
+    assert limit.running == 0
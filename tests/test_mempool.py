@@ -0,0 +1,45 @@
+from mempool import Mempool
+from transaction import Transaction
+
+
+def transaction(handle, amount, n=0):
+    return Transaction(handle, {"n": n}, amount, "Network", 1000 + n)
+
+
+def test_select_orders_by_amount_then_arrival():
+    mempool = Mempool()
+    low, first, second, high = transaction("a", 1), transaction("b", 5, 1), transaction("c", 5, 2), transaction("d", 9)
+    for each in (low, first, second, high):
+        assert mempool.add(each)
+
+    assert mempool.select(3) == [high, first, second]
+    # Selecting leaves them in the pool, popping does not
+    assert len(mempool) == 4
+    assert mempool.pop() == high
+    assert high.tx_id not in mempool
+
+
+def test_full_pool_evicts_the_lowest_paying_transaction():
+    mempool = Mempool(max_size=2)
+    low, middle = transaction("a", 1), transaction("b", 5)
+    mempool.add(low, ("key", "signature"))
+    mempool.add(middle)
+
+    assert not mempool.add(transaction("c", 1))
+    assert mempool.add(transaction("d", 7))
+    assert low.tx_id not in mempool
+    assert mempool.signature(low.tx_id) is None
+    assert mempool.from_sender("a") == []
+
+
+def test_removed_transactions_leave_the_heaps():
+    mempool = Mempool()
+    transactions = [transaction("a", amount, amount) for amount in range(200)]
+    for each in transactions:
+        mempool.add(each)
+    mempool.remove_confirmed(transactions[:190])
+
+    assert len(mempool.best) <= 2 * len(mempool) + 64
+    assert mempool.select(20) == transactions[:189:-1]
+    assert mempool.from_sender("a") == transactions[190:]
+    assert not mempool.add(transactions[195])
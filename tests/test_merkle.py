@@ -0,0 +1,50 @@
+import hashlib
+
+import pytest
+
+import serialization
+from block import Block
+from merkle import EMPTY_ROOT, MutatedTree, merkle_branch, merkle_root, verify_branch
+from transaction import Transaction
+
+
+def tx_ids(count):
+    return [hashlib.sha256(bytes([n])).hexdigest() for n in range(count)]
+
+
+def test_every_branch_leads_to_the_root():
+    assert merkle_root([]) == EMPTY_ROOT
+    for count in range(1, 12):
+        ids = tx_ids(count)
+        root = merkle_root(ids).hex()
+        for position, tx_id in enumerate(ids):
+            assert verify_branch(tx_id, merkle_branch(ids, position), root)
+        assert not verify_branch(tx_ids(count + 1)[-1], merkle_branch(ids, 0), root)
+
+
+def test_duplicated_nodes_are_rejected():
+    a, b, c, d, e, f = tx_ids(6)
+    with pytest.raises(MutatedTree):
+        merkle_root([a, b, c, c])
+    with pytest.raises(MutatedTree):
+        merkle_root([a, c, b, c])
+    # Two equal subtrees
+    with pytest.raises(MutatedTree):
+        merkle_root([a, b, c, d, e, f, e, f])
+
+
+def test_block_with_a_duplicated_last_transaction_does_not_decode():
+    transactions = [Transaction("alice", {"n": n}, 1, "bob", 1000) for n in range(3)]
+    block = Block(1, transactions, 7, "ab" * 32, 1000)
+    # The encoding of [a, b, c, c] under the header of [a, b, c]
+    repeated = transactions[-1].to_bytes()
+    mutated = bytearray(block.to_bytes())
+    count_offset = serialization.BLOCK_HEADER.size
+    mutated[count_offset:count_offset + serialization.LENGTH.size] = serialization.LENGTH.pack(4)
+    mutated += serialization.LENGTH.pack(len(repeated)) + repeated
+
+    with pytest.raises(ValueError):
+        Block.from_bytes(bytes(mutated))
+    with pytest.raises(ValueError):
+        Block.from_dict(dict(block.to_dict(), transactions=[t.to_dict() for t in transactions + transactions[-1:]]))
+    assert Block.from_bytes(block.to_bytes()).hash == block.hash
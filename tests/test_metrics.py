@@ -0,0 +1,44 @@
+import pytest
+
+from metrics import Registry
+
+
+def test_counters_and_gauges_render_in_the_text_format():
+    registry = Registry()
+    requests = registry.counter("requests_total", "Requests served", ("route",))
+    requests.inc(route="chain")
+    requests.inc(2, route="chain")
+    requests.inc(route='say "hi"')
+    registry.gauge("mempool_size", "Unconfirmed transactions", function=lambda: 7)
+
+    assert registry.render().splitlines() == [
+        "# HELP mempool_size Unconfirmed transactions",
+        "# TYPE mempool_size gauge",
+        "mempool_size 7.0",
+        "# HELP requests_total Requests served",
+        "# TYPE requests_total counter",
+        'requests_total{route="chain"} 3.0',
+        'requests_total{route="say \\"hi\\""} 1.0',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Registry().histogram("latency_seconds", "Latency", buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value)
+
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_count 4",
+        "latency_seconds_sum 6.25",
+    ]
+
+
+def test_registering_a_name_again():
+    registry = Registry()
+    counter = registry.counter("blocks_total", "Blocks", ("result",))
+    assert registry.counter("blocks_total", "Blocks", ("result",)) is counter
+    with pytest.raises(ValueError):
+        registry.gauge("blocks_total", "Blocks", ("result",))
@@ -0,0 +1,51 @@
+from twisted.internet import defer
+
+from peers import PeerManager, listed_nodes
+
+
+class FakeClient:
+    """ Answers /nodes from a table, peers missing from it fail. """
+
+    timeout = 1
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.asked = []
+
+    def get_json(self, node, url):
+        self.asked.append(node)
+        if node not in self.answers:
+            return defer.fail(ConnectionRefusedError(node))
+        return defer.succeed(self.answers[node])
+
+
+def test_listed_nodes_only_accepts_lists_of_addresses():
+    assert listed_nodes({"full_nodes": ["a", "b"]}) == ["a", "b"]
+    assert listed_nodes({"full_nodes": ["a", 1]}) is None
+    assert listed_nodes({"full_nodes": "a"}) is None
+    assert listed_nodes(["a"]) is None
+
+
+def test_refresh_learns_peers_and_drops_unreachable_ones():
+    client = FakeClient({"a": {"full_nodes": ["b", "me"]}, "b": {"full_nodes": []}})
+    peers = PeerManager(["a", "down", "me"], 5000, client, own_address="me", max_failures=2)
+    assert set(peers) == {"a", "down"}
+
+    peers.refresh()
+    assert set(peers) == {"a", "b", "down"}
+    assert peers.peers["a"].last_seen is not None
+    assert peers.snapshot()[-1] == "down"
+
+    peers.refresh()
+    assert set(peers) == {"a", "b"}
+    assert client.asked.count("down") == 2
+
+
+def test_a_success_resets_the_failure_count():
+    peers = PeerManager(["a"], 5000, FakeClient({}), own_address="me", max_failures=2)
+    peers.mark_failure(["a"])
+    peers.mark_success(["a"])
+    peers.mark_failure(["a"])
+    assert "a" in peers
+    peers.mark_failure(["a"])
+    assert "a" not in peers
@@ -0,0 +1,65 @@
+from twisted.internet import reactor
+from twisted.trial import unittest
+
+from blockchain import Blockchain
+from network import PeerClient
+from peopleschain import Node
+from test_blockchain import grow
+from test_gossip import free_port
+
+
+class NodeTest(unittest.TestCase):
+    """ A node served by this reactor on loopback, asked through a PeerClient. """
+
+    timeout = 30
+
+    def setUp(self):
+        port = free_port()
+        self.url = "http://127.0.0.1:{}".format(port)
+        self.chain = grow(Blockchain(), 6, 10, "local")
+        self.node = Node("local", self.chain, seeds=[], own_address="127.0.0.1:{}".format(port), port=port, serve=False)
+        listening = reactor.listenTCP(port, self.node.site(), interface="127.0.0.1")
+        self.addCleanup(listening.stopListening)
+        self.addCleanup(self.node.peer_client.close)
+        self.client = PeerClient()
+        self.addCleanup(self.client.close)
+
+    def get(self, path, client=None):
+        return (client or self.client).get_json("local", self.url + path)
+
+    def test_chain_streamed_during_a_reorganization_is_one_chain(self):
+        original = list(self.chain.blocks)
+        fork = grow(Blockchain(), 9, 10, "fork")
+        block_fragment = self.node.block_fragment
+
+        def reorganizing_fragment(block):
+            # The chain switches to the fork once the first block has been written
+            if self.chain.last_block.hash == original[-1].hash:
+                self.assertTrue(self.chain.reorganize(1, list(fork.blocks)[1:]))
+            return block_fragment(block)
+
+        self.node.block_fragment = reorganizing_fragment
+        d = self.get("/chain?from_height=0")
+
+        def check(response):
+            blocks = response["Blocks"]
+            self.assertEqual(len(blocks), len(original))
+            for height in range(1, len(original)):
+                self.assertEqual(blocks[str(height)]["previous_hash"], original[height - 1].hash)
+            self.assertEqual(self.chain.last_block.hash, fork.last_block.hash)
+        return d.addCallback(check)
+
+    def test_compressed_answers_decode_to_the_same_chain(self):
+        compressing_client = PeerClient(compression_level=3)
+        self.addCleanup(compressing_client.close)
+        plain = self.get("/chain")
+
+        def get_compressed(plain_answer):
+            return self.get("/chain", compressing_client).addCallback(lambda answer: (plain_answer, answer))
+
+        def check(answers):
+            plain_answer, compressed_answer = answers
+            self.assertEqual(compressed_answer, plain_answer)
+            # The node advertised what it accepts, later request bodies are compressed
+            self.assertEqual(compressing_client.request_encodings["local"], b'gzip')
+        return plain.addCallback(get_compressed).addCallback(check)
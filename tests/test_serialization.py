@@ -0,0 +1,70 @@
+import hashlib
+
+import pytest
+
+import serialization
+from block import Block
+from transaction import Transaction
+
+
+def transactions():
+    return [
+        Transaction("alice", {"name": "Ålice", "tags": [1, 2]}, 50, "bob", 1000.5),
+        Transaction("bob", {}, 0.25, None, 1001),
+    ]
+
+
+def test_transaction_round_trip():
+    for transaction in transactions():
+        for lazy in (False, True):
+            decoded = Transaction.from_bytes(transaction.to_bytes(), lazy=lazy)
+            assert decoded.tx_id == transaction.tx_id
+            assert decoded.to_dict() == transaction.to_dict()
+            assert type(decoded.amount) is type(transaction.amount)
+
+
+def test_transaction_data_is_encoded_canonically():
+    first = Transaction("alice", {"a": 1, "b": 2}, 1, "bob", 1000)
+    second = Transaction("alice", {"b": 2, "a": 1}, 1, "bob", 1000)
+    assert first.to_bytes() == second.to_bytes()
+    assert first.tx_id == second.tx_id
+
+
+def test_block_round_trip_keeps_its_hash():
+    block = Block(1, transactions(), 42, "ab" * 32, 1002)
+    decoded = Block.from_bytes(block.to_bytes())
+    assert decoded.hash == block.hash
+    assert decoded.to_dict() == block.to_dict()
+    assert Block.hash_header(block.header_dict()) == block.hash
+
+    prefix, suffix = block.proof_template()
+    assert hashlib.sha256(prefix + Block.encode_proof(42) + suffix).hexdigest() == block.hash
+
+
+def test_genesis_previous_hash_round_trip():
+    block = Block(0, [], 100, 0, 1000)
+    assert Block.from_bytes(block.to_bytes()).previous_hash == 0
+
+
+def test_malformed_encodings_are_refused():
+    transaction = transactions()[0]
+    encoding = transaction.to_bytes()
+    with pytest.raises(serialization.SerializationError):
+        Transaction.from_bytes(encoding[:-1])
+    with pytest.raises(serialization.SerializationError):
+        Transaction.from_bytes(b'\x09' + encoding[1:])
+
+    block = Block(1, transactions(), 42, "ab" * 32, 1002)
+    # The Merkle root no longer matches once a transaction is swapped out
+    other = Transaction("carol", {}, 1, "dave", 1000)
+    forged = block.encode_header(block.merkle_root) + Block(1, [other], 42, "ab" * 32, 1002).encode_body()
+    with pytest.raises(serialization.SerializationError):
+        Block.from_bytes(forged)
+
+
+def test_records_round_trip():
+    payloads = [b'', b'one', bytes(300)]
+    content = serialization.encode_records(payloads)
+    assert serialization.decode_records(content) == payloads
+    with pytest.raises(serialization.SerializationError):
+        serialization.decode_records(content[:-1])
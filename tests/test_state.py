@@ -0,0 +1,44 @@
+from blockchain import Blockchain
+from state import INITIAL_BALANCE, AccountState
+from test_blockchain import grow
+
+
+def applied(state, blocks):
+    for block in blocks:
+        state.apply_block(block)
+    return state
+
+
+def test_rollback_replays_from_the_last_snapshot_below():
+    blocks = list(grow(Blockchain(), 9, 10).blocks)
+    state = applied(AccountState(snapshot_interval=3), blocks)
+    assert state.balance("miner") == INITIAL_BALANCE + 9
+
+    # Snapshot at height 3, blocks 4 and 5 are replayed
+    assert state.rollback(blocks, 6) == 2
+    assert state.height == 5
+    assert state.balances == applied(AccountState(), blocks[:6]).balances
+    assert state.snapshot_heights() == [3]
+
+
+def test_reopened_state_loads_the_last_snapshot_on_disk(tmp_path):
+    blocks = list(grow(Blockchain(), 9, 10).blocks)
+    applied(AccountState(str(tmp_path), snapshot_interval=4, keep_snapshots=2), blocks)
+
+    state = AccountState(str(tmp_path), snapshot_interval=4, keep_snapshots=2)
+    assert state.snapshot_heights() == [8, 4]
+    assert state.load(blocks) == 1
+    assert state.balance("miner") == INITIAL_BALANCE + 9
+
+
+def test_snapshots_of_a_replaced_fork_are_dropped():
+    blocks = list(grow(Blockchain(), 9, 10).blocks)
+    fork = blocks[:4] + list(grow(Blockchain(blocks=blocks[:4]), 6, 20, "other").blocks)[4:]
+    state = applied(AccountState(snapshot_interval=3), blocks)
+
+    # The snapshot at height 6 is of the old chain, the one at 3 is shared
+    assert state.rollback(fork, 8) == 4
+    assert state.snapshot_heights() == [6, 3]
+    assert state.snapshots[6][0] == fork[6].hash
+    assert state.balances == applied(AccountState(), fork[:8]).balances
+    assert state.balance("other") == INITIAL_BALANCE + 4
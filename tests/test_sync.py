@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from blockchain import Blockchain
+from network import peer_url
+from sync import TIP_URL, ChainSync, SyncError
+from test_blockchain import grow, sha256_rule
+
+
+class InProcessSync(ChainSync):
+    """ ChainSync against chains of this process, the peers are their names. """
+
+    def __init__(self, blockchain, peers, executor):
+        super().__init__(blockchain, 0, executor=executor)
+        self.peers = peers
+
+    def get_json(self, url, params=None):
+        node = url.split("//")[1].split(":")[0]
+        chain = self.peers[node]
+        if url == peer_url(TIP_URL, node, self.port):
+            last_block, chain_work = chain.tip()
+            return {"height": last_block.index, "hash": last_block.hash, "chain_work": chain_work}
+        stop = min(params["from"] + params["count"], len(chain.blocks))
+        return {"headers": [chain.blocks[height].header_dict() for height in range(params["from"], stop)]}
+
+    def fetch_blocks(self, node, from_height, to_height):
+        return [self.peers[node].encoded_block(height) for height in range(from_height, to_height + 1)]
+
+
+class BrokenHeaders(InProcessSync):
+    """ The peer "broken" advertises the most work but answers header requests with garbage. """
+
+    def get_json(self, url, params=None):
+        node = url.split("//")[1].split(":")[0]
+        if node == "broken":
+            if url == peer_url(TIP_URL, node, self.port):
+                return {"height": 100, "hash": "f" * 64, "chain_work": 2 ** 64}
+            return {"headers": [{"index": "garbage"}]}
+        return super().get_json(url, params)
+
+
+def test_sync_follows_the_most_work_not_the_longest_chain():
+    heavy = grow(Blockchain(rule=sha256_rule()), 8, 1, "heavy")
+    light = grow(Blockchain(rule=sha256_rule()), 11, 1000, "light")
+    peers = {"heavy": heavy, "light": light}
+
+    with ThreadPoolExecutor(1) as executor:
+        local = Blockchain(blocks=list(heavy.blocks), rule=sha256_rule())
+        assert InProcessSync(local, peers, executor).run(["light"]) is None
+        assert local.last_block.hash == heavy.last_block.hash
+
+        local = Blockchain(blocks=list(light.blocks), rule=sha256_rule())
+        assert InProcessSync(local, peers, executor).run(["light", "heavy"]) == "heavy"
+        assert local.last_block.hash == heavy.last_block.hash
+
+
+def test_sync_moves_on_from_a_peer_with_malformed_headers():
+    source = grow(Blockchain(), 5, 10)
+    with ThreadPoolExecutor(1) as executor:
+        local = Blockchain()
+        chain_sync = BrokenHeaders(local, {"good": source}, executor)
+        assert chain_sync.run(["broken", "good"]) == "good"
+        assert chain_sync.bad_nodes == {"broken"}
+        assert local.last_block.hash == source.last_block.hash
+
+
+def test_sync_error_when_every_peer_fails():
+    with ThreadPoolExecutor(1) as executor:
+        chain_sync = BrokenHeaders(Blockchain(), {}, executor)
+        with pytest.raises(SyncError):
+            chain_sync.run(["broken"])
+        assert chain_sync.bad_nodes == {"broken"}
@@ -2,7 +2,17 @@ import hashlib
 from time import time
 import json
 
+import serialization
+
 class Transaction:
+    """
+        A transaction is immutable once created: its id is the hash of its fields.
+        Slots instead of a __dict__ keep the per-transaction overhead low when the
+        whole chain is held in memory, and data is only kept in its encoded form,
+        decoded on access.
+    """
+
+    __slots__ = ('handle', 'amount', 'timestamp', 'destination', 'tx_id', '_bytes')
 
     def __init__(self, handle, data, amount, destination, timestamp=None):
         """
@@ -15,15 +25,33 @@ class Transaction:
 
         """
 
-        self.handle = handle
-        self.data = data
-        self.amount = amount
-        if timestamp is None:
-            self.timestamp = time()
-        else:
-            self.timestamp = timestamp
-        self.destination = destination
-        self.tx_id = self.calculate_tx_id()
+        set_field = object.__setattr__
+        set_field(self, 'handle', handle)
+        set_field(self, 'amount', amount)
+        set_field(self, 'timestamp', time() if timestamp is None else timestamp)
+        set_field(self, 'destination', destination)
+        # Canonical bytes, encoded once and reused for the id, blocks, storage and the wire
+        set_field(self, '_bytes', self.pack(handle, data, amount, destination, self.timestamp))
+        set_field(self, 'tx_id', hashlib.sha256(self._bytes).hexdigest())
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Transaction {} is immutable".format(self.tx_id))
+
+    def __delattr__(self, name):
+        raise AttributeError("Transaction {} is immutable".format(self.tx_id))
+
+    def __setstate__(self, state):
+        # Unpickling, e.g. results of the validation process pool
+        _, fields = state
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    @property
+    def data(self):
+        """ A fresh copy of the data, decoded from the end of the encoding. """
+
+        data_length = serialization.TRANSACTION_HEADER.unpack_from(self._bytes)[-1]
+        return json.loads(self._bytes[len(self._bytes) - data_length:])
 
     def calculate_tx_id(self):
         """
@@ -31,26 +59,107 @@ class Transaction:
 
         """
 
-        data_to_json = {
+        hash_object = hashlib.sha256(self.encode())
+        return hash_object.hexdigest()
+
+    def encode(self):
+        """ Binary encoding of the transaction, see serialization.py """
+        return self.pack(self.handle, self.data, self.amount, self.destination, self.timestamp)
+
+    @staticmethod
+    def pack(handle, data, amount, destination, timestamp):
+        handle = handle.encode('utf-8')
+        encoded_destination = b'' if destination is None else destination.encode('utf-8')
+        data = serialization.canonical_json(data)
+        amount_kind, amount = serialization.pack_amount(amount)
+        header = serialization.TRANSACTION_HEADER.pack(
+            serialization.VERSION,
+            timestamp,
+            amount_kind,
+            amount,
+            len(handle),
+            serialization.NO_STRING if destination is None else len(encoded_destination),
+            len(data)
+        )
+        return b''.join((header, handle, encoded_destination, data))
+
+    def to_bytes(self):
+        return self._bytes
+
+    @classmethod
+    def from_bytes(cls, buffer, lazy=False):
+        """
+            Rebuild a transaction from its binary encoding.
+
+            :param buffer: <bytes> Output of to_bytes
+            :param lazy: <bool> Keep the encoding as it is, the data is neither decoded nor
+                checked to be canonical JSON until it is read. The id is then only right for
+                a canonical encoding, the caller checks it with calculate_tx_id.
+        """
+
+        serialization.check_version(buffer)
+        _, timestamp, amount_kind, amount, handle_length, destination_length, data_length = \
+            serialization.TRANSACTION_HEADER.unpack_from(buffer)
+
+        offset = serialization.TRANSACTION_HEADER.size
+        handle = bytes(buffer[offset:offset + handle_length]).decode('utf-8')
+        offset += handle_length
+        destination = None
+        if destination_length != serialization.NO_STRING:
+            destination = bytes(buffer[offset:offset + destination_length]).decode('utf-8')
+            offset += destination_length
+        if offset + data_length != len(buffer):
+            raise serialization.SerializationError("Transaction length does not match its fields")
+        amount = serialization.unpack_amount(amount_kind, amount)
+
+        if not lazy:
+            data = json.loads(bytes(buffer[offset:offset + data_length]))
+            return cls(handle, data, amount, destination, timestamp)
+
+        transaction = cls.__new__(cls)
+        set_field = object.__setattr__
+        set_field(transaction, 'handle', handle)
+        set_field(transaction, 'amount', amount)
+        set_field(transaction, 'timestamp', timestamp)
+        set_field(transaction, 'destination', destination)
+        set_field(transaction, '_bytes', bytes(buffer))
+        set_field(transaction, 'tx_id', hashlib.sha256(transaction._bytes).hexdigest())
+        return transaction
+
+    def to_dict(self):
+        return {
             "handle": self.handle,
             "data": self.data,
             "amount": self.amount,
-            "time": self.timestamp,
-            "destination": self.destination or 0,
+            "timestamp": self.timestamp,
+            "destination": self.destination,
+            "tx_id": self.tx_id,
         }
 
-        data_json = json.dumps(data_to_json, sort_keys=True)
-        hash_object = hashlib.sha256(data_json.encode('utf-8'))
-        return hash_object.hexdigest()
+    @classmethod
+    def from_dict(cls, transaction_dict):
+        """
+            Rebuild a transaction from the dictionary produced by to_dict or toJSON.
+
+            :param transaction_dict: <dict> Decoded transaction
+        """
+
+        return cls(
+            transaction_dict["handle"],
+            transaction_dict["data"],
+            transaction_dict["amount"],
+            transaction_dict["destination"],
+            transaction_dict["timestamp"]
+        )
 
     def toJSON(self):
-        return json.dumps(self, default=lambda o: {key: value for key, value in o.__dict__.items()}, sort_keys=True)
+        return json.dumps(self.to_dict(), sort_keys=True)
 
     def __repr__(self):
         return "<Transaction {}>".format(self.tx_id)
 
     def __str__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
 
 if __name__ == '__main__':
     pass